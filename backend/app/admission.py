@@ -0,0 +1,177 @@
+import os
+import math
+import time
+import logging
+import threading
+from typing import Dict, Optional
+
+from .utils import get_page_count, get_page_pixels
+
+logger = logging.getLogger(__name__)
+
+# Decoded megapixels (pages x pixels) the OCR endpoints may hold in flight together
+ADMISSION_MAX_MEGAPIXELS = float(os.getenv("ADMISSION_MAX_MEGAPIXELS", "120"))
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "true").lower() == "true"
+# Throughput assumed for Retry-After until requests have been timed
+ADMISSION_INITIAL_MEGAPIXELS_PER_SECOND = float(os.getenv("ADMISSION_INITIAL_MEGAPIXELS_PER_SECOND", "2"))
+RETRY_AFTER_MIN_SECONDS = 1
+RETRY_AFTER_MAX_SECONDS = 120
+
+# US Letter at 200 dpi, for files whose page size cannot be read
+_DEFAULT_PAGE_PIXELS = 1700 * 2200
+# Extra time a rejected client is expected back within
+_WAITING_GRACE_SECONDS = 5
+# Weight of the newest request in the throughput average
+_THROUGHPUT_SMOOTHING = 0.2
+# Requests that end sooner than this (rejected uploads, cache hits) did no measurable OCR
+_MIN_TIMED_SECONDS = 0.5
+
+
+def estimate_cost(file_path: str, pages: Optional[int] = None) -> float:
+    """
+    Estimated cost of OCR'ing a document in megapixels: pages x decoded pixels
+    of the first page, from file headers only.
+
+    Args:
+        file_path: PDF, TIFF or image file
+        pages: Pages that will be processed (default: all of them)
+    """
+    try:
+        page_pixels = get_page_pixels(file_path)
+        total_pages = get_page_count(file_path)
+    except Exception as e:
+        logger.warning(f"Could not size {file_path} for admission: {e}")
+        page_pixels, total_pages = _DEFAULT_PAGE_PIXELS, 1
+    pages = min(pages, total_pages) if pages else total_pages
+    return max(1, pages) * page_pixels / 1e6
+
+
+class Rejected(Exception):
+    """Raised when a request does not fit; retry_after is the suggested wait in seconds."""
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class Ticket:
+    """Admitted work; release() (idempotent) returns its cost to the budget."""
+
+    def __init__(self, controller: "AdmissionController", client: str, cost: float):
+        self.client = client
+        self.cost = cost
+        self.started = time.time()
+        self._controller = controller
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self._controller._release(self)
+
+
+class AdmissionController:
+    """
+    Bounds the OCR work in flight by estimated cost and shares it fairly between clients.
+
+    A request is admitted only if it fits in the remaining budget. A client
+    that already has work in flight gets more only within an equal share of
+    the budget, counting clients with work in flight or recently turned away,
+    so one client keeping the budget full cannot lock out another waiting to
+    retry. Requests larger than the whole budget run only when nothing else
+    does. Rejections carry a Retry-After estimated from measured throughput,
+    so latency under overload grows with the backlog instead of every request
+    slowing down together.
+    """
+
+    def __init__(self, max_megapixels: float = ADMISSION_MAX_MEGAPIXELS, enabled: bool = ADMISSION_ENABLED):
+        self.max_cost = max_megapixels
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._in_flight: Dict[str, float] = {}
+        # Rejected clients count towards fair shares until their Retry-After (plus grace) has passed
+        self._waiting: Dict[str, float] = {}
+        self._total = 0.0
+        self._running = 0
+        self._throughput = ADMISSION_INITIAL_MEGAPIXELS_PER_SECOND
+        self._admitted = 0
+        self._rejected = 0
+
+    def _retry_after(self, excess: float) -> int:
+        seconds = math.ceil(excess / max(self._throughput, 1e-3))
+        return int(min(RETRY_AFTER_MAX_SECONDS, max(RETRY_AFTER_MIN_SECONDS, seconds)))
+
+    def _reject(self, client: str, reason: str, excess: float) -> Rejected:
+        self._rejected += 1
+        retry_after = self._retry_after(excess)
+        self._waiting[client] = time.time() + retry_after + _WAITING_GRACE_SECONDS
+        return Rejected(reason, retry_after)
+
+    def admit(self, client: str, cost: float) -> Ticket:
+        """
+        Reserve cost for client.
+
+        Raises:
+            Rejected: when the budget or the client's fair share is exhausted
+        """
+        with self._lock:
+            if not self.enabled:
+                return Ticket(self, client, 0.0)
+            # Oversized requests are charged the whole budget and so run alone
+            cost = min(cost, self.max_cost)
+            now = time.time()
+            self._waiting = {c: expires for c, expires in self._waiting.items() if expires > now}
+            held = self._in_flight.get(client, 0.0)
+            active = len(set(self._in_flight) | set(self._waiting) | {client})
+            share = self.max_cost / active
+
+            # Every client may run one request that fits the budget; more only within its share
+            if held > 0 and active > 1 and held + cost > share:
+                logger.info(f"Admission: rejected {cost:.1f} MP from {client} "
+                            f"(holds {held:.1f} MP, fair share {share:.1f} MP)")
+                raise self._reject(client, "Client is over its fair share of OCR capacity", held + cost - share)
+            if self._total + cost > self.max_cost:
+                logger.info(f"Admission: rejected {cost:.1f} MP from {client} "
+                            f"({self._total:.1f}/{self.max_cost:.0f} MP in flight)")
+                raise self._reject(client, "OCR capacity saturated", self._total + cost - self.max_cost)
+
+            self._waiting.pop(client, None)
+            self._in_flight[client] = held + cost
+            self._total += cost
+            self._running += 1
+            self._admitted += 1
+            return Ticket(self, client, cost)
+
+    def _release(self, ticket: Ticket):
+        if ticket.cost <= 0:
+            return
+        elapsed = time.time() - ticket.started
+        with self._lock:
+            remaining = self._in_flight.get(ticket.client, 0.0) - ticket.cost
+            if remaining > 1e-9:
+                self._in_flight[ticket.client] = remaining
+            else:
+                self._in_flight.pop(ticket.client, None)
+            self._total = max(0.0, self._total - ticket.cost)
+            if elapsed >= _MIN_TIMED_SECONDS:
+                # Requests running side by side drain the budget together
+                rate = ticket.cost / elapsed * self._running
+                self._throughput += _THROUGHPUT_SMOOTHING * (rate - self._throughput)
+            self._running = max(0, self._running - 1)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "max_megapixels": self.max_cost,
+                "in_flight_megapixels": round(self._total, 2),
+                "clients": len(self._in_flight),
+                "waiting_clients": len(self._waiting),
+                "megapixels_per_second": round(self._throughput, 2),
+                "admitted": self._admitted,
+                "rejected": self._rejected,
+            }
+
+
+controller = AdmissionController()
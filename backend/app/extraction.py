@@ -1,6 +1,6 @@
 import os
 import re
-from typing import Dict, List
+from typing import Dict, List, Optional
 from PIL import Image, ImageDraw, ImageFont
 import cv2
 import numpy as np
@@ -9,7 +9,6 @@ import base64
 import io
 import json
 import logging
-import requests
 
 # Import PDF utilities
 from .utils import (
@@ -17,20 +16,20 @@ from .utils import (
     convert_pdf_to_images, 
     is_pdf_file, 
     get_pdf_page_count,
+    load_page,
     save_image_temporarily
 )
+from .label_scanner import register_key_variants
+from .field_mapping import map_fields_hybrid, map_fields_hybrid_batch, final_value
 
 logger = logging.getLogger(__name__)
 
-NGROK_API_URL = "http://127.0.0.1:8001"
-api_endpoint = f"{NGROK_API_URL}/extract"
-
 # ----------------------------
 # Load PHOCR model
 # ----------------------------
 engine = PHOCR()
 
-# Your existing code for _KEY_VARIANTS, _LABEL_TO_FIELD, etc. remains the same...
+# Label variants, compiled with the other languages' tables by app.label_scanner
 _KEY_VARIANTS = {
     "name": ["full name", "name"],
     "age": ["age", "years", "y/o"],
@@ -43,15 +42,7 @@ _KEY_VARIANTS = {
     "id_number": ["id number", "id", "passport no", "passport number", "passport"],
 }
 
-_LABEL_TO_FIELD = {}
-for fld, variants in _KEY_VARIANTS.items():
-    for v in variants:
-        _LABEL_TO_FIELD[v.lower()] = fld
-
-# build alternation for regex; put longer phrases first
-_all_variants_sorted = sorted(set(_LABEL_TO_FIELD.keys()), key=lambda s: -len(s))
-_LABEL_PATTERN = r'\b(' + '|'.join(re.escape(v) for v in _all_variants_sorted) + r')\b\s*:?\s*'
-_LABEL_RE = re.compile(_LABEL_PATTERN, flags=re.IGNORECASE | re.DOTALL)
+register_key_variants("en", _KEY_VARIANTS)
 
 # ----------------------------
 # Utility functions (keep your existing ones)
@@ -232,7 +223,8 @@ def create_confidence_overlay(image_path: str, detections: List[Dict]) -> str:
 # ----------------------------
 # Enhanced OCR extraction with PDF support
 # ----------------------------
-def extract_text_with_detection(file_path: str, debug: bool = False, page_number: int = 1) -> Dict:
+def extract_text_with_detection(file_path: str, debug: bool = False, page_number: int = 1,
+                                image: Optional[Image.Image] = None) -> Dict:
     """
     Extract text with bounding boxes and confidence scores for confidence zones
     Now supports PDFs by converting to image first
@@ -241,6 +233,7 @@ def extract_text_with_detection(file_path: str, debug: bool = False, page_number
         file_path: Path to image or PDF file
         debug: Enable debug output
         page_number: Page number for PDFs (1-indexed)
+        image: Already rasterized page (e.g. from a document session); skips loading file_path
         
     Returns:
         Dict with text, detections, and metadata
@@ -249,14 +242,16 @@ def extract_text_with_detection(file_path: str, debug: bool = False, page_number
     
     try:
         # Handle PDF files
-        if is_pdf_file(file_path):
+        is_pdf = is_pdf_file(file_path)
+        if image is not None:
+            image = image.convert("RGB")
+        elif is_pdf:
             logger.info(f"Converting PDF page {page_number} to image")
             image = convert_pdf_to_image(file_path, page_number=page_number, dpi=200)
-            is_pdf = True
         else:
             logger.info("Loading image file")
-            image = Image.open(file_path).convert("RGB")
-            is_pdf = False
+            # TIFF: only the requested frame is decoded
+            image = load_page(file_path, page_number=page_number).convert("RGB")
 
         # Initialize quality report
         quality_report = {
@@ -355,7 +350,8 @@ def extract_text_with_detection(file_path: str, debug: bool = False, page_number
         traceback.print_exc()
         return {"error": str(e)}
 
-def extract_text(file_path: str, debug: bool = False, page_number: int = 1) -> Dict:
+def extract_text(file_path: str, debug: bool = False, page_number: int = 1,
+                 image: Optional[Image.Image] = None) -> Dict:
     """
     Extract text from image or PDF
     
@@ -363,17 +359,20 @@ def extract_text(file_path: str, debug: bool = False, page_number: int = 1) -> D
         file_path: Path to image or PDF file
         debug: Enable debug output
         page_number: Page number for PDFs (1-indexed)
+        image: Already decoded page (e.g. a TIFF frame); skips loading file_path
         
     Returns:
         Dict with extraction results
     """
     try:
         # Handle PDF files
-        if is_pdf_file(file_path):
+        if image is not None:
+            image = image.convert("RGB")
+        elif is_pdf_file(file_path):
             logger.info(f"Converting PDF page {page_number} to image")
             image = convert_pdf_to_image(file_path, page_number=page_number, dpi=200)
         else:
-            image = Image.open(file_path).convert("RGB")
+            image = load_page(file_path, page_number=page_number).convert("RGB")
 
         # Initialize quality report
         quality_report = {
@@ -541,61 +540,21 @@ def _calculate_confidence_for_text(texts: List[str], scores: List[float], extrac
     else:
         return sum(scores) / len(scores) if scores else 0.0
 
-def map_fields_via_api(ocr_text: str,custom_fields=None):
-    print("Custom Fields")
-    print(custom_fields)
-    """
-    Send OCR text to remote NuExtract API and get structured fields
-    """
-    try:
-        payload = {"text": ocr_text}
-        if custom_fields is not None and len(custom_fields) > 0:
-            payload["fields"] = custom_fields
-
-
-        logger.info(f"Sending text to NuExtract API (length={len(ocr_text)} chars)...")
-        headers = {
-            "Content-Type": "application/json", 
-            "ngrok-skip-browser-warning": "true"  # CRITICAL for ngrok-free
-        }
-        response = requests.post(api_endpoint, json=payload, headers=headers, timeout=120)
-
-        if response.status_code == 200:
-            data = response.json()
-            logger.info(f"Received data from API: {data}")
-            return data
-        else:
-            logger.error(f"API returned status {response.status_code}: {response.text}")
-            return {field: {"value": None, "confidence": None} for field in [
-                "name","age","gender","dob","address","country","phone","email","id_number"
-            ]}
-    except Exception as e:
-        logger.error(f"Error calling NuExtract API: {e}")
-        return {field: {"value": None, "confidence": None} for field in [
-            "name","age","gender","dob","address","country","phone","email","id_number"
-        ]}
-
-
 # Example usage inside your extraction workflow
 def map_fields(result: dict, custom_fields: list = None) -> dict:
     """
-    Enhanced map_fields using remote NuExtract API
+    Map fields with the shared rule engine first; only unresolved fields go to the LLM mapper
     """
-    # Get the full text from local OCR
-    ocr_text = ""
-    if "detections" in result:
-        ocr_text = " ".join([d["text"] for d in result["detections"]])
-    elif "text" in result:
-        ocr_text = result["text"]
-    elif "texts" in result:
-        ocr_text = " ".join(result["texts"])
+    mapped = map_fields_hybrid(result, custom_fields=custom_fields)
+    # The English endpoint has always returned plain values, as the LLM mapper does
+    return _plain_values(mapped)
 
-    if not ocr_text.strip():
-        logger.warning("No OCR text found to send to API")
-        return {field: {"value": None, "confidence": None} for field in [
-            "name","age","gender","dob","address","country","phone","email","id_number"
-        ]}
+def _plain_values(mapped: dict) -> dict:
+    """Plain field values; rule values that failed validation are dropped, as in the CJK mappers."""
+    return {field: final_value(data) or "" for field, data in mapped.items()}
 
-    # Call remote API
-    mapped_fields = map_fields_via_api(ocr_text, custom_fields=custom_fields)
-    return mapped_fields
\ No newline at end of file
+def map_fields_batch(results: list, custom_fields: list = None) -> list:
+    """
+    map_fields for many pages at once; unresolved fields of all pages share one mapper round trip
+    """
+    return [_plain_values(mapped) for mapped in map_fields_hybrid_batch(results, custom_fields=custom_fields)]
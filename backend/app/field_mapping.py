@@ -0,0 +1,281 @@
+import os
+import logging
+from typing import Callable, Dict, List, Optional
+
+from .label_scanner import DEFAULT_FIELDS, scan_for_fields, scan_field_values, fold_text
+from .field_validation import validate_field, is_free_text
+from .text_compaction import compact_text, estimate_tokens, MAPPER_TOKEN_BUDGET
+from .layout import pair_key_values
+from .mapper_client import map_fields_via_api, map_fields_batch_via_api, mapper_available
+
+logger = logging.getLogger(__name__)
+
+# Rule results at or above this OCR confidence (and passing validation) are final;
+# everything else is sent to the LLM mapper
+RULE_CONFIDENCE_THRESHOLD = float(os.getenv("RULE_CONFIDENCE_THRESHOLD", "0.8"))
+LLM_FALLBACK_ENABLED = os.getenv("MAPPER_LLM_ENABLED", "true").lower() == "true"
+
+
+def _llm_value(raw):
+    """Unwrap a mapper value (plain string or {"value": ...}) to a stripped string or None."""
+    if isinstance(raw, dict):
+        raw = raw.get("value")
+    if raw is None:
+        return None
+    raw = str(raw).strip()
+    return raw or None
+
+
+def final_value(data: Dict) -> Optional[str]:
+    """A mapped field's value for outputs without a source: None for a rules_unvalidated hint."""
+    if data.get("source") == "rules_unvalidated":
+        return None
+    return data.get("value")
+
+
+# ----------------------------
+# Hybrid mapping
+# ----------------------------
+def _rule_pass(result: Dict, fields: List[str], threshold: float):
+    """Run the rule engine; returns (scan, mapped, unresolved field keys)."""
+    scan = scan_for_fields(result, fields)
+    if scan is None or not scan.text:
+        logger.warning("No OCR text found to map")
+        return None, {field: {"value": None, "confidence": None, "source": None} for field in fields}, []
+
+    def resolved(field, value, confidence):
+        return validate_field(field, value) and (confidence or 0.0) >= threshold
+
+    # A label alone in its box is paired geometrically (two-column forms, value
+    # below its label); that beats the label's neighbour in the space-joined text
+    layout_pairs = pair_key_values(result, fields)
+
+    mapped = {}
+    unresolved = []
+    for field, rule in scan_field_values(scan, fields).items():
+        pair = layout_pairs.get(field)
+        if pair and resolved(field, pair["value"], pair["confidence"]):
+            mapped[field] = {"value": pair["value"], "confidence": pair["confidence"], "source": "layout"}
+            continue
+        value, confidence = rule["value"], rule["confidence"]
+        if not value:
+            mapped[field] = {"value": None, "confidence": None, "source": None}
+            unresolved.append(field)
+        elif not validate_field(field, value) or (rule["detached"] and is_free_text(field)):
+            # Kept only as a hint: a value that fails validation, or free text paired
+            # with a lone label by reading order alone, is never final
+            mapped[field] = {"value": value, "confidence": None, "source": "rules_unvalidated"}
+            unresolved.append(field)
+        else:
+            mapped[field] = {"value": value, "confidence": confidence, "source": "rules"}
+            if not resolved(field, value, confidence):
+                unresolved.append(field)
+
+    logger.info(f"Rules resolved {len(fields) - len(unresolved)}/{len(fields)} fields; "
+                f"{len(unresolved)} left for the LLM mapper")
+    return scan, mapped, unresolved
+
+
+def _llm_enabled() -> bool:
+    if not LLM_FALLBACK_ENABLED:
+        return False
+    if not mapper_available():
+        logger.warning("Mapper unavailable (circuit open); using rule-based results only")
+        return False
+    return True
+
+
+def _merge_llm(scan, mapped: Dict, unresolved: List[str], llm_result: Dict) -> Dict:
+    """Overlay non-empty LLM values on the rule results, attributing OCR confidence where the value appears."""
+    folded_text = fold_text(scan.text)
+    for field in unresolved:
+        value = _llm_value((llm_result or {}).get(field))
+        if value is None:
+            continue
+        pos = folded_text.find(fold_text(value))
+        confidence = scan.confidence_for_span(pos, pos + len(value)) if pos >= 0 else None
+        mapped[field] = {"value": value, "confidence": confidence, "source": "llm"}
+    return mapped
+
+
+def map_fields_hybrid(result: Dict, custom_fields: Optional[List[str]] = None,
+                      llm_mapper: Optional[Callable] = None,
+                      threshold: Optional[float] = None) -> Dict:
+    """
+    Map OCR output to fields with rules first and the LLM only for what is left.
+
+    The shared label scanner and field patterns run first, then label/value
+    pairing from the detection boxes (layout.pair_key_values). A label's value never
+    leaves its detection. A field is final when its value validates and its OCR
+    confidence is at least the threshold; free text taken from the detection after a
+    lone label is never final (only layout pairing can confirm it). Only the
+    remaining fields are sent to the LLM mapper, in a prompt listing just those
+    and carrying the compacted OCR text (see text_compaction.compact_text).
+
+    Args:
+        result: Output of extract_text_with_detection (or extract_text)
+        custom_fields: Field keys to map (default: DEFAULT_FIELDS)
+        llm_mapper: Callable(text, custom_fields=[...]) -> dict (default: map_fields_via_api)
+        threshold: Rule confidence threshold (default: RULE_CONFIDENCE_THRESHOLD)
+
+    Returns:
+        Dict of field -> {"value", "confidence", "source"} where source is
+        "rules", "layout", "llm" or None when the field was not found;
+        "rules_unvalidated" (confidence None) marks a rule value that failed
+        validation and that the LLM did not replace
+    """
+    fields = list(custom_fields) if custom_fields else list(DEFAULT_FIELDS)
+    threshold = RULE_CONFIDENCE_THRESHOLD if threshold is None else threshold
+    llm_mapper = llm_mapper or map_fields_via_api
+
+    scan, mapped, unresolved = _rule_pass(result, fields, threshold)
+    if not unresolved or not _llm_enabled():
+        return mapped
+
+    llm_text = compact_text(result) or scan.text
+    return _merge_llm(scan, mapped, unresolved, llm_mapper(llm_text, custom_fields=unresolved))
+
+
+def map_fields_hybrid_batch(results: List[Dict], custom_fields: Optional[List[str]] = None,
+                            batch_mapper: Optional[Callable] = None,
+                            threshold: Optional[float] = None) -> List[Dict]:
+    """
+    Hybrid mapping for many OCR results (e.g. the pages of a PDF).
+
+    Rules run per result; the leftovers of every result go to the mapping
+    service in a single /extract/batch round trip.
+
+    Args:
+        results: OCR results, one per page/document
+        custom_fields: Field keys to map (default: DEFAULT_FIELDS)
+        batch_mapper: Callable([(text, fields), ...]) -> [dict, ...] (default: map_fields_batch_via_api)
+        threshold: Rule confidence threshold (default: RULE_CONFIDENCE_THRESHOLD)
+
+    Returns:
+        List of mapped field dicts in input order (same shape as map_fields_hybrid)
+    """
+    fields = list(custom_fields) if custom_fields else list(DEFAULT_FIELDS)
+    threshold = RULE_CONFIDENCE_THRESHOLD if threshold is None else threshold
+    batch_mapper = batch_mapper or map_fields_batch_via_api
+
+    passes = [_rule_pass(result, fields, threshold) for result in results]
+    pending = [i for i, (_, _, unresolved) in enumerate(passes) if unresolved]
+    if not pending or not _llm_enabled():
+        return [mapped for _, mapped, _ in passes]
+
+    llm_results = batch_mapper([(compact_text(results[i]) or passes[i][0].text, passes[i][2]) for i in pending])
+    for i, llm_result in zip(pending, llm_results):
+        scan, mapped, unresolved = passes[i]
+        _merge_llm(scan, mapped, unresolved, llm_result)
+    return [mapped for _, mapped, _ in passes]
+
+
+# ----------------------------
+# Document-level mapping
+# ----------------------------
+def _locate(scan, value: str):
+    """(confidence, detection index) of value in a page's scan, or None if it does not appear there."""
+    if scan is None or not value:
+        return None
+    pos = fold_text(scan.text).find(fold_text(value))
+    if pos < 0:
+        return None
+    return scan.confidence_for_span(pos, pos + len(value)), scan.detection_index_at(pos)
+
+
+def _document_chunks(texts: List[str], page_numbers: List[int], token_budget: int) -> List[List[int]]:
+    """Group consecutive pages (indices) into chunks of at most token_budget estimated tokens."""
+    chunks, used = [], 0
+    for i, text in enumerate(texts):
+        if not text:
+            continue
+        tokens = estimate_tokens(text) + estimate_tokens(f"[Page {page_numbers[i]}]")
+        if not chunks or used + tokens > token_budget:
+            chunks.append([])
+            used = 0
+        chunks[-1].append(i)
+        used += tokens
+    return chunks
+
+
+def map_fields_document(results: List[Dict], custom_fields: Optional[List[str]] = None,
+                        page_numbers: Optional[List[int]] = None,
+                        llm_mapper: Optional[Callable] = None,
+                        threshold: Optional[float] = None,
+                        token_budget: Optional[int] = None) -> Dict:
+    """
+    Map one set of fields for a whole multipage document.
+
+    Rules run per page and the most confident validated value of every field
+    wins. The fields no page resolves are mapped from the compacted text of all
+    pages, packed into as few LLM calls as the token budget allows; chunks are
+    mapped in page order and stop early once every field has a value. LLM values
+    are attributed to the first page (and detection) whose text contains them.
+
+    Args:
+        results: OCR results, one per page
+        custom_fields: Field keys to map (default: DEFAULT_FIELDS)
+        page_numbers: Page number of each result (default: 1..N)
+        llm_mapper: Callable(text, custom_fields=[...]) -> dict (default: map_fields_via_api)
+        threshold: Rule confidence threshold (default: RULE_CONFIDENCE_THRESHOLD)
+        token_budget: Estimated tokens per LLM call (default: MAPPER_TOKEN_BUDGET)
+
+    Returns:
+        Dict of field -> {"value", "confidence", "source", "page_number", "detection_index"}
+    """
+    fields = list(custom_fields) if custom_fields else list(DEFAULT_FIELDS)
+    page_numbers = list(page_numbers) if page_numbers else list(range(1, len(results) + 1))
+    threshold = RULE_CONFIDENCE_THRESHOLD if threshold is None else threshold
+    token_budget = MAPPER_TOKEN_BUDGET if token_budget is None else token_budget
+    llm_mapper = llm_mapper or map_fields_via_api
+
+    passes = [_rule_pass(result, fields, threshold) for result in results]
+
+    mapped = {}
+    unresolved = []
+    for field in fields:
+        best, best_key = None, None
+        for i, (scan, page_mapped, page_unresolved) in enumerate(passes):
+            data = page_mapped.get(field) or {}
+            if not data.get("value"):
+                continue
+            # Resolved values beat unresolved ones, then higher confidence wins
+            key = (field not in page_unresolved, data.get("confidence") or 0.0)
+            if best_key is None or key > best_key:
+                located = _locate(scan, data["value"])
+                best = {**data, "page_number": page_numbers[i],
+                        "detection_index": located[1] if located else None}
+                best_key = key
+        mapped[field] = best or {"value": None, "confidence": None, "source": None,
+                                 "page_number": None, "detection_index": None}
+        if best_key is None or not best_key[0]:
+            unresolved.append(field)
+
+    if not unresolved or not _llm_enabled():
+        return mapped
+
+    texts = [compact_text(result, token_budget=token_budget) for result in results]
+    calls = 0
+    for chunk in _document_chunks(texts, page_numbers, token_budget):
+        if not unresolved:
+            break
+        chunk_text = "\n\n".join(f"[Page {page_numbers[i]}]\n{texts[i]}" for i in chunk)
+        llm_result = llm_mapper(chunk_text, custom_fields=unresolved) or {}
+        calls += 1
+        for field in list(unresolved):
+            value = _llm_value(llm_result.get(field))
+            if value is None:
+                continue
+            page_number, confidence, detection_index = None, None, None
+            for i in chunk:
+                located = _locate(passes[i][0], value)
+                if located is not None:
+                    page_number, (confidence, detection_index) = page_numbers[i], located
+                    break
+            mapped[field] = {"value": value, "confidence": confidence, "source": "llm",
+                             "page_number": page_number, "detection_index": detection_index}
+            unresolved.remove(field)
+
+    logger.info(f"Document mapping: {len(results)} pages, {calls} LLM calls, "
+                f"{len(fields) - len(unresolved)}/{len(fields)} fields found")
+    return mapped
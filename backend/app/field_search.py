@@ -0,0 +1,124 @@
+import os
+import json
+import logging
+from typing import Callable, Dict, List, Optional
+
+from .label_scanner import DEFAULT_FIELDS
+from .field_validation import validate_field
+
+logger = logging.getLogger(__name__)
+
+# A field counts as found once its value validates and is at least this confident
+FIND_MIN_CONFIDENCE = float(os.getenv("FIND_MIN_CONFIDENCE", "0.8"))
+# Mapping sources whose values can be final; "rules_unvalidated" values are only hints
+_RESOLVING_SOURCES = ("rules", "layout", "llm")
+
+
+def parse_page_order(spec: str, total_pages: int) -> List[int]:
+    """
+    Pages to search, in order.
+
+    "" or "natural" is 1..N, "reverse" is N..1, "ends" alternates from both ends
+    (1, N, 2, N-1, ...: identity pages are usually first or last) and a JSON list
+    of page numbers searches only those.
+
+    Raises ValueError for unknown orders or pages outside the document.
+    """
+    spec = (spec or "").strip()
+    pages = list(range(1, total_pages + 1))
+    if spec in ("", "natural"):
+        return pages
+    if spec == "reverse":
+        return pages[::-1]
+    if spec == "ends":
+        order = []
+        while pages:
+            order.append(pages.pop(0))
+            if pages:
+                order.append(pages.pop())
+        return order
+    try:
+        listed = json.loads(spec)
+    except json.JSONDecodeError:
+        raise ValueError(f"Unknown page order '{spec}': use natural, reverse, ends or a JSON list of pages")
+    if not isinstance(listed, list) or not listed:
+        raise ValueError("page_order list must be a non-empty JSON list of page numbers")
+    order = []
+    for page in listed:
+        if not isinstance(page, int) or not 1 <= page <= total_pages:
+            raise ValueError(f"Page {page!r} is outside the document (1-{total_pages})")
+        if page not in order:
+            order.append(page)
+    return order
+
+
+def is_resolved(field: str, data: Dict, min_confidence: float = FIND_MIN_CONFIDENCE) -> bool:
+    """
+    Whether a mapped value is final: it comes from a resolving source, passes
+    validation and, for rule and layout values, is at least min_confidence.
+    LLM values are final once they validate (as in map_fields_document).
+    """
+    if not data.get("value") or data.get("source") not in _RESOLVING_SOURCES:
+        return False
+    if not validate_field(field, data["value"]):
+        return False
+    return data["source"] == "llm" or (data.get("confidence") or 0.0) >= min_confidence
+
+
+def find_fields(pages: List[int], detect: Callable[[int], Dict], map_page: Callable[[Dict, List[str]], Dict],
+                fields: Optional[List[str]] = None, min_confidence: float = FIND_MIN_CONFIDENCE) -> Dict:
+    """
+    Search pages in order until every field is resolved (see is_resolved).
+
+    Only the fields still missing are mapped on each page, so later pages cost
+    less mapping as well as no OCR once everything is found.
+
+    Args:
+        pages: Page numbers in search order (see parse_page_order)
+        detect: page number -> extract_text_with_detection result
+        map_page: (result, fields) -> map_fields_hybrid output ({field: {"value", "confidence", "source"}})
+        fields: Field keys to find (default: DEFAULT_FIELDS)
+        min_confidence: Confidence at which a validated rule or layout value is final
+
+    Returns:
+        {"fields": {field: {"value", "confidence", "source", "page_number"}} with the
+        best candidate of every field (resolved values first, then the most
+        confident; value None when never seen), "missing": fields no page resolved,
+        "pages_processed", "stopped_early", "page_errors": {page: error}}
+    """
+    fields = list(fields) if fields else list(DEFAULT_FIELDS)
+    best = {field: {"value": None, "confidence": None, "source": None, "page_number": None} for field in fields}
+    best_key = {}
+    missing = list(fields)
+    processed, errors = [], {}
+
+    for page_number in pages:
+        if not missing:
+            break
+        result = detect(page_number)
+        processed.append(page_number)
+        if "error" in result:
+            errors[page_number] = result["error"]
+            continue
+
+        for field, data in map_page(result, missing).items():
+            if not data.get("value"):
+                continue
+            # Resolved values beat unresolved ones, then higher confidence wins
+            key = (is_resolved(field, data, min_confidence), data.get("confidence") or 0.0)
+            if field not in best_key or key > best_key[field]:
+                best[field] = {**data, "page_number": page_number}
+                best_key[field] = key
+        missing = [field for field in missing if not best_key.get(field, (False,))[0]]
+        logger.info(f"Field search: page {page_number} done, {len(fields) - len(missing)}/{len(fields)} fields found")
+
+    stopped_early = not missing and len(processed) < len(pages)
+    if stopped_early:
+        logger.info(f"Field search stopped after {len(processed)} of {len(pages)} pages")
+    return {
+        "fields": best,
+        "missing": missing,
+        "pages_processed": processed,
+        "stopped_early": stopped_early,
+        "page_errors": errors,
+    }
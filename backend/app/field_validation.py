@@ -0,0 +1,77 @@
+import re
+from datetime import datetime
+from typing import Optional
+
+# Importable both as app.field_validation and, from the standalone mapping
+# service (python3 app/mappingfinal.py), as a top-level module
+try:
+    from .label_scanner import resolve_field, fold_text
+except ImportError:
+    from label_scanner import resolve_field, fold_text
+
+# ----------------------------
+# Field validation
+# ----------------------------
+_EMAIL_RE = re.compile(r'[\w\.-]+@[\w\.-]+\.\w+')
+_DATE_FORMATS = [
+    "%d/%m/%Y", "%m/%d/%Y", "%Y/%m/%d", "%d-%m-%Y", "%m-%d-%Y", "%Y-%m-%d",
+    "%d.%m.%Y", "%Y.%m.%d", "%d %B %Y", "%d %b %Y", "%B %d %Y", "%b %d %Y",
+    "%d/%m/%y", "%m/%d/%y",
+]
+_CJK_DATE_RE = re.compile(r'(\d{4})\s*[年년]\s*(\d{1,2})\s*[月월]\s*(\d{1,2})\s*[日일]?')
+_GENDER_VALUES = {"male", "female", "m", "f", "other", "男", "女", "男性", "女性", "남", "여", "남성", "여성"}
+
+
+def parse_date(value: str) -> Optional[datetime]:
+    """Parse the date formats commonly printed on forms; None if unparseable."""
+    value = str(value).strip().replace(",", " ")
+    value = re.sub(r'\s+', ' ', value)
+    m = _CJK_DATE_RE.search(value)
+    if m:
+        try:
+            return datetime(int(m.group(1)), int(m.group(2)), int(m.group(3)))
+        except ValueError:
+            return None
+    for fmt in _DATE_FORMATS:
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+    return None
+
+
+# Fields whose values get a type check; anything else only has a length limit
+_TYPED_FIELDS = {"email", "phone", "age", "dob", "gender"}
+
+
+def is_free_text(field: str) -> bool:
+    """True for fields (name, address, custom keys, ...) whose validation cannot reject a wrong value."""
+    return (resolve_field(field) or field) not in _TYPED_FIELDS
+
+
+def validate_field(field: str, value) -> bool:
+    """
+    Check that a mapped value is plausible for its field.
+
+    Known fields (resolved through the label tables, so "Date of Birth" counts as
+    dob) get type checks; custom fields only need a non-empty, reasonably short value.
+    """
+    if value is None:
+        return False
+    value = str(value).strip()
+    if not value:
+        return False
+
+    canonical = resolve_field(field) or field
+    if canonical == "email":
+        return _EMAIL_RE.fullmatch(value) is not None
+    if canonical == "phone":
+        return 7 <= sum(c.isdigit() for c in value) <= 15
+    if canonical == "age":
+        return value.isdigit() and 0 < int(value) <= 130
+    if canonical == "dob":
+        parsed = parse_date(value)
+        return parsed is not None and 1900 <= parsed.year <= datetime.now().year
+    if canonical == "gender":
+        return fold_text(value) in _GENDER_VALUES
+    return len(value) <= 200
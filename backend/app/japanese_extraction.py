@@ -1,7 +1,6 @@
 # ocr_japanese.py
 import os
-import re
-from typing import Dict, List
+from typing import Dict, List, Optional
 from PIL import Image, ImageDraw, ImageFont
 import cv2
 import numpy as np
@@ -11,6 +10,9 @@ import io
 import json
 import logging
 
+from .label_scanner import register_key_variants
+from .field_mapping import map_fields_hybrid, map_fields_hybrid_batch, final_value
+
 # Assuming 'utils' is a local module in your project structure
 # from .utils import (
 #     convert_pdf_to_image,
@@ -43,15 +45,7 @@ _KEY_VARIANTS = {
     "id_number": ["ID番号", "パスポート番号", "証明書番号"],
 }
 
-_LABEL_TO_FIELD = {}
-for fld, variants in _KEY_VARIANTS.items():
-    for v in variants:
-        _LABEL_TO_FIELD[v.lower()] = fld
-
-# build alternation for regex; put longer phrases first
-_all_variants_sorted = sorted(set(_LABEL_TO_FIELD.keys()), key=lambda s: -len(s))
-_LABEL_PATTERN = r'(' + '|'.join(re.escape(v) for v in _all_variants_sorted) + r')\s*:?\s*'
-_LABEL_RE = re.compile(_LABEL_PATTERN, flags=re.IGNORECASE | re.DOTALL)
+register_key_variants("ja", _KEY_VARIANTS)
 
 # ----------------------------
 # Utility functions
@@ -169,11 +163,12 @@ def create_confidence_overlay(image_path: str, detections: List[Dict]) -> str:
         logger.error(f"Error creating confidence overlay: {e}")
         return None
 
-def extract_text_with_detection(file_path: str, debug: bool = False, page_number: int = 1) -> Dict:
+def extract_text_with_detection(file_path: str, debug: bool = False, page_number: int = 1,
+                                image: Optional[Image.Image] = None) -> Dict:
     logger.info(f"Starting text extraction with detection for: {file_path}")
     try:
         logger.info("Loading image file")
-        image = Image.open(file_path).convert("RGB")
+        image = image.convert("RGB") if image is not None else Image.open(file_path).convert("RGB")
         is_pdf = file_path.lower().endswith('.pdf')
         quality_report = {"suggestions": [], "issues": [], "is_pdf": is_pdf}
 
@@ -214,71 +209,17 @@ def extract_text_with_detection(file_path: str, debug: bool = False, page_number
         logger.error(f"Error in extract_text_with_detection: {e}", exc_info=True)
         return {"error": str(e)}
 
-def map_fields(result: Dict) -> Dict:
-    fields = {
-        "name": None, "age": None, "gender": None, "dob": None, "address": None,
-        "country": None, "phone": None, "email": None, "id_number": None,
-    }
-    confidence_scores = {k: None for k in fields.keys()}
-    texts, scores = [], []
-
-    if "detections" in result:
-        for d in result["detections"]:
-            texts.append(d["text"])
-            scores.append(d["confidence"])
-        full_text = " ".join(texts)
-    else:
-        return {field: {"value": None, "confidence": None} for field in fields.keys()}
-
-    full_text = re.sub(r'\s+', ' ', full_text).strip()
-    logger.info(f"Full Text for mapping: {full_text}")
-
-    matches = sorted(_LABEL_RE.finditer(full_text), key=lambda m: m.start())
-    for i, m in enumerate(matches):
-        field = _LABEL_TO_FIELD.get(m.group(1).lower())
-        if not field or fields[field] is not None:
-            continue
-        
-        start_val = m.end()
-        end_val = matches[i + 1].start() if i + 1 < len(matches) else len(full_text)
-        val = full_text[start_val:end_val].strip(" \t\n\r:;,-")
-        
-        if field == "email": extracted_value = _extract_email(val) or val
-        elif field == "phone": extracted_value = _extract_phone(val) or val
-        elif field == "age": extracted_value = _extract_age(val) or val
-        else: extracted_value = val
-        
-        if extracted_value:
-            fields[field] = extracted_value
-            confidence_scores[field] = _calculate_confidence_for_text(texts, scores, extracted_value)
-
-    if not fields["email"]:
-        email_val = _extract_email(full_text)
-        if email_val: fields["email"] = email_val; confidence_scores["email"] = _calculate_confidence_for_text(texts, scores, email_val)
-    if not fields["phone"]:
-        phone_val = _extract_phone(full_text)
-        if phone_val: fields["phone"] = phone_val; confidence_scores["phone"] = _calculate_confidence_for_text(texts, scores, phone_val)
-
-    result_out = {}
-    for k, v in fields.items():
-        result_out[k] = {"value": v.strip(" \t\n\r,:;") if isinstance(v, str) else v, "confidence": confidence_scores[k]}
-    
-    logger.info(f"Final mapped fields: {result_out}")
-    return result_out
-
-def _extract_email(s: str) -> str:
-    m = re.search(r'[\w\.-]+@[\w\.-]+\.\w+', s)
-    return m.group(0).strip() if m else None
-
-def _extract_phone(s: str) -> str:
-    m = re.search(r'(\+?\d[\d\-\s().]{6,}\d)', s)
-    return m.group(1).strip() if m else None
-
-def _extract_age(s: str) -> str:
-    m = re.search(r'\b(\d{1,3})\b', s)
-    return m.group(1) if m else None
-
-def _calculate_confidence_for_text(texts: List[str], scores: List[float], extracted_text: str) -> float:
-    if not extracted_text or not scores: return 0.0
-    matching_scores = [scores[i] for i, seg in enumerate(texts) if i < len(scores) and seg.lower().strip() in extracted_text.lower().strip()]
-    return sum(matching_scores) / len(matching_scores) if matching_scores else 0.0
\ No newline at end of file
+def map_fields(result: Dict, custom_fields: List[str] = None) -> Dict:
+    """
+    Map OCR output to fields: shared label rules first, LLM mapper only for unresolved fields.
+    Rule values that fail validation are dropped (value None), as in the English mapper.
+    """
+    mapped = map_fields_hybrid(result, custom_fields=custom_fields)
+    return {field: {"value": final_value(data), "confidence": data["confidence"]} for field, data in mapped.items()}
+
+def map_fields_batch(results: List[Dict], custom_fields: List[str] = None) -> List[Dict]:
+    """map_fields for many pages at once; unresolved fields of all pages share one mapper round trip."""
+    return [
+        {field: {"value": final_value(data), "confidence": data["confidence"]} for field, data in mapped.items()}
+        for mapped in map_fields_hybrid_batch(results, custom_fields=custom_fields)
+    ]
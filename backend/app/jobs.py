@@ -0,0 +1,314 @@
+import os
+import json
+import time
+import uuid
+import shutil
+import logging
+import sqlite3
+import threading
+from typing import Callable, Dict, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+# Jobs and per-page results survive restarts in this SQLite database
+JOBS_DB_PATH = os.getenv("JOBS_DB_PATH", "jobs.sqlite3")
+# Job documents are kept here until the job is deleted
+JOBS_DIR = os.getenv("JOBS_DIR", os.path.join("uploads", "jobs"))
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "1"))
+# Idle workers check for new jobs this often (submissions also wake them)
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "2"))
+# A running job whose worker has not sent a heartbeat for this long (its process
+# died) is taken over by the next free worker of any process
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "60"))
+JOB_HEARTBEAT_SECONDS = JOB_LEASE_SECONDS / 4
+
+FINISHED_STATUSES = ("completed", "failed", "cancelled")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    path TEXT NOT NULL,
+    params TEXT NOT NULL,
+    total_pages INTEGER,
+    cancel_requested INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    heartbeat_at REAL
+);
+CREATE TABLE IF NOT EXISTS job_pages (
+    job_id TEXT NOT NULL,
+    page_number INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    result TEXT,
+    finished_at REAL NOT NULL,
+    PRIMARY KEY (job_id, page_number)
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at);
+"""
+
+
+class JobCancelled(Exception):
+    """Raised inside a job processor when the job was cancelled between pages."""
+
+
+class JobStopped(Exception):
+    """Raised inside a job processor when the queue is stopping; the job is left running for a takeover."""
+
+
+class JobQueue:
+    """
+    Persistent queue of document jobs, processed page by page by worker threads.
+
+    The processor callable does the actual work:
+    processor(job, done_pages, report) where report(page_number, status, result)
+    stores one page and raises JobCancelled once the job has been cancelled
+    (JobStopped once the queue is stopping).
+    Pages already stored are passed in done_pages, so a job interrupted by a
+    restart resumes where it stopped.
+
+    Several processes (e.g. uvicorn workers) may share one database: a running
+    job holds a lease that its process renews every JOB_HEARTBEAT_SECONDS, and
+    only jobs whose lease has run out are taken over.
+    """
+
+    def __init__(self, db_path: str = JOBS_DB_PATH, jobs_dir: str = JOBS_DIR):
+        self.db_path = db_path
+        self.jobs_dir = jobs_dir
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._workers: List[threading.Thread] = []
+        # Jobs this process is running, whose leases the heartbeat thread renews
+        self._running: Set[str] = set()
+        self._heartbeat_thread: Optional[threading.Thread] = None
+        os.makedirs(jobs_dir, exist_ok=True)
+        with self._connect() as db:
+            db.executescript(_SCHEMA)
+            columns = {row["name"] for row in db.execute("PRAGMA table_info(jobs)")}
+            if "heartbeat_at" not in columns:
+                db.execute("ALTER TABLE jobs ADD COLUMN heartbeat_at REAL")
+
+    def _connect(self) -> sqlite3.Connection:
+        db = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        db.row_factory = sqlite3.Row
+        db.execute("PRAGMA journal_mode=WAL")
+        return db
+
+    # ----------------------------
+    # Client side
+    # ----------------------------
+    def submit(self, filename: str, source_path: str, params: Dict) -> Dict:
+        """Queue a job for a copy of the document at source_path."""
+        job_id = uuid.uuid4().hex
+        path = os.path.join(self.jobs_dir, f"{job_id}_{os.path.basename(filename or 'document')}")
+        shutil.copyfile(source_path, path)
+        with self._connect() as db:
+            db.execute(
+                "INSERT INTO jobs (id, status, filename, path, params, created_at) VALUES (?, 'queued', ?, ?, ?, ?)",
+                (job_id, filename or "document", path, json.dumps(params), time.time()),
+            )
+        self._wake.set()
+        logger.info(f"Queued job {job_id} for {filename}")
+        return self.get(job_id)
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        """Job status with per-page progress; None if unknown."""
+        with self._connect() as db:
+            job = db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if job is None:
+                return None
+            pages = db.execute("SELECT page_number, status FROM job_pages WHERE job_id = ? ORDER BY page_number",
+                               (job_id,)).fetchall()
+            position = None
+            if job["status"] == "queued":
+                position = db.execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued' AND created_at < ?",
+                                      (job["created_at"],)).fetchone()[0]
+        page_status = {str(p["page_number"]): p["status"] for p in pages}
+        total = job["total_pages"]
+        return {
+            "job_id": job["id"],
+            "status": job["status"],
+            "filename": job["filename"],
+            "params": json.loads(job["params"]),
+            "total_pages": total,
+            "pages_done": len(page_status),
+            "progress": round(len(page_status) / total, 3) if total else 0.0,
+            "pages": page_status,
+            "queue_position": position,
+            "cancel_requested": bool(job["cancel_requested"]),
+            "error": job["error"],
+            "created_at": job["created_at"],
+            "started_at": job["started_at"],
+            "finished_at": job["finished_at"],
+        }
+
+    def results(self, job_id: str) -> Optional[Dict]:
+        """Status plus the stored page results so far (partial while the job runs)."""
+        status = self.get(job_id)
+        if status is None:
+            return None
+        with self._connect() as db:
+            rows = db.execute("SELECT page_number, status, result FROM job_pages WHERE job_id = ? ORDER BY page_number",
+                              (job_id,)).fetchall()
+        status["results"] = {
+            str(row["page_number"]): {"page_status": row["status"], **(json.loads(row["result"]) if row["result"] else {})}
+            for row in rows
+        }
+        status["partial"] = status["status"] not in FINISHED_STATUSES
+        return status
+
+    def cancel(self, job_id: str) -> Optional[Dict]:
+        """Cancel a job: queued jobs stop at once, running ones after their current page."""
+        with self._connect() as db:
+            db.execute("UPDATE jobs SET status = 'cancelled', finished_at = ? WHERE id = ? AND status = 'queued'",
+                       (time.time(), job_id))
+            db.execute("UPDATE jobs SET cancel_requested = 1 WHERE id = ? AND status = 'running'", (job_id,))
+        return self.get(job_id)
+
+    def delete(self, job_id: str) -> bool:
+        """Remove a finished job, its results and its document."""
+        with self._connect() as db:
+            job = db.execute("SELECT path, status FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if job is None or job["status"] not in FINISHED_STATUSES:
+                return False
+            db.execute("DELETE FROM job_pages WHERE job_id = ?", (job_id,))
+            db.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+        if os.path.exists(job["path"]):
+            os.remove(job["path"])
+        return True
+
+    def page_result(self, job_id: str, page_number: int) -> Optional[Dict]:
+        """Stored result of one page of a job; None if the page has not finished."""
+        with self._connect() as db:
+            row = db.execute("SELECT result FROM job_pages WHERE job_id = ? AND page_number = ?",
+                             (job_id, page_number)).fetchone()
+        if row is None:
+            return None
+        return json.loads(row["result"]) if row["result"] else {}
+
+    def stats(self) -> Dict:
+        with self._connect() as db:
+            counts = dict(db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+        return {"workers": len(self._workers), "jobs": counts}
+
+    # ----------------------------
+    # Worker side
+    # ----------------------------
+    def _claim(self) -> Optional[sqlite3.Row]:
+        """Atomically move the oldest queued job, or running job with an expired lease, to running."""
+        with self._lock, self._connect() as db:
+            now = time.time()
+            db.execute("BEGIN IMMEDIATE")
+            job = db.execute("SELECT * FROM jobs WHERE status = 'queued' "
+                             "OR (status = 'running' AND COALESCE(heartbeat_at, 0) < ?) "
+                             "ORDER BY created_at LIMIT 1", (now - JOB_LEASE_SECONDS,)).fetchone()
+            if job is not None:
+                db.execute("UPDATE jobs SET status = 'running', started_at = COALESCE(started_at, ?), heartbeat_at = ? "
+                           "WHERE id = ?", (now, now, job["id"]))
+                self._running.add(job["id"])
+            db.execute("COMMIT")
+        if job is not None and job["status"] == "running":
+            logger.info(f"Taking over job {job['id']}: its worker stopped sending heartbeats")
+        return job
+
+    def _heartbeat(self):
+        """Renew the leases of the jobs this process is running (until it exits: stopped workers finish their page)."""
+        while True:
+            time.sleep(JOB_HEARTBEAT_SECONDS)
+            with self._lock:
+                running = list(self._running)
+            if not running:
+                continue
+            try:
+                with self._connect() as db:
+                    db.execute(f"UPDATE jobs SET heartbeat_at = ? WHERE status = 'running' "
+                               f"AND id IN ({', '.join('?' * len(running))})", (time.time(), *running))
+            except sqlite3.Error as e:
+                logger.warning(f"Job heartbeat failed: {e}")
+
+    def _finish(self, job_id: str, status: str, error: Optional[str] = None):
+        with self._connect() as db:
+            db.execute("UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE id = ?",
+                       (status, error, time.time(), job_id))
+
+    def set_total_pages(self, job_id: str, total_pages: int):
+        with self._connect() as db:
+            db.execute("UPDATE jobs SET total_pages = ? WHERE id = ?", (total_pages, job_id))
+
+    def _run(self, job: sqlite3.Row, processor: Callable):
+        job_id = job["id"]
+        with self._connect() as db:
+            done: Set[int] = {row[0] for row in db.execute("SELECT page_number FROM job_pages WHERE job_id = ?", (job_id,))}
+
+        def report(page_number: int, status: str, result: Optional[Dict] = None):
+            with self._connect() as db:
+                db.execute("INSERT OR REPLACE INTO job_pages (job_id, page_number, status, result, finished_at) "
+                           "VALUES (?, ?, ?, ?, ?)",
+                           (job_id, page_number, status, json.dumps(result, ensure_ascii=False) if result else None,
+                            time.time()))
+                cancelled = db.execute("SELECT cancel_requested FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if cancelled is None or cancelled[0]:
+                raise JobCancelled()
+            if self._stop.is_set():
+                raise JobStopped()
+
+        job_info = {"job_id": job_id, "path": job["path"], "filename": job["filename"], "params": json.loads(job["params"])}
+        start = time.time()
+        try:
+            processor(job_info, done, report)
+        except JobCancelled:
+            logger.info(f"Job {job_id} cancelled")
+            self._finish(job_id, "cancelled")
+            return
+        except JobStopped:
+            # No longer heartbeated (see finally), so its lease runs out and it is taken over
+            logger.info(f"Job {job_id} stopped; it resumes once its lease runs out")
+            return
+        except Exception as e:
+            logger.error(f"Job {job_id} failed: {e}", exc_info=True)
+            self._finish(job_id, "failed", str(e))
+            return
+        finally:
+            with self._lock:
+                self._running.discard(job_id)
+        self._finish(job_id, "completed")
+        logger.info(f"Job {job_id} completed in {time.time() - start:.1f}s")
+
+    def _worker(self, processor: Callable):
+        while not self._stop.is_set():
+            job = self._claim()
+            if job is None:
+                self._wake.wait(JOB_POLL_SECONDS)
+                self._wake.clear()
+                continue
+            self._run(job, processor)
+
+    def start(self, processor: Callable, workers: int = JOB_WORKERS):
+        """Start the worker threads (once)."""
+        if self._workers:
+            return
+        self._stop.clear()
+        for i in range(max(1, workers)):
+            thread = threading.Thread(target=self._worker, args=(processor,), name=f"job-worker-{i}", daemon=True)
+            thread.start()
+            self._workers.append(thread)
+        if self._heartbeat_thread is None:
+            self._heartbeat_thread = threading.Thread(target=self._heartbeat, name="job-heartbeat", daemon=True)
+            self._heartbeat_thread.start()
+        logger.info(f"Started {len(self._workers)} job workers")
+
+    def stop(self):
+        """
+        Stop the workers after their current page; their jobs are resumed by the
+        next start (here or in another process) once their lease has run out.
+        """
+        self._stop.set()
+        self._wake.set()
+        self._workers = []
+
+
+queue = JobQueue()
@@ -0,0 +1,412 @@
+import re
+import logging
+import threading
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FIELDS = ["name", "age", "gender", "dob", "address", "country", "phone", "email", "id_number"]
+
+# ----------------------------
+# Key variant registry
+# ----------------------------
+# Every language module registers its _KEY_VARIANTS table here on import. All
+# tables are compiled into one Aho-Corasick automaton, so a page is scanned once
+# for the labels of every language instead of once per language mapper.
+_VARIANT_TABLES: Dict[str, Dict[str, List[str]]] = {}
+_automaton = None
+_automaton_lock = threading.Lock()
+
+# Characters allowed between a label and its value (the old `\s*:?\s*`, plus
+# the full-width colon used on CJK forms)
+_SEPARATOR_CHARS = set(" \t\n\r:：")
+_VALUE_STRIP_CHARS = " \t\n\r:;,-"
+
+_FIELD_PATTERNS = {
+    "email": re.compile(r'[\w\.-]+@[\w\.-]+\.\w+'),
+    "phone": re.compile(r'\+?\d[\d\-\s().]{6,}\d'),
+    "age": re.compile(r'\b\d{1,3}\b'),
+    "dob": re.compile(r'\d{1,4}[./-]\d{1,2}[./-]\d{1,4}|\d{4}\s*[年년]\s*\d{1,2}\s*[月월]\s*\d{1,2}\s*[日일]?'),
+}
+
+
+def register_key_variants(language: str, variants: Dict[str, List[str]]) -> None:
+    """Register (or replace) the label variants of a language."""
+    global _automaton
+    with _automaton_lock:
+        _VARIANT_TABLES[language] = variants
+        _automaton = None
+
+
+def fold_text(text: str) -> str:
+    """Lowercase text character by character so offsets stay aligned with the original."""
+    return "".join(c if len(c.lower()) != 1 else c.lower() for c in text)
+
+
+def _is_ascii_word_char(c: str) -> bool:
+    return c.isascii() and c.isalpha()
+
+
+class _Automaton:
+    """Aho-Corasick automaton over the folded label variants of all languages."""
+
+    def __init__(self, keywords: List[Tuple[str, str, str]]):
+        # keywords: (folded label, field, language)
+        self.keywords = keywords
+        self.goto: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        self.out: List[List[int]] = [[]]
+
+        for kid, (label, _, _) in enumerate(keywords):
+            state = 0
+            for ch in label:
+                nxt = self.goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(self.goto)
+                    self.goto[state][ch] = nxt
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.out.append([])
+                state = nxt
+            self.out[state].append(kid)
+
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self.goto[state].items():
+                queue.append(nxt)
+                f = self.fail[state]
+                while f and ch not in self.goto[f]:
+                    f = self.fail[f]
+                self.fail[nxt] = self.goto[f].get(ch, 0)
+                self.out[nxt] = self.out[nxt] + self.out[self.fail[nxt]]
+
+    def iter_matches(self, folded: str):
+        """Yield (start, end, keyword_id) for every keyword occurrence in folded text."""
+        state = 0
+        for i, ch in enumerate(folded):
+            while state and ch not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(ch, 0)
+            for kid in self.out[state]:
+                yield i + 1 - len(self.keywords[kid][0]), i + 1, kid
+
+
+def _get_automaton() -> _Automaton:
+    global _automaton
+    with _automaton_lock:
+        if _automaton is None:
+            keywords = []
+            seen = {}
+            for language, table in _VARIANT_TABLES.items():
+                for field, variants in table.items():
+                    for variant in variants:
+                        folded = fold_text(variant.strip())
+                        if not folded:
+                            continue
+                        if folded in seen:
+                            if seen[folded] != field:
+                                logger.debug(f"Label '{variant}' ({language}) already maps to '{seen[folded]}', ignoring '{field}'")
+                            continue
+                        seen[folded] = field
+                        keywords.append((folded, field, language))
+            _automaton = _Automaton(keywords)
+            logger.info(f"Built label automaton with {len(keywords)} labels from {len(_VARIANT_TABLES)} languages")
+        return _automaton
+
+
+# ----------------------------
+# Scanning
+# ----------------------------
+class LabelMatch:
+    __slots__ = ("start", "end", "value_start", "label", "field", "language")
+
+    def __init__(self, start, end, value_start, label, field, language):
+        self.start = start
+        self.end = end
+        self.value_start = value_start
+        self.label = label
+        self.field = field
+        self.language = language
+
+    def __repr__(self):
+        return f"LabelMatch({self.label!r}->{self.field}, {self.start}:{self.end})"
+
+
+class LabelScan:
+    """
+    Result of scanning a page's OCR segments for labels.
+
+    Holds the joined text, the label matches in reading order and an
+    offset-to-detection index with score prefix sums, so the OCR confidence of
+    any text span is available in O(1).
+    """
+
+    def __init__(self, texts: List[str], scores: List[float]):
+        parts = []
+        owner = []
+        prefix = [0.0]
+        bounds = {}
+        length = 0
+        for i, segment in enumerate(texts):
+            segment = re.sub(r'\s+', ' ', str(segment)).strip()
+            score = float(scores[i]) if i < len(scores) and scores[i] is not None else 0.0
+            prefix.append(prefix[-1] + score)
+            if not segment:
+                continue
+            if parts:
+                parts.append(" ")
+                # separators belong to the preceding segment
+                owner.append(owner[-1])
+                length += 1
+            parts.append(segment)
+            owner.extend([i] * len(segment))
+            bounds[i] = (length, length + len(segment))
+            length += len(segment)
+
+        self.text = "".join(parts)
+        self._owner = owner
+        self._prefix = prefix
+        self._bounds = bounds
+        self.matches: List[LabelMatch] = []
+
+    def confidence_for_span(self, start: int, end: int) -> Optional[float]:
+        """Average OCR score of the detections that the text span [start, end) covers."""
+        if start >= end or not self._owner:
+            return None
+        start = max(0, min(start, len(self._owner) - 1))
+        end = max(start + 1, min(end, len(self._owner)))
+        first = self._owner[start]
+        if self.text[start] == " " and first + 1 <= self._owner[end - 1]:
+            first += 1
+        last = self._owner[end - 1]
+        return (self._prefix[last + 1] - self._prefix[first]) / (last - first + 1)
+
+    def detection_index_at(self, offset: int) -> Optional[int]:
+        """Index of the detection that produced the character at offset."""
+        if 0 <= offset < len(self._owner):
+            return self._owner[offset]
+        return None
+
+    def value_spans(self):
+        """
+        Yield (match, value_start, value_end, detached) for every label.
+
+        A value never leaves one detection: it runs to the end of the label's own
+        detection (or the next label), and a label alone in its detection takes
+        the following detection only. detached is True in that second case, where
+        the pairing rests on reading order alone.
+        """
+        for i, m in enumerate(self.matches):
+            end = self.matches[i + 1].start if i + 1 < len(self.matches) else len(self.text)
+            detection = self.detection_index_at(m.value_start)
+            if detection is None:
+                yield m, m.value_start, m.value_start, False
+                continue
+            end = min(end, self._bounds[detection][1])
+            yield m, m.value_start, end, detection != self.detection_index_at(m.start)
+
+
+def scan_texts(texts: List[str], scores: List[float], languages: Optional[List[str]] = None,
+               extra_labels: Optional[Dict[str, str]] = None) -> LabelScan:
+    """
+    Scan OCR segments for field labels of every registered language in a single pass.
+
+    Args:
+        texts: OCR text segments in reading order
+        scores: Recognition confidence per segment
+        languages: Restrict matches to these language tables (default: all)
+        extra_labels: Ad-hoc label -> field pairs (e.g. custom field names);
+            they win ties against registered labels
+
+    Returns:
+        LabelScan with leftmost-longest, non-overlapping label matches
+    """
+    scan = LabelScan(texts, scores)
+    text = scan.text
+    folded = fold_text(text)
+
+    automata = [(0, _get_automaton())]
+    if extra_labels:
+        automata.append((-1, _Automaton([(fold_text(label), field, "custom") for label, field in extra_labels.items() if label])))
+
+    candidates = []
+    for priority, automaton in automata:
+        for start, end, kid in automaton.iter_matches(folded):
+            label, field, language = automaton.keywords[kid]
+            if languages and language not in languages and language != "custom":
+                continue
+            # ASCII labels must stand on word boundaries ("age" must not fire inside "page")
+            if _is_ascii_word_char(label[0]) and start > 0 and _is_ascii_word_char(text[start - 1]):
+                continue
+            if _is_ascii_word_char(label[-1]) and end < len(text) and _is_ascii_word_char(text[end]):
+                continue
+            candidates.append((start, -(end - start), priority, end, field, language))
+
+    candidates.sort()
+    cursor = 0
+    for start, _, _, end, field, language in candidates:
+        if start < cursor:
+            continue
+        value_start = end
+        while value_start < len(text) and text[value_start] in _SEPARATOR_CHARS:
+            value_start += 1
+        scan.matches.append(LabelMatch(start, end, value_start, text[start:end], field, language))
+        cursor = value_start
+
+    return scan
+
+
+def scan_result(result: Dict, languages: Optional[List[str]] = None,
+                extra_labels: Optional[Dict[str, str]] = None) -> Optional[LabelScan]:
+    """Scan an extract_text_with_detection / extract_text result; None if it has no text."""
+    if "detections" in result:
+        texts = [d.get("text", "") for d in result["detections"]]
+        scores = [d.get("confidence", 0.0) for d in result["detections"]]
+    elif isinstance(result.get("texts"), list):
+        texts = result["texts"]
+        scores = result.get("scores", [])
+    else:
+        return None
+    return scan_texts(texts, scores, languages=languages, extra_labels=extra_labels)
+
+
+# ----------------------------
+# Rule-based mapping
+# ----------------------------
+def _strip_span(text: str, start: int, end: int, chars: str = _VALUE_STRIP_CHARS) -> Tuple[int, int]:
+    while start < end and text[start] in chars:
+        start += 1
+    while end > start and text[end - 1] in chars:
+        end -= 1
+    return start, end
+
+
+def _refine_span(field: str, text: str, start: int, end: int) -> Tuple[int, int]:
+    """Narrow a raw value span to the part that matches the field's pattern, if any."""
+    pattern = _FIELD_PATTERNS.get(field)
+    if pattern is not None:
+        m = pattern.search(text, start, end)
+        if m:
+            return m.start(), m.end()
+    return start, end
+
+
+def resolve_field(key: str) -> Optional[str]:
+    """
+    Resolve a field key or label (any registered language) to its canonical field.
+
+    "Full Name", "full_name" and "姓名" all resolve to "name"; unknown keys return None.
+    """
+    folded = fold_text(str(key).replace("_", " ").strip())
+    if not folded:
+        return None
+    if folded.replace(" ", "_") in DEFAULT_FIELDS:
+        return folded.replace(" ", "_")
+    automaton = _get_automaton()
+    for label, field, _ in automaton.keywords:
+        if label == folded:
+            return field
+    return None
+
+
+def _plan_fields(fields: List[str]) -> Tuple[Dict[str, str], Dict[str, str]]:
+    """Split requested keys into canonical targets and ad-hoc labels for unknown keys."""
+    targets = {}
+    extra_labels = {}
+    for key in fields:
+        canonical = resolve_field(key)
+        if canonical:
+            targets.setdefault(canonical, key)
+        else:
+            extra_labels[str(key).replace("_", " ").strip()] = key
+            targets.setdefault(key, key)
+    return targets, extra_labels
+
+
+def scan_for_fields(result: Dict, fields: Optional[List[str]] = None,
+                    languages: Optional[List[str]] = None) -> Optional[LabelScan]:
+    """Scan a result for the labels of all registered languages plus any unknown requested keys."""
+    _, extra_labels = _plan_fields(list(fields) if fields else list(DEFAULT_FIELDS))
+    return scan_result(result, languages=languages, extra_labels=extra_labels)
+
+
+def scan_field_values(scan: Optional[LabelScan], fields: Optional[List[str]] = None) -> Dict:
+    """
+    Map a LabelScan to the requested fields, with how each value was found.
+
+    Args:
+        scan: Output of scan_for_fields (None means no text)
+        fields: Requested field keys (default: DEFAULT_FIELDS); results are keyed exactly as requested
+
+    Returns:
+        Dict of field -> {"value": str | None, "confidence": float | None, "detached": bool}
+        where detached marks a value taken from the detection after a label that
+        stands alone (see LabelScan.value_spans)
+    """
+    fields = list(fields) if fields else list(DEFAULT_FIELDS)
+    mapped = {field: {"value": None, "confidence": None, "detached": False} for field in fields}
+    if scan is None:
+        return mapped
+
+    targets, _ = _plan_fields(fields)
+    text = scan.text
+
+    for m, start, end, detached in scan.value_spans():
+        key = targets.get(m.field)
+        if key is None or mapped[key]["value"] is not None:
+            continue
+        start, end = _strip_span(text, start, end)
+        start, end = _refine_span(m.field, text, start, end)
+        start, end = _strip_span(text, start, end, " \t\n\r,:;")
+        if start < end:
+            mapped[key] = {"value": text[start:end], "confidence": scan.confidence_for_span(start, end),
+                           "detached": detached}
+
+    # Fallback patterns over the whole page
+    for field in ("email", "phone"):
+        key = targets.get(field)
+        if key is not None and mapped[key]["value"] is None:
+            m = _FIELD_PATTERNS[field].search(text)
+            if m:
+                mapped[key] = {"value": m.group(0).strip(), "confidence": scan.confidence_for_span(m.start(), m.end()),
+                               "detached": False}
+
+    return mapped
+
+
+def map_scan_fields(scan: Optional[LabelScan], fields: Optional[List[str]] = None) -> Dict:
+    """
+    Map a LabelScan to the requested fields.
+
+    Args:
+        scan: Output of scan_for_fields (None means no text)
+        fields: Requested field keys (default: DEFAULT_FIELDS); results are keyed exactly as requested
+
+    Returns:
+        Dict of field -> {"value": str | None, "confidence": float | None}
+    """
+    return {field: {"value": data["value"], "confidence": data["confidence"]}
+            for field, data in scan_field_values(scan, fields).items()}
+
+
+def map_labeled_fields(result: Dict, fields: Optional[List[str]] = None,
+                       languages: Optional[List[str]] = None) -> Dict:
+    """
+    Map OCR output to structured fields using the shared label scanner.
+
+    Args:
+        result: Output of extract_text_with_detection (or extract_text)
+        fields: Fields to map (default: DEFAULT_FIELDS)
+        languages: Restrict label tables to these languages (default: all)
+
+    Returns:
+        Dict of field -> {"value": str | None, "confidence": float | None}
+    """
+    scan = scan_for_fields(result, fields, languages=languages)
+    if scan is not None:
+        logger.info(f"Full Text for mapping: {scan.text}")
+    mapped = map_scan_fields(scan, fields)
+    logger.info(f"Final mapped fields: {mapped}")
+    return mapped
@@ -0,0 +1,234 @@
+import logging
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .label_scanner import DEFAULT_FIELDS, resolve_field, fold_text, _plan_fields
+
+logger = logging.getLogger(__name__)
+
+# A value box directly below its label may be at most this many text heights away
+BELOW_MAX_LINES = 2.5
+# A value to the right of its label may be at most this many text heights away
+RIGHT_MAX_HEIGHTS = 25.0
+# Extra cost (in text heights) of a value below its label compared to one on the same line
+BELOW_PENALTY = 1.0
+
+_LABEL_STRIP_CHARS = " \t:：-"
+
+
+# ----------------------------
+# Segments
+# ----------------------------
+def _box_bounds(box) -> Optional[Tuple[float, float, float, float]]:
+    """(x1, y1, x2, y2) from a bbox dict or a polygon / flat coordinate list; None if unusable."""
+    if isinstance(box, dict):
+        try:
+            return float(box["x1"]), float(box["y1"]), float(box["x2"]), float(box["y2"])
+        except (KeyError, TypeError, ValueError):
+            return None
+    try:
+        flat = [float(v) for point in box for v in (point if isinstance(point, (list, tuple, np.ndarray)) else [point])]
+    except (TypeError, ValueError):
+        return None
+    if len(flat) < 4:
+        return None
+    xs, ys = flat[0::2], flat[1::2]
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+def result_segments(result: Dict) -> List[Dict]:
+    """
+    OCR segments of an extraction result as {"index", "text", "confidence", "bounds"}.
+
+    Works with extract_text_with_detection output (detections) and extract_text
+    output (texts/scores/boxes); bounds is None when there is no usable geometry.
+    """
+    if "detections" in result:
+        items = [(d.get("text", ""), d.get("confidence"), d.get("bbox") or d.get("polygon"))
+                 for d in result["detections"]]
+    elif isinstance(result.get("texts"), list):
+        scores = result.get("scores") or []
+        boxes = result.get("boxes") or []
+        items = [(text, scores[i] if i < len(scores) else None, boxes[i] if i < len(boxes) else None)
+                 for i, text in enumerate(result["texts"])]
+    else:
+        return []
+
+    segments = []
+    for i, (text, confidence, box) in enumerate(items):
+        try:
+            confidence = float(confidence) if confidence is not None else None
+        except (TypeError, ValueError):
+            confidence = None
+        segments.append({
+            "index": i,
+            "text": str(text).strip(),
+            "confidence": confidence,
+            "bounds": _box_bounds(box) if box is not None else None,
+        })
+    return segments
+
+
+# ----------------------------
+# Line and column clustering
+# ----------------------------
+def _median_height(boxes: np.ndarray) -> float:
+    return max(float(np.median(boxes[:, 3] - boxes[:, 1])), 1.0)
+
+
+def cluster_lines(boxes: np.ndarray) -> np.ndarray:
+    """
+    Line id per box (N x 4 array of x1, y1, x2, y2), numbered top to bottom.
+
+    Boxes are sorted by vertical center; a new line starts wherever the gap
+    between consecutive centers exceeds half the median text height.
+    """
+    if len(boxes) == 0:
+        return np.zeros(0, dtype=int)
+    centers = (boxes[:, 1] + boxes[:, 3]) / 2
+    order = np.argsort(centers, kind="stable")
+    breaks = np.diff(centers[order]) > _median_height(boxes) / 2
+    line_ids = np.empty(len(boxes), dtype=int)
+    line_ids[order] = np.concatenate(([0], np.cumsum(breaks)))
+    return line_ids
+
+
+def cluster_columns(boxes: np.ndarray) -> np.ndarray:
+    """
+    Column id per box, numbered left to right.
+
+    Boxes are projected on the x axis; a new column starts wherever a gap wider
+    than the median text height separates the projections. Text that spans the
+    page (titles) joins everything into one column.
+    """
+    if len(boxes) == 0:
+        return np.zeros(0, dtype=int)
+    order = np.argsort(boxes[:, 0], kind="stable")
+    x1, x2 = boxes[order, 0], boxes[order, 2]
+    reach = np.maximum.accumulate(x2)
+    breaks = x1[1:] - reach[:-1] > _median_height(boxes)
+    column_ids = np.empty(len(boxes), dtype=int)
+    column_ids[order] = np.concatenate(([0], np.cumsum(breaks)))
+    return column_ids
+
+
+def reading_order_lines(segments: List[Dict]) -> List[List[Dict]]:
+    """
+    Group segments into lines, top to bottom and left to right within a line.
+
+    Segments without geometry keep engine order as lines of their own, after
+    the positioned ones.
+    """
+    positioned = [s for s in segments if s["bounds"] is not None]
+    loose = [[s] for s in segments if s["bounds"] is None]
+    if not positioned:
+        return loose
+
+    boxes = np.array([s["bounds"] for s in positioned], dtype=float)
+    line_ids = cluster_lines(boxes)
+    order = np.lexsort((boxes[:, 0], line_ids))
+    lines = []
+    for i in order:
+        if not lines or line_ids[i] != line_ids[lines[-1][-1]]:
+            lines.append([])
+        lines[-1].append(i)
+    return [[positioned[i] for i in line] for line in lines] + loose
+
+
+# ----------------------------
+# Key/value pairing
+# ----------------------------
+def _label_key(text: str, targets: Dict[str, str], extra_labels: Dict[str, str]) -> Optional[str]:
+    """Requested key a label-only segment stands for ("Name:" -> "name"), else None."""
+    label = text.strip(_LABEL_STRIP_CHARS)
+    if not label:
+        return None
+    canonical = resolve_field(label)
+    if canonical in targets:
+        return targets[canonical]
+    folded = fold_text(label)
+    for extra, key in extra_labels.items():
+        if fold_text(extra) == folded:
+            return key
+    return None
+
+
+def pair_key_values(result: Dict, fields: Optional[List[str]] = None) -> Dict[str, Dict]:
+    """
+    Pair label boxes with value boxes by spatial proximity.
+
+    A segment that is only a label ("Date of Birth:", "氏名") is paired with the
+    nearest non-label box either to its right on the same line or directly below
+    it (overlapping horizontally), never reaching past the next label in that
+    direction. Pairs are assigned greedily by distance, so every label and value
+    is used at most once. Segments that carry label and value together are left
+    to the label scanner.
+
+    Args:
+        result: Output of extract_text_with_detection (or extract_text)
+        fields: Requested field keys (default: DEFAULT_FIELDS)
+
+    Returns:
+        Dict of requested key -> {"value", "confidence", "label_index", "value_index"}
+        for the fields that could be paired
+    """
+    fields = list(fields) if fields else list(DEFAULT_FIELDS)
+    targets, extra_labels = _plan_fields(fields)
+    segments = [s for s in result_segments(result) if s["text"] and s["bounds"] is not None]
+    if len(segments) < 2:
+        return {}
+
+    keys = [_label_key(s["text"], targets, extra_labels) for s in segments]
+    is_label = np.array([key is not None for key in keys])
+    if not is_label.any() or is_label.all():
+        return {}
+
+    boxes = np.array([s["bounds"] for s in segments], dtype=float)
+    height = _median_height(boxes)
+    line_ids = cluster_lines(boxes)
+    labels = np.flatnonzero(is_label)
+    values = np.flatnonzero(~is_label)
+
+    lb, vb = boxes[labels][:, None, :], boxes[values][None, :, :]
+    same_line = line_ids[labels][:, None] == line_ids[values][None, :]
+    dx = vb[..., 0] - lb[..., 2]
+    dy = vb[..., 1] - lb[..., 3]
+    x_overlap = np.minimum(lb[..., 2], vb[..., 2]) - np.maximum(lb[..., 0], vb[..., 0]) > 0
+
+    # Nearest other label to the right on the same line / below in the same x band
+    ll, lo = boxes[labels][:, None, :], boxes[labels][None, :, :]
+    label_dx = np.where((line_ids[labels][:, None] == line_ids[labels][None, :]) & (lo[..., 0] >= ll[..., 2]),
+                        lo[..., 0] - ll[..., 2], np.inf)
+    label_dy = np.where((np.minimum(ll[..., 2], lo[..., 2]) - np.maximum(ll[..., 0], lo[..., 0]) > 0)
+                        & (lo[..., 1] >= ll[..., 3]), lo[..., 1] - ll[..., 3], np.inf)
+    next_right = label_dx.min(axis=1)[:, None]
+    next_below = label_dy.min(axis=1)[:, None]
+
+    right = same_line & (dx >= -height / 2) & (dx <= RIGHT_MAX_HEIGHTS * height) & (dx < next_right)
+    below = (~same_line & x_overlap & (dy >= -height / 4) & (dy <= BELOW_MAX_LINES * height)
+             & (dy < next_below))
+    cost = np.full(right.shape, np.inf)
+    cost[below] = dy[below] + BELOW_PENALTY * height
+    cost[right] = np.maximum(dx[right], 0.0)
+
+    pairs = {}
+    used_values = set()
+    flat = np.argsort(cost, axis=None, kind="stable")
+    for li, vi in zip(*np.unravel_index(flat, cost.shape)):
+        if not np.isfinite(cost[li, vi]):
+            break
+        key = keys[labels[li]]
+        if key in pairs or vi in used_values:
+            continue
+        value_seg = segments[values[vi]]
+        pairs[key] = {
+            "value": value_seg["text"],
+            "confidence": value_seg["confidence"],
+            "label_index": segments[labels[li]]["index"],
+            "value_index": value_seg["index"],
+        }
+        used_values.add(vi)
+
+    logger.info(f"Layout paired {len(pairs)} of {len(set(k for k in keys if k))} label boxes with values")
+    return pairs
@@ -1,57 +1,90 @@
 import os
 import shutil
 import uuid
+import time
 import json
 import logging
+from typing import Optional
 from fastapi import FastAPI, UploadFile, File, Form
 from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from PIL import Image
-from fastapi import FastAPI, File, UploadFile, HTTPException
+from fastapi import FastAPI, File, UploadFile, HTTPException, Request
 from fastapi.responses import JSONResponse
 import PyPDF2
 import io
-from pdf2image import convert_from_bytes
 from io import BytesIO
 import base64
+import hashlib
+from typing import List
+from concurrent.futures import as_completed, wait
+from fastapi.responses import StreamingResponse
 
 # --- Language-Specific Imports ---
 # Default English processors
 from app.extraction import (
     extract_text_with_detection as extract_text_with_detection_en,
     map_fields as map_fields_en,
+    map_fields_batch as map_fields_batch_en,
     create_confidence_overlay as create_confidence_overlay_en,
+    engine as engine_en,
 )
 
 # Chinese processors
 from app.chinese_extraction import (
     extract_text_with_detection as extract_text_with_detection_ch,
     map_fields as map_fields_ch,
-    create_confidence_overlay as create_confidence_overlay_ch
+    map_fields_batch as map_fields_batch_ch,
+    create_confidence_overlay as create_confidence_overlay_ch,
+    engine as engine_ch,
 )
 
 # Japanese processors
 from app.japanese_extraction import (
     extract_text_with_detection as extract_text_with_detection_ja,
     map_fields as map_fields_ja,
-    create_confidence_overlay as create_confidence_overlay_ja
+    map_fields_batch as map_fields_batch_ja,
+    create_confidence_overlay as create_confidence_overlay_ja,
+    engine as engine_ja,
 )
 
 # Korean processors
 from app.korean_extraction import (
     extract_text_with_detection as extract_text_with_detection_ko,
     map_fields as map_fields_ko,
-    create_confidence_overlay as create_confidence_overlay_ko
+    map_fields_batch as map_fields_batch_ko,
+    create_confidence_overlay as create_confidence_overlay_ko,
+    engine as engine_ko,
 )
 
 # --- Common Utility Imports ---
-from app.verification import verify_fields
+from app.verification import verify_mapped_fields, verification_fields, covers_fields
+from app.mapper_client import mapper_status
 from app.quality import check_image_quality
+from app.templates import (
+    register_template,
+    delete_template,
+    list_templates,
+    has_templates,
+    match_template,
+    extract_with_template,
+)
+from app.region_ocr import ocr_regions, parse_region
+from app.sessions import store as session_store, extractions as extraction_store, file_sha256
+from app import ocr_pool
+from app.admission import controller as admission, estimate_cost, Rejected
+from app.jobs import queue as job_queue
+from app.field_mapping import map_fields_hybrid, map_fields_document
+from app.field_search import FIND_MIN_CONFIDENCE, parse_page_order, find_fields
+from app.page_classifier import PAGE_CLASSIFIER_ENABLED, PageClassifier
 from app.utils import (
     is_pdf_file,
-    get_pdf_page_count,
-    convert_pdf_to_images,
-    save_image_temporarily
+    is_tiff_file,
+    is_multipage_file,
+    get_page_count,
+    iter_tiff_frames,
+    load_page,
+    convert_pdf_to_image
 )
 
 # Setup logging
@@ -84,53 +117,185 @@ def get_language_processors(lang: str):
         return {
             "extract_with_detection": extract_text_with_detection_ch,
             "map_fields": map_fields_ch,
+            "map_fields_batch": map_fields_batch_ch,
             "create_overlay": create_confidence_overlay_ch,
+            "engine": engine_ch,
         }
     elif lang == 'ja':
         return {
             "extract_with_detection": extract_text_with_detection_ja,
             "map_fields": map_fields_ja,
+            "map_fields_batch": map_fields_batch_ja,
             "create_overlay": create_confidence_overlay_ja,
+            "engine": engine_ja,
         }
     elif lang == 'ko':
         return {
             "extract_with_detection": extract_text_with_detection_ko,
             "map_fields": map_fields_ko,
+            "map_fields_batch": map_fields_batch_ko,
             "create_overlay": create_confidence_overlay_ko,
+            "engine": engine_ko,
         }
     else:  # Default to English
         return {
             "extract_with_detection": extract_text_with_detection_en,
             "map_fields": map_fields_en,
+            "map_fields_batch": map_fields_batch_en,
             "create_overlay": create_confidence_overlay_en,
+            "engine": engine_en,
         }
 
+def resolve_document(document: Optional[UploadFile], document_id: str = ""):
+    """
+    The file a request works on: the document session's file when document_id
+    is given, else the upload saved to UPLOAD_DIR.
+
+    Returns (file_path, session); session is None for a one-off upload.
+    """
+    if document_id:
+        session = session_store.get(document_id)
+        if session is None:
+            raise HTTPException(status_code=404, detail=f"Document session '{document_id}' not found or expired")
+        return session.path, session
+    if document is None:
+        raise HTTPException(status_code=400, detail="Either 'document' or 'document_id' is required")
+
+    file_id = str(uuid.uuid4())
+    temp_path = os.path.join(UPLOAD_DIR, f"{file_id}_{document.filename}")
+    with open(temp_path, "wb") as buffer:
+        shutil.copyfileobj(document.file, buffer)
+    return temp_path, None
+
+def release_document(file_path: str, session=None):
+    """Remove a one-off upload; session files stay until the session is evicted."""
+    if session is None and os.path.exists(file_path):
+        os.remove(file_path)
+
+def client_id(request: Request) -> str:
+    """Client for fair sharing of OCR capacity: the X-Client-ID header, else the caller's address."""
+    return request.headers.get("x-client-id") or (request.client.host if request.client else "unknown")
+
+def admit_document(request: Request, file_path: str, session=None, pages: Optional[int] = None):
+    """
+    Admit OCR of 'pages' pages of a document (default: all of them) against
+    the in-flight budget. Returns a ticket to release when the work is done.
+
+    Raises HTTPException 429 with Retry-After when saturated; the upload is released.
+    """
+    try:
+        return admission.admit(client_id(request), estimate_cost(file_path, pages))
+    except Rejected as e:
+        release_document(file_path, session)
+        raise HTTPException(status_code=429, detail=e.reason, headers={"Retry-After": str(e.retry_after)})
+
+def run_detection(processors: dict, language: str, file_path: str, page_number: int = 1, session=None,
+                  image: Optional[Image.Image] = None) -> dict:
+    """
+    extract_with_detection, reusing the session's page raster and cached OCR
+    result when there is one (or an already rasterized page image).
+    """
+    if session is None:
+        if image is None and is_multipage_file(file_path):
+            # Every extractor gets the decoded page (only the English one reads PDF/TIFF pages itself)
+            image = load_page(file_path, page_number)
+        return processors["extract_with_detection"](file_path, page_number=page_number, image=image)
+    return session.cached("ocr", (language, page_number), lambda: processors["extract_with_detection"](
+        file_path, page_number=page_number, image=session.page_image(page_number)))
+
+def map_detection(processors: dict, language: str, detection_result: dict, custom_fields: list,
+                  page_number: int = 1, session=None) -> dict:
+    """map_fields on a detection result, cached per language, page and field list in the document session."""
+    def compute():
+        if custom_fields:
+            return processors["map_fields"](detection_result, custom_fields=custom_fields)
+        return processors["map_fields"](detection_result)
+    if session is None:
+        return compute()
+    return session.cached("mapped", (language, page_number, tuple(custom_fields or ())), compute)
+
+def load_page_image(file_path: str, page_number: int = 1, session=None) -> Image.Image:
+    """Page image of an uploaded image, PDF page or TIFF frame (cached in the document session, if any)."""
+    if session is not None:
+        return session.page_image(page_number)
+    return load_page(file_path, page_number)
+
+def iter_page_images(file_path: str, session=None):
+    """(page_number, image) for every page of a PDF or TIFF, rasterized or decoded one page at a time."""
+    if session is not None:
+        for page_num in range(1, session.page_count() + 1):
+            yield page_num, session.page_image(page_num)
+    elif is_tiff_file(file_path):
+        yield from iter_tiff_frames(file_path)
+    else:
+        for page_num in range(1, get_page_count(file_path) + 1):
+            yield page_num, convert_pdf_to_image(file_path, page_number=page_num, dpi=200)
+
+def format_template_fields(mapped: dict, lang: str) -> dict:
+    """Template results in the language's mapped_fields shape (plain values for English)."""
+    if lang in ("ch", "ja", "ko"):
+        return {field: {"value": data["value"], "confidence": data["confidence"]} for field, data in mapped.items()}
+    return {field: (data["value"] or "") for field, data in mapped.items()}
+
+def parse_regions_form(regions: str, file_path: str, page_number: int = 1, session=None):
+    """
+    Parse the 'regions' form field (JSON list of boxes in page pixels).
+
+    Returns (page image, clipped regions), or None when no regions were sent.
+    Raises ValueError for invalid JSON or boxes.
+    """
+    if not regions or not regions.strip():
+        return None
+    try:
+        raw = json.loads(regions)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"Invalid JSON in regions: {e}")
+    if not isinstance(raw, list) or not raw:
+        raise ValueError("regions must be a non-empty JSON list")
+    image = load_page_image(file_path, page_number, session)
+    return image, [parse_region(region, image.width, image.height) for region in raw]
+
 # --- API Endpoints ---
 @app.post("/extract")
-async def extract(
-    document: UploadFile = File(...),
+def extract(
+    request: Request,
+    document: Optional[UploadFile] = File(None),
+    document_id: str = Form(default=""),
     include_detection: str = Form(default="false"),
     page_number: int = Form(default=1),
     language: str = Form(default="en"),
-    fields: str = Form(default="")  # NEW: fields parameter as JSON string
+    fields: str = Form(default=""),  # NEW: fields parameter as JSON string
+    regions: str = Form(default="")
 ):
     """
     Extract text & structured fields from a document (image or single PDF page).
     Supports multiple languages: en, ch, ja, ko.
     Now supports custom field extraction via 'fields' parameter.
+    'regions' (JSON list of page-pixel boxes) limits OCR to those crops.
     """
-    file_id = str(uuid.uuid4())
-    temp_path = os.path.join(UPLOAD_DIR, f"{file_id}_{document.filename}")
-
-    with open(temp_path, "wb") as buffer:
-        shutil.copyfileobj(document.file, buffer)
+    temp_path, session = resolve_document(document, document_id)
+    ticket = admit_document(request, temp_path, session, pages=1)
 
     try:
         processors = get_language_processors(language.lower())
         is_pdf = is_pdf_file(temp_path)
 
+        # Images and TIFFs are quality-checked, PDFs are not; a TIFF page is checked once
+        # decoded and the decoded page is reused for OCR
+        page_image = None
         if not is_pdf:
-            quality_report = check_image_quality(temp_path)
+            if is_tiff_file(temp_path):
+                try:
+                    page_image = load_page_image(temp_path, page_number, session)
+                except Exception as e:
+                    return JSONResponse(status_code=400, content={"error": f"Could not read page {page_number}: {e}"})
+                check_quality = lambda: check_image_quality(temp_path, image=page_image)
+            else:
+                check_quality = lambda: check_image_quality(temp_path)
+            if session is not None:
+                quality_report = session.cached("quality", (page_number,), check_quality)
+            else:
+                quality_report = check_quality()
             if quality_report["score"] < 30:
                 return JSONResponse(
                     status_code=400,
@@ -150,24 +315,58 @@ async def extract(
                 logger.warning(f"Invalid fields JSON: {e}, using default fields")
                 custom_fields = []
 
-        # Consistent extraction using the detailed function
-        detection_result = processors["extract_with_detection"](temp_path, page_number=page_number)
-        print(detection_result)
+        try:
+            page_regions = parse_regions_form(regions, temp_path, page_number, session)
+        except ValueError as e:
+            return JSONResponse(status_code=400, content={"error": str(e)})
 
-        if "error" in detection_result:
-            return JSONResponse(status_code=500, content={"error": detection_result["error"]})
+        # Registered form layouts: OCR only the field zones and skip mapping
+        template_info = None
+        template_result = None
+        if page_regions is None and has_templates():
+            if page_image is None:
+                page_image = load_page_image(temp_path, page_number, session)
+            template, distance = match_template(page_image)
+            if template is not None:
+                template_result = extract_with_template(processors["engine"], page_image, template, custom_fields or None)
+                template_info = {"name": template["name"], "distance": distance, "used": template_result is not None}
 
-        # Pass custom fields to map_fields function
-        if custom_fields:
-            fields = processors["map_fields"](detection_result, custom_fields=custom_fields)
+        if template_result is not None:
+            detection_result = template_result["ocr"]
+            fields = format_template_fields(template_result["fields"], language.lower())
         else:
-            fields = processors["map_fields"](detection_result)
+            if page_regions is not None:
+                detection_result = ocr_regions(processors["engine"], page_regions[0], page_regions[1])
+            else:
+                # Consistent extraction using the detailed function
+                detection_result = run_detection(processors, language.lower(), temp_path, page_number, session,
+                                                 image=page_image)
+            print(detection_result)
+
+            if "error" in detection_result:
+                return JSONResponse(status_code=500, content={"error": detection_result["error"]})
+
+            if page_regions is not None:
+                fields = map_detection(processors, language.lower(), detection_result, custom_fields)
+            else:
+                fields = map_detection(processors, language.lower(), detection_result, custom_fields,
+                                       page_number, session)
+
+        # Kept so /verify on the same document can skip OCR and mapping
+        extraction_id = None
+        if page_regions is None:
+            extraction_id = extraction_store.put(
+                fields, language.lower(), page_number,
+                session.sha256() if session is not None else file_sha256(temp_path),
+                fields=custom_fields, document_id=session.id if session is not None else None,
+            )
 
         # Return detection data only if requested
         if include_detection.lower() == "true":
             overlay_image = processors["create_overlay"](temp_path, detection_result["detections"])
             return {
                 "mapped_fields": fields,
+                "extraction_id": extraction_id,
                 "detections": detection_result["detections"],
                 "total_detections": detection_result["total_detections"],
                 "confidence_overlay": overlay_image,
@@ -177,46 +376,70 @@ async def extract(
                     "elapsed_time": detection_result.get("elapsed_time", 0),
                     "page_number": page_number,
                     "is_pdf": is_pdf,
-                    "custom_fields_used": len(custom_fields) if custom_fields else 0
+                    "custom_fields_used": len(custom_fields) if custom_fields else 0,
+                    "template": template_info,
+                    "regions": detection_result.get("regions")
                 }
             }
         else:
             return {
                 "mapped_fields": fields,
+                "extraction_id": extraction_id,
                 "has_detection_data": False,
                 "processing_info": {
                     "language": detection_result.get("language", language),
                     "elapsed_time": detection_result.get("elapsed_time", 0),
                     "page_number": page_number,
                     "is_pdf": is_pdf,
-                    "custom_fields_used": len(custom_fields) if custom_fields else 0
+                    "custom_fields_used": len(custom_fields) if custom_fields else 0,
+                    "template": template_info,
+                    "regions": detection_result.get("regions")
                 }
             }
 
     finally:
-        if os.path.exists(temp_path):
-            os.remove(temp_path)
+        ticket.release()
+        release_document(temp_path, session)
 
 @app.post("/extract/pdf/all")
-async def extract_pdf_all_pages(
-    document: UploadFile = File(...),
+def extract_pdf_all_pages(
+    request: Request,
+    document: Optional[UploadFile] = File(None),
+    document_id: str = Form(default=""),
     language: str = Form(default="en"),
-    fields: str = Form(default="")  # NEW: fields parameter for multipage
+    fields: str = Form(default=""),  # NEW: fields parameter for multipage
+    mode: str = Form(default="all"),
+    page_order: str = Form(default=""),
+    min_confidence: float = Form(default=FIND_MIN_CONFIDENCE),
+    skip_pages: str = Form(default="true"),
+    stream: str = Form(default="false")
 ):
-    """Extract structured data from all pages of a PDF document in the specified language."""
-    file_id = str(uuid.uuid4())
-    temp_path = os.path.join(UPLOAD_DIR, f"{file_id}_{document.filename}")
+    """
+    Extract structured data from all pages of a PDF document in the specified language.
 
-    with open(temp_path, "wb") as buffer:
-        shutil.copyfileobj(document.file, buffer)
+    mode="find" searches pages in 'page_order' (natural, reverse, ends or a JSON
+    list) only until every requested field is found with at least
+    'min_confidence', and returns the merged fields with their page numbers.
+    mode="document" OCRs every page and maps one set of fields for the whole
+    document, in one (or a few chunked) LLM calls, with each field's page and detection.
 
-    try:
-        if not is_pdf_file(temp_path):
-            return JSONResponse(status_code=400, content={"error": "File is not a PDF document"})
+    Blank pages are not OCR'd and duplicate pages reuse the earlier page's
+    result (skip_pages="false" turns this off); both are listed in 'skipped_pages'.
+
+    Multi-page TIFFs go through the same pipeline, one frame at a time.
+    stream="true" (default mode) returns NDJSON, one line per page as it finishes.
+    """
+    temp_path, session = resolve_document(document, document_id)
+    if not is_multipage_file(temp_path):
+        release_document(temp_path, session)
+        return JSONResponse(status_code=400, content={"error": "File is not a PDF or TIFF document"})
+    ticket = admit_document(request, temp_path, session)
+    streaming = False
 
+    try:
         processors = get_language_processors(language.lower())
         extract_page_func = processors["extract_with_detection"]
-        map_fields_func = processors["map_fields"]
+        map_fields_batch_func = processors["map_fields_batch"]
 
         # Parse custom fields
         custom_fields = []
@@ -228,64 +451,160 @@ async def extract_pdf_all_pages(
                 logger.warning(f"Invalid fields JSON: {e}, using default fields")
                 custom_fields = []
 
-        total_pages = get_pdf_page_count(temp_path)
-        images = convert_pdf_to_images(temp_path, dpi=200)
+        lang = language.lower()
+        classifier = PageClassifier() if PAGE_CLASSIFIER_ENABLED and skip_pages.lower() == "true" else None
+        skipped_pages = {}
 
-        processed_pages = {}
-        for page_num, image in enumerate(images, 1):
-            page_temp_path = save_image_temporarily(image, suffix='.png')
+        def should_ocr(page_num: int, image: Image.Image) -> bool:
+            """Classify a page before OCR; blank and duplicate pages are recorded and skipped."""
+            if classifier is None:
+                return True
+            status = classifier.classify(page_num, image)
+            if status["status"] == "content":
+                return True
+            skipped_pages[page_num] = status
+            return False
+
+        if mode.lower() == "find":
+            total_pages = session.page_count() if session is not None else get_page_count(temp_path)
             try:
-                page_data = extract_page_func(page_temp_path, page_number=page_num)
-                if "error" in page_data:
-                    processed_pages[str(page_num)] = {"error": page_data["error"], "page_number": page_num}
-                    continue
+                order = parse_page_order(page_order, total_pages)
+            except ValueError as e:
+                return JSONResponse(status_code=400, content={"error": str(e)})
+            def detect(page_num: int) -> dict:
+                image = load_page_image(temp_path, page_num, session)
+                if not should_ocr(page_num, image):
+                    return {"detections": [], "texts": [], "scores": [], "total_detections": 0}
+                return run_detection(processors, lang, temp_path, page_num, session, image=image)
 
-                # Pass custom fields to map_fields
-                if custom_fields:
-                    page_fields = map_fields_func(page_data, custom_fields=custom_fields)
-                else:
-                    page_fields = map_fields_func(page_data)
+            # Pages are rasterized and OCR'd one at a time, only as far as the search goes
+            search = find_fields(
+                order,
+                detect,
+                lambda page_data, missing: map_fields_hybrid(page_data, custom_fields=missing,
+                                                             threshold=min_confidence),
+                custom_fields or None,
+                min_confidence,
+            )
+            return {
+                "total_pages": total_pages,
+                "mode": "find",
+                **search,
+                "skipped_pages": skipped_pages,
+                "is_pdf": is_pdf_file(temp_path),
+                "custom_fields_used": len(custom_fields) if custom_fields else 0
+            }
+
+        # Rasters and OCR results are reused from (and kept in) the document session;
+        # otherwise PDF pages are rasterized and TIFF frames decoded one at a time
+        total_pages = session.page_count() if session is not None else get_page_count(temp_path)
+        pages = iter_page_images(temp_path, session)
 
+        def ocr_page(page_num: int, image: Image.Image) -> dict:
+            if session is not None:
+                return run_detection(processors, lang, temp_path, page_num, session)
+            return extract_page_func(temp_path, page_number=page_num, image=image)
+
+        if stream.lower() == "true" and mode.lower() == "all":
+            streaming = True
+            return StreamingResponse(
+                stream_page_results(pages, total_pages, ocr_page, should_ocr, skipped_pages,
+                                    processors, lang, custom_fields, session, temp_path, ticket),
+                media_type="application/x-ndjson",
+            )
+
+        # OCR every page first, then hand all mapping work to the mapper in one batch
+        processed_pages = {}
+        page_results = []
+        for page_num, image in pages:
+            if not should_ocr(page_num, image):
+                continue
+            page_data = ocr_page(page_num, image)
+            if "error" in page_data:
+                processed_pages[str(page_num)] = {"error": page_data["error"], "page_number": page_num}
+                continue
+            page_results.append((page_num, page_data))
+
+        if mode.lower() == "document":
+            document_fields = map_fields_document(
+                [page_data for _, page_data in page_results],
+                custom_fields=custom_fields or None,
+                page_numbers=[page_num for page_num, _ in page_results],
+            )
+            for page_num, page_data in page_results:
                 processed_pages[str(page_num)] = {
-                    "mapped_fields": page_fields,
+                    "page_status": "content",
                     "detections": page_data.get("detections", []),
-                    "processing_info": {
-                        "language": page_data.get("language", language),
-                        "page_number": int(page_num),
-                        "custom_fields_used": len(custom_fields) if custom_fields else 0
-                    }
+                    "processing_info": {"language": page_data.get("language", language), "page_number": int(page_num)}
                 }
-            finally:
-                if os.path.exists(page_temp_path):
-                    os.remove(page_temp_path)
+            add_skipped_pages(processed_pages, skipped_pages, language)
+            return {
+                "total_pages": total_pages,
+                "mode": "document",
+                "fields": document_fields,
+                "pages": dict(sorted(processed_pages.items(), key=lambda item: int(item[0]))),
+                "skipped_pages": skipped_pages,
+                "is_pdf": is_pdf_file(temp_path),
+                "custom_fields_used": len(custom_fields) if custom_fields else 0
+            }
+
+        pages_fields = map_fields_batch_func([page_data for _, page_data in page_results], custom_fields=custom_fields or None)
+
+        for (page_num, page_data), page_fields in zip(page_results, pages_fields):
+            processed_pages[str(page_num)] = {
+                "page_status": "content",
+                "mapped_fields": page_fields,
+                "detections": page_data.get("detections", []),
+                "processing_info": {
+                    "language": page_data.get("language", language),
+                    "page_number": int(page_num),
+                    "custom_fields_used": len(custom_fields) if custom_fields else 0
+                }
+            }
+        add_skipped_pages(processed_pages, skipped_pages, language)
+        processed_pages = dict(sorted(processed_pages.items(), key=lambda item: int(item[0])))
 
         return {
             "total_pages": total_pages,
             "pages": processed_pages,
-            "is_pdf": True,
+            "skipped_pages": skipped_pages,
+            "is_pdf": is_pdf_file(temp_path),
             "custom_fields_used": len(custom_fields) if custom_fields else 0
         }
 
     finally:
-        if os.path.exists(temp_path):
-            os.remove(temp_path)
+        # A streamed response releases the document and its admission when the stream ends
+        if not streaming:
+            ticket.release()
+            release_document(temp_path, session)
 
 @app.post("/detect")
-async def detect_text_regions(
-    document: UploadFile = File(...),
+def detect_text_regions(
+    request: Request,
+    document: Optional[UploadFile] = File(None),
+    document_id: str = Form(default=""),
     page_number: int = Form(default=1),
-    language: str = Form(default="en")
+    language: str = Form(default="en"),
+    regions: str = Form(default="")
 ):
-    """Get text detection regions and confidence zones only for a specific language."""
-    file_id = str(uuid.uuid4())
-    temp_path = os.path.join(UPLOAD_DIR, f"{file_id}_{document.filename}")
-
-    with open(temp_path, "wb") as buffer:
-        shutil.copyfileobj(document.file, buffer)
+    """
+    Get text detection regions and confidence zones only for a specific language.
+    'regions' (JSON list of page-pixel boxes) limits OCR to those crops.
+    """
+    temp_path, session = resolve_document(document, document_id)
+    ticket = admit_document(request, temp_path, session, pages=1)
 
     try:
         processors = get_language_processors(language.lower())
-        detection_result = processors["extract_with_detection"](temp_path, page_number=page_number)
+        try:
+            page_regions = parse_regions_form(regions, temp_path, page_number, session)
+        except ValueError as e:
+            return JSONResponse(status_code=400, content={"error": str(e)})
+
+        if page_regions is not None:
+            detection_result = ocr_regions(processors["engine"], page_regions[0], page_regions[1])
+        else:
+            detection_result = run_detection(processors, language.lower(), temp_path, page_number, session)
 
         if "error" in detection_result:
             return JSONResponse(status_code=500, content={"error": detection_result["error"]})
@@ -299,57 +618,534 @@ async def detect_text_regions(
             "processing_info": {
                 "language": detection_result.get("language", language),
                 "page_number": page_number,
-                "is_pdf": detection_result.get("is_pdf", False)
+                "is_pdf": is_pdf_file(temp_path),
+                "regions": detection_result.get("regions")
             }
         }
 
     finally:
-        if os.path.exists(temp_path):
-            os.remove(temp_path)
+        ticket.release()
+        release_document(temp_path, session)
 
 @app.post("/verify")
-async def verify_file(
-    document: UploadFile = File(...),
+def verify_file(
+    request: Request,
+    document: Optional[UploadFile] = File(None),
+    document_id: str = Form(default=""),
+    extraction_id: str = Form(default=""),
     verification_data: str = Form(...),
-    fields: str = Form(default="")  # NEW: Add fields parameter
+    fields: str = Form(default=""),  # NEW: Add fields parameter
+    language: str = Form(default="en"),
+    page_number: int = Form(default=1)
 ):
     """
-    FIXED VERSION - Verify submitted form data against OCR extracted fields with custom fields support.
+    Verify submitted form data against OCR extracted fields.
+
+    Only the fields named in verification_data are mapped ('fields' is used
+    when it names none). With 'extraction_id' (from /extract) the cached mapped
+    fields are compared directly; with 'document_id' the session's cached OCR
+    and mappings are reused. OCR runs only when neither is available. 'cache'
+    in the response tells which.
     """
-    file_id = str(uuid.uuid4())
-    temp_path = os.path.join(UPLOAD_DIR, f"{file_id}_{document.filename}")
+    try:
+        submitted_data = json.loads(verification_data)
+    except json.JSONDecodeError as e:
+        return JSONResponse(status_code=400, content={"error": f"Invalid JSON in verification_data: {e}"})
 
-    with open(temp_path, "wb") as buffer:
-        shutil.copyfileobj(document.file, buffer)
+    # Parse custom fields if provided
+    custom_fields = []
+    if fields and fields.strip():
+        try:
+            custom_fields = json.loads(fields)
+            logger.info(f"Custom fields for verification: {custom_fields}")
+        except json.JSONDecodeError as e:
+            logger.warning(f"Invalid fields JSON: {e}, proceeding without custom fields")
+            custom_fields = []
+
+    needed_fields = verification_fields(submitted_data) or custom_fields
+    entry = extraction_store.get(extraction_id) if extraction_id else None
+    if entry is not None and not covers_fields(entry["mapped_fields"], needed_fields):
+        logger.info(f"Extraction {extraction_id} does not cover the requested fields; extracting again")
+        entry = None
+    if extraction_id and entry is None and document is None and not document_id:
+        raise HTTPException(status_code=404, detail=f"Extraction '{extraction_id}' not found, expired or not reusable")
+
+    start = time.time()
+    if entry is not None and document is None and (not document_id or document_id == entry["document_id"]):
+        # The extraction alone is enough: no file to read at all
+        verification_result = verify_mapped_fields(submitted_data, entry["mapped_fields"], custom_fields or None)
+        return JSONResponse(content={
+            "success": True,
+            "verification_result": verification_result,
+            "cache": {"hit": True, "source": "extraction", "extraction_id": extraction_id,
+                      "fields_mapped": [], "elapsed_time": round(time.time() - start, 4)},
+        })
+
+    temp_path, session = resolve_document(document, document_id)
+    ticket = None
+
+    try:
+        # A referenced extraction still applies if it was made on the same bytes
+        if entry is not None:
+            digest = session.sha256() if session is not None else file_sha256(temp_path)
+            if digest != entry["sha256"]:
+                logger.info(f"Extraction {extraction_id} was made on a different document; extracting again")
+                entry = None
+
+        lang = (entry["language"] if entry is not None else language).lower()
+        page = entry["page_number"] if entry is not None else page_number
+        fields_mapped = []
+        if entry is not None:
+            mapped_fields, source = entry["mapped_fields"], "extraction"
+        elif cached_mapping(session, lang, page, needed_fields) is not None:
+            mapped_fields, source = cached_mapping(session, lang, page, needed_fields), "session_mapping"
+        else:
+            processors = get_language_processors(lang)
+            source = "session_ocr" if session is not None and session.peek("ocr", (lang, page)) is not None else None
+            if source is None:
+                # Only requests that actually run OCR take OCR capacity
+                ticket = admit_document(request, temp_path, session, pages=1)
+            detection_result = run_detection(processors, lang, temp_path, page, session)
+            if "error" in detection_result:
+                return JSONResponse(status_code=500, content={"error": detection_result["error"], "success": False})
+            fields_mapped = needed_fields
+            mapped_fields = map_detection(processors, lang, detection_result, needed_fields, page, session)
+
+        verification_result = verify_mapped_fields(submitted_data, mapped_fields, custom_fields or None)
+        return JSONResponse(content={
+            "success": True,
+            "verification_result": verification_result,
+            "cache": {"hit": source is not None, "source": source, "extraction_id": extraction_id or None,
+                      "fields_mapped": fields_mapped, "elapsed_time": round(time.time() - start, 4)},
+        })
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Verification failed: {e}", exc_info=True)
+        return JSONResponse(status_code=500, content={"error": f"Verification failed: {e}", "success": False})
+
+    finally:
+        if ticket is not None:
+            ticket.release()
+        release_document(temp_path, session)
+
+def cached_mapping(session, language: str, page_number: int, fields: list):
+    """A field mapping of this page cached in the session that covers the fields, or None."""
+    if session is None:
+        return None
+    for (lang, page, _), mapped in session.entries("mapped"):
+        if lang == language and page == page_number and covers_fields(mapped, fields):
+            return mapped
+    return None
+
+def stream_page_results(pages, total_pages: int, ocr_page, should_ocr, skipped_pages: dict,
+                        processors: dict, language: str, custom_fields: list, session, file_path: str, ticket):
+    """
+    NDJSON lines for /extract/pdf/all with stream="true": one per page as soon
+    as it is OCR'd and mapped, then a summary. Only one page image is held at a time.
+    """
+    start = time.time()
+    results = {}
+    try:
+        for page_num, image in pages:
+            if not should_ocr(page_num, image):
+                status = skipped_pages[page_num]
+                entry = {"page_number": page_num, "page_status": status["status"],
+                         "duplicate_of": status["duplicate_of"], "ink_coverage": status["ink_coverage"],
+                         **results.get(status["duplicate_of"], {"mapped_fields": {}, "detections": []})}
+            else:
+                page_data = ocr_page(page_num, image)
+                if "error" in page_data:
+                    entry = {"page_number": page_num, "error": page_data["error"]}
+                else:
+                    results[page_num] = {
+                        "mapped_fields": map_detection(processors, language, page_data, custom_fields, page_num, session),
+                        "detections": page_data.get("detections", []),
+                    }
+                    entry = {"page_number": page_num, "page_status": "content", **results[page_num]}
+            del image
+            yield json.dumps(entry, ensure_ascii=False) + "\n"
+        yield json.dumps({"summary": {
+            "total_pages": total_pages,
+            "skipped_pages": skipped_pages,
+            "is_pdf": is_pdf_file(file_path),
+            "elapsed_time": round(time.time() - start, 3),
+        }}) + "\n"
+    finally:
+        ticket.release()
+        release_document(file_path, session)
+
+def add_skipped_pages(processed_pages: dict, skipped_pages: dict, language: str):
+    """Entries for pages the classifier skipped: blank pages are empty, duplicates repeat their original."""
+    for page_num, status in skipped_pages.items():
+        original = processed_pages.get(str(status["duplicate_of"])) if status["duplicate_of"] else None
+        if original is not None and "error" not in original:
+            entry = {**original, "processing_info": {**original.get("processing_info", {}), "page_number": page_num}}
+        else:
+            entry = {"mapped_fields": {}, "detections": [],
+                     "processing_info": {"language": language, "page_number": page_num}}
+        processed_pages[str(page_num)] = {**entry, "page_status": status["status"],
+                                          "duplicate_of": status["duplicate_of"],
+                                          "ink_coverage": status["ink_coverage"]}
+
+def parse_bulk_manifest(manifest: str, uploaded: dict) -> list:
+    """
+    Validate a /verify/bulk manifest: a JSON list (or {"items": [...]}) of
+    {"id", "document" | "document_id", "verification_data", "fields", "language", "page_number"}.
+
+    Returns the items with defaults filled in; raises ValueError for the first invalid one.
+    """
+    try:
+        raw = json.loads(manifest)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"Invalid JSON in manifest: {e}")
+    if isinstance(raw, dict):
+        raw = raw.get("items")
+    if not isinstance(raw, list) or not raw:
+        raise ValueError("manifest must be a non-empty JSON list of items")
+
+    items = []
+    for index, item in enumerate(raw):
+        if not isinstance(item, dict):
+            raise ValueError(f"Manifest item {index} is not an object")
+        item_id = str(item.get("id", index))
+        if item.get("document_id"):
+            if session_store.get(item["document_id"]) is None:
+                raise ValueError(f"Item '{item_id}': document session '{item['document_id']}' not found or expired")
+            document_key = ("session", item["document_id"])
+        elif item.get("document") in uploaded:
+            document_key = ("upload", uploaded[item["document"]])
+        else:
+            raise ValueError(f"Item '{item_id}': 'document' must name an uploaded file, or give 'document_id'")
+        if not isinstance(item.get("verification_data"), dict):
+            raise ValueError(f"Item '{item_id}': 'verification_data' must be an object")
+        items.append({
+            "id": item_id,
+            "document_key": document_key,
+            "verification_data": item["verification_data"],
+            "fields": list(item.get("fields") or []),
+            "language": str(item.get("language", "en")).lower(),
+            "page_number": int(item.get("page_number", 1)),
+        })
+    return items
+
+def verify_document_group(items: list, file_path: str, session, language: str, page_number: int) -> list:
+    """
+    One OCR pass for a (document, language, page) group, one mapping of the
+    fields its pairs submitted, then verification per pair.
+    """
+    fields = []
+    for item in items:
+        for field in verification_fields(item["verification_data"]) or item["fields"]:
+            if not covers_fields(dict.fromkeys(fields), [field]):
+                fields.append(field)
+
+    mapped = cached_mapping(session, language, page_number, fields)
+    if mapped is None:
+        processors = get_language_processors(language)
+        detection_result = run_detection(processors, language, file_path, page_number, session)
+        if "error" in detection_result:
+            return [{"id": item["id"], "success": False, "error": detection_result["error"]} for item in items]
+        mapped = map_detection(processors, language, detection_result, fields, page_number, session)
+
+    return [
+        {
+            "id": item["id"],
+            "success": True,
+            "verification_result": verify_mapped_fields(item["verification_data"], mapped, item["fields"] or None),
+            "shared_ocr": len(items) > 1,
+        }
+        for item in items
+    ]
+
+@app.post("/verify/bulk")
+def verify_bulk(
+    request: Request,
+    manifest: str = Form(...),
+    documents: List[UploadFile] = File(default=[])
+):
+    """
+    Verify many (document, submitted data) pairs in one request.
+
+    Uploaded documents are deduplicated by content hash within the request, and
+    every distinct (document, language, page) is OCR'd once on the OCR pool.
+    Results stream back as NDJSON, one line per pair in completion order,
+    followed by a {"summary": ...} line.
+    """
+    # Stream each upload to disk under a prefix unique to this request, hashing as it
+    # is written; a copy of an upload already saved is dropped. Manifest items refer
+    # to uploads by filename
+    request_id = str(uuid.uuid4())
+    uploaded, paths = {}, {}
+    for index, document in enumerate(documents):
+        path = os.path.join(UPLOAD_DIR, f"{request_id}_{index}_{os.path.basename(document.filename or 'document')}")
+        sha = hashlib.sha256()
+        with open(path, "wb") as f:
+            for chunk in iter(lambda: document.file.read(1024 * 1024), b""):
+                sha.update(chunk)
+                f.write(chunk)
+        digest = sha.hexdigest()
+        if digest in paths:
+            os.remove(path)
+        else:
+            paths[digest] = path
+        if uploaded.get(document.filename, digest) != digest:
+            for path in paths.values():
+                os.remove(path)
+            return JSONResponse(status_code=400, content={
+                "error": f"Two different documents were uploaded as '{document.filename}'"})
+        uploaded[document.filename] = digest
+
+    try:
+        items = parse_bulk_manifest(manifest, uploaded)
+    except (ValueError, TypeError) as e:
+        for path in paths.values():
+            os.remove(path)
+        return JSONResponse(status_code=400, content={"error": str(e)})
 
+    groups = {}
+    for item in items:
+        groups.setdefault((item["document_key"], item["language"], item["page_number"]), []).append(item)
+    logger.info(f"Bulk verification: {len(items)} pairs, {len(paths)} uploaded documents, {len(groups)} OCR runs")
+
+    # The whole batch is admitted at once: one page per OCR run
+    cost = 0.0
+    for (kind, key), _, _ in groups:
+        session = session_store.get(key) if kind == "session" else None
+        file_path = session.path if session is not None else paths.get(key)
+        if file_path is not None:
+            cost += estimate_cost(file_path, 1)
     try:
+        ticket = admission.admit(client_id(request), cost)
+    except Rejected as e:
+        for path in paths.values():
+            os.remove(path)
+        raise HTTPException(status_code=429, detail=e.reason, headers={"Retry-After": str(e.retry_after)})
+
+    def stream():
+        start = time.time()
+        counts = {}
+        futures = {}
         try:
-            submitted_data = json.loads(verification_data)
-        except json.JSONDecodeError as e:
-            return JSONResponse(status_code=400, content={"error": f"Invalid JSON in verification_data: {e}"})
+            for ((kind, key), language, page_number), group in groups.items():
+                session = session_store.get(key) if kind == "session" else None
+                file_path = session.path if session is not None else paths.get(key)
+                if file_path is None:
+                    for item in group:
+                        yield json.dumps({"id": item["id"], "success": False, "error": "Document session expired"}) + "\n"
+                    continue
+                futures[ocr_pool.submit(verify_document_group, group, file_path, session, language, page_number)] = group
+            for future in as_completed(futures):
+                try:
+                    results = future.result()
+                except Exception as e:
+                    logger.error(f"Bulk verification group failed: {e}", exc_info=True)
+                    results = [{"id": item["id"], "success": False, "error": str(e)} for item in futures[future]]
+                for result in results:
+                    status = result["verification_result"]["overall_status"] if result["success"] else "error"
+                    counts[status] = counts.get(status, 0) + 1
+                    yield json.dumps(result, ensure_ascii=False) + "\n"
+            yield json.dumps({"summary": {
+                "pairs": len(items),
+                "documents": len({item["document_key"] for item in items}),
+                "ocr_runs": len(groups),
+                "statuses": counts,
+                "elapsed_time": round(time.time() - start, 3),
+            }}) + "\n"
+        finally:
+            # Client gone or done: drop groups that have not started yet, and let the
+            # running ones finish before their documents are deleted
+            for future in futures:
+                future.cancel()
+            wait(futures)
+            ticket.release()
+            for path in paths.values():
+                if os.path.exists(path):
+                    os.remove(path)
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+def process_job(job: dict, done_pages: set, report):
+    """
+    Job worker: OCR and map every page of the job's document in order, storing
+    each page as it finishes. Pages stored before a restart are not redone;
+    duplicates of them repeat their stored result.
+    """
+    params = job["params"]
+    language = params.get("language", "en")
+    custom_fields = params.get("fields") or []
+    processors = get_language_processors(language)
+    classifier = PageClassifier() if PAGE_CLASSIFIER_ENABLED and params.get("skip_pages", True) else None
+    job_queue.set_total_pages(job["job_id"], get_page_count(job["path"]))
+
+    results = {}
+
+    def duplicate_result(page_num: int) -> dict:
+        if page_num not in results:
+            stored = job_queue.page_result(job["job_id"], page_num) or {}
+            return {"mapped_fields": stored.get("mapped_fields", {}), "detections": stored.get("detections", [])}
+        return results[page_num]
+
+    for page_num, image in iter_page_images(job["path"]):
+        # Resumed jobs still classify earlier pages, so later duplicates are recognized
+        status = classifier.classify(page_num, image) if classifier is not None else {"status": "content"}
+        if page_num in done_pages:
+            continue
+        if status["status"] != "content":
+            report(page_num, status["status"], {
+                "duplicate_of": status["duplicate_of"], "ink_coverage": status["ink_coverage"],
+                **duplicate_result(status["duplicate_of"]),
+            })
+            continue
+        page_data = run_detection(processors, language, job["path"], page_num, image=image)
+        del image
+        if "error" in page_data:
+            report(page_num, "error", {"error": page_data["error"]})
+            continue
+        results[page_num] = {
+            "mapped_fields": map_detection(processors, language, page_data, custom_fields, page_num),
+            "detections": page_data.get("detections", []),
+        }
+        report(page_num, "content", results[page_num])
+
+@app.on_event("startup")
+def start_job_workers():
+    job_queue.start(process_job)
 
-        # Parse custom fields if provided
+@app.on_event("shutdown")
+def stop_job_workers():
+    job_queue.stop()
+
+@app.post("/jobs")
+def create_job(
+    document: Optional[UploadFile] = File(None),
+    document_id: str = Form(default=""),
+    language: str = Form(default="en"),
+    fields: str = Form(default=""),
+    skip_pages: str = Form(default="true")
+):
+    """
+    Queue a PDF or TIFF for background extraction and return its job_id at once.
+    Poll GET /jobs/{job_id} for per-page progress and GET /jobs/{job_id}/results
+    for the pages finished so far; jobs survive restarts.
+    """
+    temp_path, session = resolve_document(document, document_id)
+    try:
+        if not is_multipage_file(temp_path):
+            return JSONResponse(status_code=400, content={"error": "File is not a PDF or TIFF document"})
         custom_fields = []
         if fields and fields.strip():
             try:
                 custom_fields = json.loads(fields)
-                logger.info(f"Custom fields for verification: {custom_fields}")
             except json.JSONDecodeError as e:
-                logger.warning(f"Invalid fields JSON: {e}, proceeding without custom fields")
-                custom_fields = []
+                return JSONResponse(status_code=400, content={"error": f"Invalid JSON in fields: {e}"})
+        filename = session.filename if session is not None else document.filename
+        return job_queue.submit(filename, temp_path, {
+            "language": language.lower(),
+            "fields": custom_fields,
+            "skip_pages": skip_pages.lower() == "true",
+        })
+    finally:
+        release_document(temp_path, session)
 
-        # CRITICAL FIX: Pass custom_fields to verify_fields function
-        verification_result = verify_fields(submitted_data, temp_path, custom_fields=custom_fields)
-        return JSONResponse(content={"success": True, "verification_result": verification_result})
+def _job_or_404(job):
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
 
-    except Exception as e:
-        logger.error(f"Verification failed: {e}", exc_info=True)
-        return JSONResponse(status_code=500, content={"error": f"Verification failed: {e}", "success": False})
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Job status and per-page progress."""
+    return _job_or_404(job_queue.get(job_id))
+
+@app.get("/jobs/{job_id}/results")
+async def get_job_results(job_id: str):
+    """Results of the pages finished so far ('partial' is true until the job ends)."""
+    return _job_or_404(job_queue.results(job_id))
+
+@app.post("/jobs/{job_id}/cancel")
+async def cancel_job(job_id: str):
+    """Cancel a job; a running job stops after its current page and keeps the pages done."""
+    return _job_or_404(job_queue.cancel(job_id))
+
+@app.delete("/jobs/{job_id}")
+async def delete_job(job_id: str):
+    """Delete a finished (completed, failed or cancelled) job and its results."""
+    job = _job_or_404(job_queue.get(job_id))
+    if not job_queue.delete(job_id):
+        raise HTTPException(status_code=409, detail=f"Job is {job['status']}; cancel it first")
+    return {"success": True}
+
+@app.post("/documents")
+def create_document(document: UploadFile = File(...)):
+    """
+    Upload a document once and get a document_id. Pass it as 'document_id' to
+    /extract, /extract/pdf/all, /detect, /verify, /pdf/page-count and
+    /pdf/convert-to-images to reuse the upload, page rasters and OCR results.
+    """
+    session = session_store.create(document.filename, document.file.read())
+    return {**session.info(), "page_count": session.page_count()}
+
+@app.get("/documents/{document_id}")
+async def get_document(document_id: str):
+    """Document session details: cached pages and results, time to expiry."""
+    session = session_store.get(document_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail=f"Document session '{document_id}' not found or expired")
+    return session.info()
+
+@app.delete("/documents/{document_id}")
+async def delete_document(document_id: str):
+    """Drop a document session and everything cached for it."""
+    if not session_store.delete(document_id):
+        raise HTTPException(status_code=404, detail=f"Document session '{document_id}' not found or expired")
+    return {"success": True}
+
+@app.get("/templates")
+async def get_templates():
+    """List registered form templates."""
+    return {"templates": list_templates()}
+
+@app.post("/templates")
+async def create_template(
+    reference: UploadFile = File(...),
+    definition: str = Form(...),
+    page_number: int = Form(default=1)
+):
+    """
+    Register a form template from a reference page (image or PDF page) and a JSON definition:
+    {"name", "anchors": {id: {"text", "bbox": [x1, y1, x2, y2]}}, "fields": {field: {"anchor": id, "zone": [x1, y1, x2, y2]}}}
+    with boxes in pixels of the reference page (PDFs are rendered at 200 dpi).
+    """
+    file_id = str(uuid.uuid4())
+    temp_path = os.path.join(UPLOAD_DIR, f"{file_id}_{reference.filename}")
+
+    with open(temp_path, "wb") as buffer:
+        shutil.copyfileobj(reference.file, buffer)
+
+    try:
+        try:
+            template_definition = json.loads(definition)
+        except json.JSONDecodeError as e:
+            return JSONResponse(status_code=400, content={"error": f"Invalid JSON in definition: {e}"})
+        try:
+            template = register_template(template_definition, load_page_image(temp_path, page_number))
+        except ValueError as e:
+            return JSONResponse(status_code=400, content={"error": str(e)})
+        return {"success": True, "template": template}
 
     finally:
         if os.path.exists(temp_path):
             os.remove(temp_path)
 
+@app.delete("/templates/{name}")
+async def remove_template(name: str):
+    """Delete a registered form template."""
+    if not delete_template(name):
+        raise HTTPException(status_code=404, detail=f"Template '{name}' not found")
+    return {"success": True}
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint."""
@@ -359,22 +1155,42 @@ async def health_check():
             "single_page_extraction", "multipage_pdf_extraction",
             "data_verification", "quality_assessment",
             "confidence_zones", "bounding_box_detection",
-            "custom_field_extraction"  # NEW feature
+            "custom_field_extraction",  # NEW feature
+            "form_templates", "document_sessions", "background_jobs",
+            "admission_control"
         ],
-        "language_support": ["en", "ch", "ja", "ko"]
+        "language_support": ["en", "ch", "ja", "ko"],
+        "mapper": mapper_status(),
+        "document_sessions": session_store.stats(),
+        "extraction_cache": extraction_store.stats(),
+        "ocr_pool": ocr_pool.stats(),
+        "jobs": job_queue.stats(),
+        "admission": admission.stats()
     }
 
 @app.post("/pdf/page-count")
-async def get_pdf_page_count(file: UploadFile = File(...)):
+async def pdf_page_count(file: Optional[UploadFile] = File(None), document_id: str = Form(default="")):
     """
     Endpoint to get the number of pages in a PDF file.
     
     Args:
         file: PDF file uploaded via multipart/form-data
+        document_id: Document session to use instead of uploading the file again
         
     Returns:
         JSON response with page count
     """
+    if document_id:
+        session = session_store.get(document_id)
+        if session is None:
+            raise HTTPException(status_code=404, detail=f"Document session '{document_id}' not found or expired")
+        if not session.is_pdf:
+            raise HTTPException(status_code=400, detail="File must be a PDF")
+        page_count = session.page_count()
+        return {"filename": session.filename, "page_count": page_count, "message": f"PDF contains {page_count} pages"}
+    if file is None:
+        raise HTTPException(status_code=400, detail="Either 'file' or 'document_id' is required")
+
     # Check if the uploaded file is a PDF
     if not file.filename.lower().endswith('.pdf'):
         raise HTTPException(status_code=400, detail="File must be a PDF")
@@ -442,21 +1258,27 @@ async def get_pdf_page_count_by_path(file_path: str):
         )
 
 @app.post("/pdf/convert-to-images")
-async def convert_pdf_to_images(file: UploadFile = File(...)):
+def convert_pdf_to_images_endpoint(request: Request, file: Optional[UploadFile] = File(None), document_id: str = Form(default="")):
+    if file is None and not document_id:
+        raise HTTPException(status_code=400, detail="Either 'file' or 'document_id' is required")
+    # Page rasters come from (and stay in) the document session; uploads are rasterized one page at a time
+    temp_path, session = resolve_document(file, document_id)
+    ticket = admit_document(request, temp_path, session)
     try:
-        # Convert PDF to images using pdf2image or similar
-        images = convert_from_bytes(await file.read())
-        
         base64_images = []
-        for i, image in enumerate(images):
+        for _, image in iter_page_images(temp_path, session):
             buffer = BytesIO()
             image.save(buffer, format='PNG')
+            del image
             img_base64 = base64.b64encode(buffer.getvalue()).decode()
             base64_images.append(f"data:image/png;base64,{img_base64}")
             
         return {"images": base64_images}
     except Exception as e:
         return {"error": str(e)}
+    finally:
+        ticket.release()
+        release_document(temp_path, session)
 
 @app.get("/")
 async def root():
@@ -0,0 +1,401 @@
+import os
+import math
+import time
+import logging
+import threading
+from collections import deque
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+# "http" calls the mapping service(s); "inprocess" runs QwenFieldMapper in this
+# process and talks to the model runtime directly, skipping the extra HTTP hop
+MAPPER_MODE = os.getenv("MAPPER_MODE", "http").lower()
+
+# Default mapping service; set MAPPER_ENDPOINTS to a comma-separated list of
+# base URLs to spread mapping over several mapper/Ollama instances
+NGROK_API_URL = "http://127.0.0.1:8001"
+
+DEFAULT_FIELDS = ["name", "age", "gender", "dob", "address", "country", "phone", "email", "id_number"]
+
+# Per-call timeout; a mapper slower than this is treated as down
+MAPPER_TIMEOUT = float(os.getenv("MAPPER_TIMEOUT", "30"))
+# Generations the mapping service runs side by side within one batch (keep in step
+# with the service's own MAPPER_BATCH_CONCURRENCY)
+MAPPER_BATCH_CONCURRENCY = int(os.getenv("MAPPER_BATCH_CONCURRENCY", "2"))
+# Hard cap on a batch call's timeout, however many items it carries
+MAPPER_BATCH_TIMEOUT_MAX = float(os.getenv("MAPPER_BATCH_TIMEOUT_MAX", "120"))
+
+# Keep-alive connections to the mapping service(s)
+_session = requests.Session()
+_session.mount("http://", HTTPAdapter(pool_maxsize=int(os.getenv("MAPPER_POOL_SIZE", "8"))))
+_session.mount("https://", HTTPAdapter(pool_maxsize=int(os.getenv("MAPPER_POOL_SIZE", "8"))))
+
+
+def _empty_fields(fields=None):
+    return {field: {"value": None, "confidence": None} for field in (fields or DEFAULT_FIELDS)}
+
+
+# ----------------------------
+# Circuit breaker
+# ----------------------------
+class CircuitBreaker:
+    """
+    Circuit breaker for a mapping service endpoint.
+
+    Opens after `failure_threshold` consecutive failures, or when the error rate
+    over the last `window` calls reaches `error_rate`. Calls slower than
+    `slow_call_seconds` count as failures. While open, callers skip the mapper;
+    after `recovery_seconds` a single probe call is let through (half-open) and
+    its outcome closes or re-opens the breaker.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, failure_threshold: int = 3, recovery_seconds: float = 30.0,
+                 slow_call_seconds: float = 20.0, window: int = 20, error_rate: float = 0.5):
+        self.failure_threshold = failure_threshold
+        self.recovery_seconds = recovery_seconds
+        self.slow_call_seconds = slow_call_seconds
+        self.error_rate = error_rate
+        self.state = self.CLOSED
+        self._consecutive_failures = 0
+        self._outcomes = deque(maxlen=window)
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._avg_latency = None
+        self._lock = threading.Lock()
+
+    def is_open(self) -> bool:
+        """True while calls are being refused (open and not yet due for a probe)."""
+        with self._lock:
+            if self.state == self.OPEN:
+                return time.monotonic() - self._opened_at < self.recovery_seconds
+            return self.state == self.HALF_OPEN and self._probe_in_flight
+
+    def allow_request(self) -> bool:
+        """True if a call may go to the mapper now (claims the probe slot when half-open)."""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self._opened_at >= self.recovery_seconds:
+                self.state = self.HALF_OPEN
+                self._probe_in_flight = False
+            if self.state == self.HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            return False
+
+    def record_success(self, latency: float):
+        with self._lock:
+            self._avg_latency = latency if self._avg_latency is None else 0.8 * self._avg_latency + 0.2 * latency
+            if latency > self.slow_call_seconds:
+                self._failure_locked(f"slow call ({latency:.1f}s)")
+                return
+            self._outcomes.append(True)
+            self._consecutive_failures = 0
+            if self.state != self.CLOSED:
+                logger.info("Mapper circuit breaker closed")
+            self.state = self.CLOSED
+            self._probe_in_flight = False
+
+    def record_failure(self, reason: str = ""):
+        with self._lock:
+            self._failure_locked(reason)
+
+    def _failure_locked(self, reason: str):
+        self._outcomes.append(False)
+        self._consecutive_failures += 1
+        failures = self._outcomes.count(False)
+        rate_tripped = (len(self._outcomes) >= self._outcomes.maxlen // 2
+                        and failures / len(self._outcomes) >= self.error_rate)
+        if self.state == self.HALF_OPEN or self._consecutive_failures >= self.failure_threshold or rate_tripped:
+            if self.state != self.OPEN:
+                logger.warning(f"Mapper circuit breaker opened: {reason}")
+            self.state = self.OPEN
+            self._opened_at = time.monotonic()
+            self._probe_in_flight = False
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self._consecutive_failures,
+                "recent_error_rate": round(self._outcomes.count(False) / len(self._outcomes), 3) if self._outcomes else 0.0,
+                "avg_latency_ms": round(self._avg_latency * 1000, 1) if self._avg_latency is not None else None,
+            }
+
+
+# ----------------------------
+# Endpoint pool
+# ----------------------------
+class MapperEndpoint:
+    """One mapping service instance with its own breaker and in-flight counter."""
+
+    def __init__(self, base_url: str):
+        self.base_url = base_url.rstrip("/")
+        self.breaker = CircuitBreaker(
+            failure_threshold=int(os.getenv("MAPPER_BREAKER_FAILURES", "3")),
+            recovery_seconds=float(os.getenv("MAPPER_BREAKER_RECOVERY", "30")),
+            slow_call_seconds=float(os.getenv("MAPPER_SLOW_CALL_SECONDS", "20")),
+        )
+        self.outstanding = 0
+        self.healthy = True
+
+    def snapshot(self) -> dict:
+        return {"url": self.base_url, "healthy": self.healthy, "outstanding": self.outstanding, **self.breaker.snapshot()}
+
+
+class MapperPool:
+    """
+    Routes mapper calls over several mapping service instances.
+
+    Each call goes to the healthy endpoint with the fewest outstanding requests.
+    An endpoint is ejected while its /health check fails or its circuit breaker
+    is open, and rejoins once the health check (or a breaker probe) succeeds.
+    """
+
+    def __init__(self, urls, health_interval: float = 10.0):
+        self.endpoints = [MapperEndpoint(url) for url in urls]
+        self.health_interval = health_interval
+        self._lock = threading.Lock()
+        self._health_thread = None
+
+    def _ensure_health_checks(self):
+        if self._health_thread is None and self.health_interval > 0:
+            with self._lock:
+                if self._health_thread is None:
+                    self._health_thread = threading.Thread(target=self._health_loop, name="mapper-health", daemon=True)
+                    self._health_thread.start()
+
+    def _health_loop(self):
+        while True:
+            for endpoint in self.endpoints:
+                try:
+                    ok = _session.get(f"{endpoint.base_url}/health", timeout=5).status_code == 200
+                except Exception:
+                    ok = False
+                if ok != endpoint.healthy:
+                    logger.warning(f"Mapper endpoint {endpoint.base_url} is now {'healthy' if ok else 'unhealthy'}")
+                endpoint.healthy = ok
+            time.sleep(self.health_interval)
+
+    def acquire(self, exclude=()):
+        """Pick and reserve the least-loaded usable endpoint; None if every endpoint is ejected."""
+        self._ensure_health_checks()
+        with self._lock:
+            candidates = [e for e in self.endpoints if e.healthy and e not in exclude and not e.breaker.is_open()]
+            for endpoint in sorted(candidates, key=lambda e: e.outstanding):
+                if endpoint.breaker.allow_request():
+                    endpoint.outstanding += 1
+                    return endpoint
+        return None
+
+    def release(self, endpoint: MapperEndpoint):
+        with self._lock:
+            endpoint.outstanding -= 1
+
+    def available(self) -> bool:
+        return any(e.healthy and not e.breaker.is_open() for e in self.endpoints)
+
+    def snapshot(self) -> list:
+        return [e.snapshot() for e in self.endpoints]
+
+
+pool = MapperPool(
+    [url.strip() for url in os.getenv("MAPPER_ENDPOINTS", NGROK_API_URL).split(",") if url.strip()],
+    health_interval=float(os.getenv("MAPPER_HEALTH_INTERVAL", "10")),
+)
+
+
+# ----------------------------
+# In-process mapper
+# ----------------------------
+_local_mapper = None
+_local_lock = threading.Lock()
+_local_breaker = CircuitBreaker(
+    failure_threshold=int(os.getenv("MAPPER_BREAKER_FAILURES", "3")),
+    recovery_seconds=float(os.getenv("MAPPER_BREAKER_RECOVERY", "30")),
+    slow_call_seconds=float(os.getenv("MAPPER_SLOW_CALL_SECONDS", "20")),
+)
+
+
+def _get_local_mapper():
+    """Create the in-process mapper cascade on first use and load its models."""
+    global _local_mapper
+    with _local_lock:
+        if _local_mapper is None:
+            from .qwen_mapper import TieredFieldMapper, model_tiers
+            _local_mapper = TieredFieldMapper(model_tiers())
+            _local_mapper.warmup()
+        return _local_mapper
+
+
+def _extract_inprocess(ocr_text: str, fields: list):
+    """Map through the in-process mapper behind its breaker; None if skipped or failed."""
+    if not _local_breaker.allow_request():
+        logger.warning("Mapper circuit breaker is open; skipping LLM mapping")
+        return None
+    start = time.monotonic()
+    try:
+        data, timings = _get_local_mapper().extract_fields_timed(ocr_text, fields)
+    except Exception as e:
+        _local_breaker.record_failure(str(e))
+        logger.error(f"Error in in-process mapper: {e}")
+        return None
+    _local_breaker.record_success(time.monotonic() - start)
+    logger.info(f"In-process mapper returned {data} (timings: {timings})")
+    return data
+
+
+def _extract_batch_inprocess(items):
+    """Batch mapping in-process, over MAPPER_BATCH_CONCURRENCY concurrent generations."""
+    if not _local_breaker.allow_request():
+        logger.warning("Mapper circuit breaker is open; skipping LLM mapping")
+        return None
+    from .qwen_mapper import run_batch
+    start = time.monotonic()
+    results = run_batch(_get_local_mapper(), [(text, list(fields)) for text, fields in items],
+                        MAPPER_BATCH_CONCURRENCY)
+    if all(item["error"] for item in results):
+        _local_breaker.record_failure(results[0]["error"])
+    else:
+        _local_breaker.record_success((time.monotonic() - start) / len(items))
+    return results
+
+
+def mapper_available() -> bool:
+    """False while no mapper can take calls (breakers open, endpoints ejected); callers keep the rule-based result."""
+    if MAPPER_MODE == "inprocess":
+        return not _local_breaker.is_open()
+    return pool.available()
+
+
+def mapper_status() -> dict:
+    """Mapper mode plus health, load, breaker state and latency, for health reporting."""
+    if MAPPER_MODE == "inprocess":
+        status = {"mode": MAPPER_MODE, "inprocess": _local_breaker.snapshot()}
+        if _local_mapper is not None:
+            status["tiers"] = _local_mapper.stats()
+        return status
+    return {"mode": MAPPER_MODE, "endpoints": pool.snapshot()}
+
+
+def _post(path: str, payload: dict, timeout: float, work_units: int = 1):
+    """
+    POST to a mapper endpoint from the pool; returns the response, or None if skipped or failed.
+
+    A failed call is retried once on another endpoint. Latency is recorded per
+    work unit so a large batch is not mistaken for a slow mapper.
+    """
+    headers = {
+        "Content-Type": "application/json",
+        "ngrok-skip-browser-warning": "true"  # CRITICAL for ngrok-free
+    }
+    tried = []
+    for _ in range(min(2, len(pool.endpoints))):
+        endpoint = pool.acquire(exclude=tried)
+        if endpoint is None:
+            break
+        tried.append(endpoint)
+        start = time.monotonic()
+        try:
+            response = _session.post(f"{endpoint.base_url}{path}", json=payload, headers=headers, timeout=timeout)
+        except Exception as e:
+            endpoint.breaker.record_failure(str(e))
+            logger.error(f"Error calling mapping API at {endpoint.base_url}: {e}")
+            continue
+        finally:
+            pool.release(endpoint)
+        if response.status_code != 200:
+            endpoint.breaker.record_failure(f"HTTP {response.status_code}")
+            logger.error(f"API at {endpoint.base_url} returned status {response.status_code}: {response.text}")
+            continue
+        endpoint.breaker.record_success((time.monotonic() - start) / max(1, work_units))
+        return response
+
+    if not tried:
+        logger.warning("No mapper endpoint available (all ejected); skipping LLM mapping")
+    return None
+
+
+def map_fields_via_api(ocr_text: str, custom_fields=None):
+    """
+    Send OCR text to the mapper and get structured fields
+
+    In "http" mode this goes to the mapping service pool (mappingfinal.py); in
+    "inprocess" mode QwenFieldMapper runs here against the model runtime.
+    """
+    payload = {"text": ocr_text}
+    if custom_fields is not None and len(custom_fields) > 0:
+        payload["fields"] = custom_fields
+
+    if MAPPER_MODE == "inprocess":
+        data = _extract_inprocess(ocr_text, payload.get("fields") or DEFAULT_FIELDS)
+        return data if data is not None else _empty_fields(custom_fields)
+
+    logger.info(f"Sending text to mapping API (length={len(ocr_text)} chars, fields={custom_fields})...")
+    response = _post("/extract", payload, MAPPER_TIMEOUT)
+    if response is None:
+        return _empty_fields(custom_fields)
+    try:
+        data = response.json()
+    except ValueError as e:
+        logger.error(f"Invalid JSON from mapping API: {e}")
+        return _empty_fields(custom_fields)
+    logger.info(f"Received data from API: {data} "
+                f"(timing: {response.headers.get('Server-Timing', 'n/a')}, "
+                f"prompt tokens: {response.headers.get('X-Prompt-Tokens', 'n/a')})")
+    return data
+
+
+def _batch_rounds(count: int) -> int:
+    """Rounds of concurrent generations the mapping service needs for count items."""
+    return math.ceil(count / max(1, MAPPER_BATCH_CONCURRENCY))
+
+
+def map_fields_batch_via_api(items):
+    """
+    Map many texts in one round trip through the mapping service's /extract/batch
+
+    Args:
+        items: List of (ocr_text, fields) pairs
+
+    Returns:
+        List of field dicts in input order; items that failed get empty fields
+
+    The call waits MAPPER_TIMEOUT per round of concurrent generations, up to
+    MAPPER_BATCH_TIMEOUT_MAX, so a large batch cannot hold a request for minutes.
+    """
+    if not items:
+        return []
+    if MAPPER_MODE == "inprocess":
+        results = _extract_batch_inprocess(items)
+        if results is None:
+            return [_empty_fields(fields) for _, fields in items]
+        data = {"results": results}
+    else:
+        payload = {"items": [{"text": text, "fields": list(fields)} for text, fields in items],
+                   "concurrency": MAPPER_BATCH_CONCURRENCY}
+        rounds = _batch_rounds(len(items))
+        timeout = min(MAPPER_TIMEOUT * rounds, MAPPER_BATCH_TIMEOUT_MAX)
+        logger.info(f"Sending {len(items)} items to mapping batch API (timeout {timeout:.0f}s)...")
+        response = _post("/extract/batch", payload, timeout, work_units=rounds)
+        if response is None:
+            return [_empty_fields(fields) for _, fields in items]
+        try:
+            data = response.json()
+        except ValueError as e:
+            logger.error(f"Invalid JSON from mapping batch API: {e}")
+            return [_empty_fields(fields) for _, fields in items]
+
+    mapped = []
+    for (_, fields), item in zip(items, data.get("results", [])):
+        if item.get("error"):
+            logger.error(f"Batch item {item.get('index')} failed: {item['error']}")
+            mapped.append(_empty_fields(fields))
+        else:
+            mapped.append(item.get("fields") or _empty_fields(fields))
+    logger.info(f"Batch API mapped {len(mapped)} items in {data.get('total_latency_ms', 'n/a')} ms")
+    return mapped
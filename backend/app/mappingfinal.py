@@ -1,87 +1,16 @@
-import json
-import re
-import requests
 import os
 import socket
+import time
 import uvicorn
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Response
 from pydantic import BaseModel
 import nest_asyncio
 from dotenv import set_key, load_dotenv
 
-class QwenFieldMapper:
-    def __init__(self, model_name="qwen2.5:1.5b"):
-        """
-        Uses an Ollama model that is already pulled locally.
-        Example: ollama pull qwen2.5:1.5b
-        """
-        self.model_name = model_name
-        self.api_url = "http://localhost:11434/api/generate"
-        print(f"Using Ollama model (offline): {self.model_name}")
-
-    def extract_fields(self, ocr_text: str, required_fields: list[str]) -> dict:
-        """
-        Extract the given required_fields from ocr_text and return only JSON 
-        with those exact keys.
-        """
-        # Build JSON skeleton
-        skeleton = "{\n"
-        skeleton += ",\n".join([f'  "{field}": ""' for field in required_fields])
-        skeleton += "\n}"
-
-        prompt = f"""Extract information from the following text and return ONLY a JSON object
-with these exact field names (no other text or keys).:
-
-Text: {ocr_text}
-
-Return only this JSON format:
-{skeleton}
-"""
-
-        payload = {
-            "model": self.model_name,
-            "prompt": prompt,
-            "stream": False,
-            "options": {
-                "temperature": 0,
-                "repeat_penalty": 1.1,
-                "top_p" : 1
-            }
-        }
-
-        try:
-            response = requests.post(self.api_url, json=payload, timeout=120)
-            response.raise_for_status()
-            generated = response.json().get("response", "")
-        except Exception as e:
-            print("Error communicating with Ollama:", e)
-            return {field: "" for field in required_fields}
-
-        return self._extract_strict_json(generated, required_fields)
-
-    def _extract_strict_json(self, text: str, required_fields: list[str]) -> dict:
-        """
-        Extracts the first valid JSON object from text and ensures all required fields exist.
-        """
-        default_result = {field: "" for field in required_fields}
-
-        try:
-            clean_text = text.replace("```json", "").replace("```", "").strip()
-            match = re.search(r'\{.*?\}', clean_text, re.DOTALL)
-            if match:
-                parsed_json = json.loads(match.group(0))
-                # Guarantee all requested fields exist
-                for key in default_result.keys():
-                    if key not in parsed_json:
-                        parsed_json[key] = ""
-                return parsed_json
-        except json.JSONDecodeError:
-            pass
-        return default_result
-mapper = QwenFieldMapper("qwen2.5:1.5b")
-print("Model initialized.")
-
-
+try:
+    from app.qwen_mapper import TieredFieldMapper, model_tiers, run_batch, server_timing_header
+except ImportError:  # run as a script from backend/app: python3 mappingfinal.py
+    from qwen_mapper import TieredFieldMapper, model_tiers, run_batch, server_timing_header
 
 # ----------------- FastAPI Setup -----------------
 app = FastAPI(title="OCR Field Extractor API")
@@ -91,19 +20,64 @@ class OCRRequest(BaseModel):
     text: str
     fields: list[str]
 
+class BatchRequest(BaseModel):
+    items: list[OCRRequest]
+    concurrency: int | None = None
+
+# Upper bound on simultaneous Ollama generations per batch. Ollama itself only
+# runs requests in parallel up to OLLAMA_NUM_PARALLEL, so keep the two in step.
+BATCH_CONCURRENCY = int(os.getenv("MAPPER_BATCH_CONCURRENCY", "2"))
+
 # ----------------- Initialize the Qwen Model -----------------
 print("Loading model, this may take a few minutes...")
-mapper = QwenFieldMapper()  # Ollama offline model
+# MAPPER_MODEL_TIERS="qwen2.5:0.5b,qwen2.5:1.5b" escalates fields the small model
+# gets wrong to the larger one; by default a single MAPPER_MODEL tier
+mapper = TieredFieldMapper(model_tiers())  # Ollama offline models
+mapper.warmup()
 print("Model ready!")
 
 # ----------------- API Endpoint -----------------
 @app.post("/extract")
-def extract_fields(request: OCRRequest):
+def extract_fields(request: OCRRequest, response: Response):
     try:
-        result = mapper.extract_fields(request.text, request.fields)
-        return result
+        result, timings = mapper.extract_fields_timed(request.text, request.fields)
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        # A non-200 lets clients (and their circuit breakers) tell an Ollama failure from empty fields
+        print("Error communicating with Ollama:", e)
+        raise HTTPException(status_code=503, detail=f"Model runtime error: {e}")
+    # Field keys are the body, so Ollama's timings travel in headers
+    response.headers["Server-Timing"] = server_timing_header(timings)
+    for header, key in (("X-Prompt-Tokens", "prompt_tokens"), ("X-Generated-Tokens", "generated_tokens")):
+        if timings.get(key) is not None:
+            response.headers[header] = str(timings[key])
+    response.headers["X-Early-Stop"] = str(timings.get("early_stop", False)).lower()
+    return result
+
+@app.post("/extract/batch")
+def extract_fields_batch(request: BatchRequest):
+    """
+    Map many (text, fields) items in one call.
+
+    Items are scheduled over at most MAPPER_BATCH_CONCURRENCY concurrent
+    generations (a request may ask for fewer). Results come back in input order,
+    each with its own error and latency, so one bad item does not fail the batch.
+    """
+    concurrency = max(1, min(request.concurrency or BATCH_CONCURRENCY, BATCH_CONCURRENCY))
+    start = time.perf_counter()
+    results = run_batch(mapper, [(item.text, item.fields) for item in request.items], concurrency)
+
+    return {
+        "results": results,
+        "total_items": len(results),
+        "concurrency": concurrency,
+        "total_latency_ms": round((time.perf_counter() - start) * 1000, 1),
+    }
+
+@app.get("/stats")
+def stats():
+    """Per-tier usage and latency of the model cascade since startup."""
+    return {"tiers": mapper.stats()}
+
 @app.get("/health")
 def health():
     return {"status": "ok"}
@@ -120,9 +94,10 @@ def find_free_port() -> int:
 
 # ----------------- Run FastAPI -----------------
 if __name__ == "__main__":
-    # Find available port
-    port = find_free_port()
-    host = "127.0.0.1"
+    # MAPPER_PORT picks the port (several instances per host need distinct ports);
+    # MAPPER_PORT=0 asks the OS for a free one. The URL written to .env is the one we bind.
+    port = int(os.getenv("MAPPER_PORT", "8001")) or find_free_port()
+    host = os.getenv("MAPPER_HOST", "127.0.0.1")
     url = f"http://{host}:{port}"
 
     # Load .env and update NOTEBOOK_URL
@@ -136,5 +111,5 @@ if __name__ == "__main__":
 
 
     # Run without reloader (avoids duplicate process in notebooks)
-    uvicorn.run(app, host=host, port=8001)
+    uvicorn.run(app, host=host, port=port)
 
@@ -1,10 +1,10 @@
 import cv2
 import numpy as np
-from PIL import Image
 import fitz  # PyMuPDF for PDF handling
 import os
 from app.extraction import extract_text, map_fields
 from app.quality import check_image_quality
+from app.utils import get_tiff_frame_count, iter_tiff_frames
 import tempfile
 
 
@@ -89,47 +89,27 @@ def extract_from_pdf(pdf_path):
 
 
 def extract_from_tiff(tiff_path):
-    """Extract text from multi-page TIFF"""
+    """Extract text from multi-page TIFF, decoding one frame at a time"""
     try:
-        # Open TIFF with PIL
-        with Image.open(tiff_path) as img:
-            total_pages = img.n_frames if hasattr(img, 'n_frames') else 1
-            pages = {}
-            
-            for page_num in range(total_pages):
-                img.seek(page_num)
-                
-                # Convert to RGB if necessary
-                if img.mode != 'RGB':
-                    page_img = img.convert('RGB')
-                else:
-                    page_img = img.copy()
-                
-                # Save temporary image for OCR processing
-                with tempfile.NamedTemporaryFile(suffix='.png', delete=False) as tmp_file:
-                    page_img.save(tmp_file.name, 'PNG')
-                    tmp_path = tmp_file.name
-                
-                try:
-                    # Extract text using your existing OCR function
-                    text = extract_text(tmp_path)
-                    quality = check_image_quality(tmp_path)
-                    
-                    pages[str(page_num + 1)] = {
-                        "text": text,
-                        "quality": quality
-                    }
-                    
-                finally:
-                    # Clean up temporary file
-                    if os.path.exists(tmp_path):
-                        os.remove(tmp_path)
-            
-            return {
-                "total_pages": total_pages,
-                "pages": pages
+        total_pages = get_tiff_frame_count(tiff_path)
+        pages = {}
+
+        # Frames go to OCR in memory, in their own mode (bilevel fax pages stay
+        # compact until extract_text converts them)
+        for page_num, frame in iter_tiff_frames(tiff_path):
+            text = extract_text(tiff_path, page_number=page_num, image=frame)
+            quality = check_image_quality(tiff_path, image=frame)
+
+            pages[str(page_num)] = {
+                "text": text,
+                "quality": quality
             }
-            
+
+        return {
+            "total_pages": total_pages,
+            "pages": pages
+        }
+
     except Exception as e:
         raise Exception(f"Failed to process TIFF: {str(e)}")
 
@@ -0,0 +1,47 @@
+import os
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Concurrent OCR tasks (each one a PHOCR pass plus mapping); the ONNX sessions
+# behind the engines run inference calls concurrently
+OCR_POOL_WORKERS = int(os.getenv("OCR_POOL_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+_pool: Optional[ThreadPoolExecutor] = None
+_lock = threading.Lock()
+_pending = 0
+
+
+def get_pool() -> ThreadPoolExecutor:
+    """The shared OCR worker pool, created on first use."""
+    global _pool
+    with _lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=max(1, OCR_POOL_WORKERS), thread_name_prefix="ocr")
+            logger.info(f"Started OCR pool with {OCR_POOL_WORKERS} workers")
+        return _pool
+
+
+def _done(_future: Future):
+    global _pending
+    with _lock:
+        _pending -= 1
+
+
+def submit(fn: Callable, *args, **kwargs) -> Future:
+    """Run fn(*args, **kwargs) on the OCR pool."""
+    global _pending
+    pool = get_pool()
+    with _lock:
+        _pending += 1
+    future = pool.submit(fn, *args, **kwargs)
+    future.add_done_callback(_done)
+    return future
+
+
+def stats() -> Dict:
+    with _lock:
+        return {"workers": OCR_POOL_WORKERS, "pending": _pending, "started": _pool is not None}
@@ -0,0 +1,183 @@
+import os
+import logging
+from typing import Dict, List, Optional
+
+import numpy as np
+from PIL import Image
+from scipy import ndimage
+from scipy.fft import dctn
+
+logger = logging.getLogger(__name__)
+
+# Pages with at most this many glyph-sized ink marks are blank (separators, empty
+# backs); dust, speckle and punch holes stay below it, a single line of text does not
+BLANK_MAX_MARKS = int(os.getenv("BLANK_MAX_MARKS", "2"))
+# Pages within this Hamming distance of an earlier page's 64-bit pHash share its layout
+# (the coarse hash stays put when a page is rescanned shifted or skewed); the closest
+# of them are aligned and compared pixel by pixel
+DUPLICATE_HASH_DISTANCE = int(os.getenv("DUPLICATE_HASH_DISTANCE", "8"))
+# ...and are duplicates only if, once aligned, at most this fraction of their pixels
+# carries ink the other page lacks...
+DUPLICATE_PIXEL_DIFFERENCE = float(os.getenv("DUPLICATE_PIXEL_DIFFERENCE", "0.001"))
+# ...and no block of the page differs in this many pixels: a filled-in value or a tick
+# on a copy of the same form is concentrated, misalignment is not
+DUPLICATE_MAX_MARK_PIXELS = int(os.getenv("DUPLICATE_MAX_MARK_PIXELS", "24"))
+PAGE_CLASSIFIER_ENABLED = os.getenv("PAGE_CLASSIFIER_ENABLED", "true").lower() == "true"
+
+# Pixels this much darker than the page background count as ink
+_INK_CONTRAST = 60
+# Pages are checked for ink on a thumbnail of at most this many pixels per side...
+_THUMBNAIL_SIDE = 512
+# ...and compared with their look-alikes at this resolution
+_COMPARE_SIDE = 1024
+# Connected ink blobs of at least this many thumbnail pixels count as marks
+_MIN_MARK_PIXELS = 4
+# Earlier pages (closest hash first) a page is compared with pixel by pixel
+_MAX_COMPARISONS = 3
+# Compared pages are aligned as a whole, then every block this many pixels a side is
+# moved by up to _MAX_BLOCK_SHIFT px to where it matches best (a rescan skewed by a
+# fraction of a degree is a small shift in every block)
+_BLOCK_SIDE = 32
+_MAX_BLOCK_SHIFT = 3
+# Ink within this many pixels of ink on the other page is not a difference
+_JITTER_PIXELS = 1
+
+
+def _thumbnail(image: Image.Image, side: int = _THUMBNAIL_SIDE) -> np.ndarray:
+    gray = image.convert("L")
+    gray.thumbnail((side, side))
+    return np.asarray(gray, dtype=np.float32)
+
+
+def _ink_mask(pixels: np.ndarray) -> np.ndarray:
+    """Ink pixels, relative to the page's own background (tinted paper, grey scans)."""
+    background = np.percentile(pixels, 90)
+    return pixels < background - _INK_CONTRAST
+
+
+def ink_coverage(image: Image.Image) -> float:
+    """Fraction of the page covered by ink."""
+    return float(np.mean(_ink_mask(_thumbnail(image))))
+
+
+def count_marks(mask: np.ndarray) -> int:
+    """Connected ink blobs of at least _MIN_MARK_PIXELS pixels (glyphs, lines, stamps)."""
+    labels, count = ndimage.label(mask)
+    if not count:
+        return 0
+    sizes = np.bincount(labels.ravel())[1:]
+    return int(np.count_nonzero(sizes >= _MIN_MARK_PIXELS))
+
+
+def perceptual_hash(image: Image.Image) -> int:
+    """64-bit pHash: signs of the low-frequency DCT coefficients of a 32x32 grayscale page."""
+    pixels = np.asarray(image.convert("L").resize((32, 32), Image.LANCZOS), dtype=np.float32)
+    low = dctn(pixels, norm="ortho")[:8, :8].flatten()
+    bits = low > np.median(low[1:])
+    return int("".join("1" if b else "0" for b in bits), 2)
+
+
+def _offset(mask: np.ndarray, other: np.ndarray):
+    """(dy, dx) that moves other onto mask, by phase correlation."""
+    cross = np.fft.rfft2(mask.astype(np.float32)) * np.conj(np.fft.rfft2(other.astype(np.float32)))
+    cross /= np.abs(cross) + 1e-9
+    peak = np.fft.irfft2(cross, s=mask.shape)
+    height, width = peak.shape
+    y, x = np.unravel_index(int(np.argmax(peak)), peak.shape)
+    return int(y - height if y > height // 2 else y), int(x - width if x > width // 2 else x)
+
+
+def _shift(mask: np.ndarray, dy: int, dx: int) -> np.ndarray:
+    """mask moved by (dy, dx); pixels moved in from outside are blank."""
+    moved = np.zeros_like(mask)
+    height, width = mask.shape
+    moved[max(dy, 0):height + min(dy, 0), max(dx, 0):width + min(dx, 0)] = \
+        mask[max(-dy, 0):height - max(dy, 0), max(-dx, 0):width - max(dx, 0)]
+    return moved
+
+
+def pixel_difference(mask: np.ndarray, other: np.ndarray):
+    """
+    Ink on one page that the other lacks, allowing _JITTER_PIXELS of jitter,
+    once other is aligned onto mask as a whole and then block by block.
+
+    Returns:
+        (fraction of pixels that differ, differing pixels in the worst block);
+        pages of different shapes differ completely
+    """
+    if mask.shape != other.shape:
+        return 1.0, mask.size
+    other = _shift(other, *_offset(mask, other))
+    near = np.ones((2 * _JITTER_PIXELS + 1,) * 2, dtype=bool)
+    side, reach = _BLOCK_SIDE, _MAX_BLOCK_SHIFT
+    height, width = mask.shape
+    rows, cols = -(-height // side), -(-width // side)
+
+    def padded(pixels, margin):
+        out = np.zeros((rows * side + 2 * margin, cols * side + 2 * margin), dtype=bool)
+        out[margin:margin + height, margin:margin + width] = pixels
+        return out
+
+    ink, ink_near = padded(mask, 0), padded(ndimage.binary_dilation(mask, near), 0)
+    other_ink, other_near = padded(other, reach), padded(ndimage.binary_dilation(other, near), reach)
+    best = None
+    # Smallest shifts first: most blocks of a duplicate match without moving
+    for dy, dx in sorted(((dy, dx) for dy in range(-reach, reach + 1) for dx in range(-reach, reach + 1)),
+                         key=lambda s: abs(s[0]) + abs(s[1])):
+        window = (slice(reach - dy, reach - dy + rows * side), slice(reach - dx, reach - dx + cols * side))
+        missing = (ink & ~other_near[window]) | (other_ink[window] & ~ink_near)
+        cost = np.count_nonzero(missing.reshape(rows, side, cols, side), axis=(1, 3))
+        best = cost if best is None else np.minimum(best, cost)
+        if not best.any():
+            break
+    return float(best.sum()) / mask.size, int(best.max())
+
+
+class PageClassifier:
+    """
+    Flags blank and duplicate pages of one document before OCR.
+
+    Pages are classified in the order they are seen; a duplicate refers to the
+    first earlier content page it matches.
+    """
+
+    def __init__(self):
+        self._seen: List[Dict] = []
+
+    def classify(self, page_number: int, image: Image.Image) -> Dict:
+        """
+        Returns:
+            {"status": "content" | "blank" | "duplicate", "ink_coverage", "duplicate_of"}
+        """
+        mask = _ink_mask(_thumbnail(image))
+        coverage = float(np.mean(mask))
+        marks = count_marks(mask)
+        if marks <= BLANK_MAX_MARKS:
+            logger.info(f"Page {page_number} is blank ({marks} ink marks, ink coverage {coverage:.4f})")
+            return {"status": "blank", "ink_coverage": round(coverage, 4), "duplicate_of": None}
+
+        page_hash = perceptual_hash(image)
+        candidates = sorted(((bin(page_hash ^ earlier["hash"]).count("1"), -i, earlier)
+                             for i, earlier in enumerate(self._seen)), key=lambda c: c[:2])
+        candidates = [(distance, earlier) for distance, _, earlier in candidates
+                      if distance <= DUPLICATE_HASH_DISTANCE][:_MAX_COMPARISONS]
+        detail = _ink_mask(_thumbnail(image, _COMPARE_SIDE))
+        for distance, earlier in candidates:
+            difference, worst_block = pixel_difference(detail, np.unpackbits(earlier["mask"], count=earlier["size"])
+                                                   .reshape(earlier["shape"]).astype(bool))
+            if difference <= DUPLICATE_PIXEL_DIFFERENCE and worst_block < DUPLICATE_MAX_MARK_PIXELS:
+                logger.info(f"Page {page_number} duplicates page {earlier['page']} (pHash distance {distance}, "
+                            f"pixel difference {difference:.5f}, worst block {worst_block} px)")
+                return {"status": "duplicate", "ink_coverage": round(coverage, 4), "duplicate_of": earlier["page"]}
+
+        # Masks are kept bit-packed: one per content page for the rest of the document
+        self._seen.append({"page": page_number, "hash": page_hash, "mask": np.packbits(detail),
+                           "shape": detail.shape, "size": detail.size})
+        return {"status": "content", "ink_coverage": round(coverage, 4), "duplicate_of": None}
+
+
+def classify_pages(images: List[Image.Image], page_numbers: Optional[List[int]] = None) -> Dict[int, Dict]:
+    """Classify every page of a document: {page_number: classification}."""
+    classifier = PageClassifier()
+    page_numbers = page_numbers or list(range(1, len(images) + 1))
+    return {page: classifier.classify(page, image) for page, image in zip(page_numbers, images)}
@@ -4,16 +4,20 @@ from scipy import ndimage
 import math
 
 
-def check_image_quality(image_path):
+def check_image_quality(image_path, image=None):
     """
     Enhanced image quality check with robust blur detection
     Uses only cv2, numpy, and scipy
+    'image' (PIL) checks an already decoded page, e.g. a TIFF frame, instead of reading image_path
     """
     suggestions = []
     score = 100  # start with perfect score, subtract for issues
 
     # Read the image
-    img = cv2.imread(image_path)
+    if image is not None:
+        img = cv2.cvtColor(np.asarray(image.convert("RGB")), cv2.COLOR_RGB2BGR)
+    else:
+        img = cv2.imread(image_path)
     if img is None:
         return {"score": 0, "suggestions": ["Invalid image file. Please upload a valid image."]}
 
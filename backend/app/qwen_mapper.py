@@ -0,0 +1,469 @@
+import os
+import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    from .field_validation import validate_field
+except ImportError:  # imported as a top-level module by python3 app/mappingfinal.py
+    from field_validation import validate_field
+
+# Fixed instructions sent as the system prompt. They never change between calls,
+# so Ollama can reuse the KV-cache for this prefix; the field skeleton comes next
+# (stable for a given field list) and the OCR text goes last.
+MAPPER_INSTRUCTIONS = """You extract information from OCR text of scanned forms.
+Return ONLY a JSON object with exactly the field names you are given (no other text or keys).
+Copy values as they appear in the text. Use an empty string for fields that are not present."""
+
+
+# Whitespace-only chunks tolerated after the object closes before generation is cut off
+_TRAILING_CHUNKS = 2
+
+
+def _parse_keep_alive(value: str):
+    """Ollama accepts a duration string ("30m") or a number of seconds (-1 keeps the model loaded forever)."""
+    value = value.strip()
+    return int(value) if value.lstrip("-").isdigit() else value
+
+
+class QwenFieldMapper:
+    def __init__(self, model_name="qwen2.5:1.5b"):
+        """
+        Uses an Ollama model that is already pulled locally.
+        Example: ollama pull qwen2.5:1.5b
+        """
+        self.model_name = model_name
+        # One mapper instance per Ollama runtime; point OLLAMA_URL at this instance's runtime
+        self.api_url = f"{os.getenv('OLLAMA_URL', 'http://localhost:11434').rstrip('/')}/api/generate"
+        # Pooled keep-alive connections to the runtime, sized for concurrent generations
+        pool_size = int(os.getenv("MAPPER_POOL_SIZE", "8"))
+        self.session = requests.Session()
+        self.session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+        self.session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+        self.timeout = float(os.getenv("OLLAMA_TIMEOUT", "120"))
+        self.keep_alive = _parse_keep_alive(os.getenv("OLLAMA_KEEP_ALIVE", "-1"))
+        # Output cap: the skeleton's braces plus a bounded value per field
+        self.tokens_per_field = int(os.getenv("MAPPER_TOKENS_PER_FIELD", "48"))
+        self.base_tokens = int(os.getenv("MAPPER_BASE_TOKENS", "16"))
+        # Field lists longer than shard_size are split into groups generated
+        # concurrently over the same text (0 disables sharding). Ollama only runs
+        # OLLAMA_NUM_PARALLEL generations at once, so keep shard_concurrency in step.
+        self.shard_size = int(os.getenv("MAPPER_SHARD_SIZE", "0"))
+        self.shard_concurrency = int(os.getenv("MAPPER_SHARD_CONCURRENCY", "4"))
+        # Created up front (its threads only start on first use): a pool built on
+        # first use raced when the first sharded calls came in together
+        self._shard_pool = ThreadPoolExecutor(max_workers=max(1, self.shard_concurrency),
+                                              thread_name_prefix="mapper-shard")
+        print(f"Using Ollama model (offline): {self.model_name}")
+
+    def warmup(self):
+        """Load the model into memory now and keep it resident (a generate call without a prompt only loads)."""
+        try:
+            self.session.post(self.api_url, json={"model": self.model_name, "keep_alive": self.keep_alive}, timeout=300)
+        except Exception as e:
+            print("Model warmup failed:", e)
+
+    def build_prompt(self, ocr_text: str, required_fields: list[str]) -> str:
+        # Build JSON skeleton
+        skeleton = "{\n"
+        skeleton += ",\n".join([f'  "{field}": ""' for field in required_fields])
+        skeleton += "\n}"
+
+        return f"""Return only this JSON format:
+{skeleton}
+
+Text: {ocr_text}
+"""
+
+    def extract_fields(self, ocr_text: str, required_fields: list[str]) -> dict:
+        """
+        Extract the given required_fields from ocr_text and return only JSON 
+        with those exact keys.
+        """
+        try:
+            fields, _ = self.extract_fields_timed(ocr_text, required_fields)
+            return fields
+        except Exception as e:
+            print("Error communicating with Ollama:", e)
+            return {field: "" for field in required_fields}
+
+    def extract_fields_timed(self, ocr_text: str, required_fields: list[str]) -> tuple[dict, dict]:
+        """
+        Like extract_fields, but also returns Ollama's timings (milliseconds and
+        token counts) and raises on communication errors.
+
+        Output is constrained to a JSON schema built from required_fields and
+        streamed. Once the top-level object closes, the closing "done" chunk
+        (with the timings) is read and the connection reused; generation is cut
+        off only if more tokens follow.
+        Wide field lists are sharded (see shard_fields) when shard_size is set.
+        """
+        shards = self.shard_fields(required_fields)
+        if len(shards) == 1:
+            return self._generate(ocr_text, required_fields)
+        return self._extract_sharded(ocr_text, required_fields, shards)
+
+    def shard_fields(self, required_fields: list[str]) -> list[list[str]]:
+        """Split the field list into contiguous groups of at most shard_size, as even as possible."""
+        if self.shard_size <= 0 or len(required_fields) <= self.shard_size:
+            return [list(required_fields)]
+        count = -(-len(required_fields) // self.shard_size)
+        size, extra = divmod(len(required_fields), count)
+        shards, start = [], 0
+        for i in range(count):
+            end = start + size + (1 if i < extra else 0)
+            shards.append(list(required_fields[start:end]))
+            start = end
+        return shards
+
+    def _extract_sharded(self, ocr_text: str, required_fields: list[str], shards: list[list[str]]) -> tuple[dict, dict]:
+        """
+        Generate every shard concurrently and merge in required_fields order.
+
+        A failed shard leaves its fields empty (listed in timings["shard_errors"]);
+        the call only raises when every shard failed.
+        """
+        start = time.perf_counter()
+        futures = [self._shard_pool.submit(self._generate, ocr_text, shard) for shard in shards]
+
+        merged = {}
+        shard_timings = []
+        errors = []
+        for future in futures:
+            try:
+                fields, timings = future.result()
+            except Exception as e:
+                fields, timings = {}, None
+                errors.append(e)
+            merged.update(fields)
+            if timings:
+                shard_timings.append(timings)
+        if len(errors) == len(shards):
+            raise errors[0]
+
+        timings = {"total_ms": round((time.perf_counter() - start) * 1000, 1)}
+        for key in ("load_ms", "prompt_eval_ms", "eval_ms", "prompt_tokens", "generated_tokens"):
+            values = [t[key] for t in shard_timings if t.get(key) is not None]
+            timings[key] = round(sum(values), 1) if values else None
+        timings["early_stop"] = any(t.get("early_stop") for t in shard_timings)
+        timings["shards"] = len(shards)
+        timings["shard_errors"] = [str(e) for e in errors]
+        return {field: merged.get(field, "") for field in required_fields}, timings
+
+    def _generate(self, ocr_text: str, required_fields: list[str]) -> tuple[dict, dict]:
+        """One streamed, schema-constrained generation for required_fields."""
+        payload = {
+            "model": self.model_name,
+            "system": MAPPER_INSTRUCTIONS,
+            "prompt": self.build_prompt(ocr_text, required_fields),
+            "format": self.build_schema(required_fields),
+            "stream": True,
+            "keep_alive": self.keep_alive,
+            "options": {
+                "temperature": 0,
+                "repeat_penalty": 1.1,
+                "top_p" : 1,
+                "num_predict": self.base_tokens + self.tokens_per_field * len(required_fields)
+            }
+        }
+
+        start = time.perf_counter()
+        scanner = _JsonObjectScanner()
+        tokens = 0
+        trailing = 0
+        final = {}
+        with self.session.post(self.api_url, json=payload, timeout=self.timeout, stream=True) as response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                chunk = json.loads(line)
+                if chunk.get("error"):
+                    raise RuntimeError(chunk["error"])
+                if chunk.get("done"):
+                    # Read to the end of the body so the connection goes back to the pool
+                    final = chunk
+                    continue
+                tokens += 1
+                if scanner.complete is not None:
+                    trailing += 1
+                    if chunk.get("response", "").strip() or trailing > _TRAILING_CHUNKS:
+                        # Still generating after the object closed: leaving the with-block
+                        # closes the connection, which makes Ollama stop
+                        break
+                    continue
+                scanner.feed(chunk.get("response", ""))
+
+        text = scanner.complete if scanner.complete is not None else scanner.text
+        timings = self._timings(final) if final else {
+            "total_ms": round((time.perf_counter() - start) * 1000, 1),
+            "load_ms": None,
+            "prompt_eval_ms": None,
+            "eval_ms": None,
+            "prompt_tokens": None,
+            "generated_tokens": tokens,
+        }
+        timings["early_stop"] = not final
+        return self._extract_strict_json(text, required_fields), timings
+
+    @staticmethod
+    def build_schema(required_fields: list[str]) -> dict:
+        """JSON schema for Ollama's structured output: exactly the requested keys, all strings."""
+        return {
+            "type": "object",
+            "properties": {field: {"type": "string"} for field in required_fields},
+            "required": list(required_fields),
+        }
+
+    @staticmethod
+    def _timings(data: dict) -> dict:
+        """Convert Ollama's nanosecond durations to milliseconds."""
+        ns = lambda key: round(data.get(key, 0) / 1e6, 1)
+        return {
+            "total_ms": ns("total_duration"),
+            "load_ms": ns("load_duration"),
+            "prompt_eval_ms": ns("prompt_eval_duration"),
+            "eval_ms": ns("eval_duration"),
+            "prompt_tokens": data.get("prompt_eval_count", 0),
+            "generated_tokens": data.get("eval_count", 0),
+        }
+
+    def _extract_strict_json(self, text: str, required_fields: list[str]) -> dict:
+        """
+        Decodes the first JSON object in text (nested values and braces inside
+        strings included) and returns exactly the required fields.
+        """
+        result = {field: "" for field in required_fields}
+
+        clean_text = text.replace("```json", "").replace("```", "")
+        start = clean_text.find("{")
+        if start < 0:
+            return result
+        try:
+            parsed_json, _ = json.JSONDecoder().raw_decode(clean_text[start:])
+        except json.JSONDecodeError:
+            return result
+        if not isinstance(parsed_json, dict):
+            return result
+
+        for key in required_fields:
+            value = parsed_json.get(key)
+            if value is None:
+                continue
+            result[key] = value if isinstance(value, str) else json.dumps(value, ensure_ascii=False)
+        return result
+
+
+class TieredFieldMapper:
+    """
+    Cascade of mapper models, smallest first.
+
+    Every field goes to the first tier. Fields that come back empty or fail
+    validate_field (bad date, malformed email, impossible age, ...) escalate to
+    the next tier in a prompt that lists only those fields; the last tier's
+    non-empty answer is kept even if it does not validate. (The rule engine in
+    field_mapping runs before any of this, so it is effectively tier 0.)
+
+    Per-tier usage and latency are kept for tuning; see stats().
+    """
+
+    def __init__(self, model_names: list[str], validator=validate_field):
+        if not model_names:
+            raise ValueError("At least one mapper model is required")
+        self.tiers = [QwenFieldMapper(name) for name in model_names]
+        self.validator = validator
+        self._stats = {
+            mapper.model_name: {"calls": 0, "errors": 0, "fields_requested": 0, "fields_accepted": 0, "total_ms": 0.0}
+            for mapper in self.tiers
+        }
+        self._lock = threading.Lock()
+
+    @property
+    def model_name(self) -> str:
+        return " > ".join(mapper.model_name for mapper in self.tiers)
+
+    def warmup(self):
+        for mapper in self.tiers:
+            mapper.warmup()
+
+    def extract_fields(self, ocr_text: str, required_fields: list[str]) -> dict:
+        try:
+            fields, _ = self.extract_fields_timed(ocr_text, required_fields)
+            return fields
+        except Exception as e:
+            print("Error communicating with Ollama:", e)
+            return {field: "" for field in required_fields}
+
+    def extract_fields_timed(self, ocr_text: str, required_fields: list[str]) -> tuple[dict, dict]:
+        """
+        Run the cascade; returns (fields, timings).
+
+        timings sums Ollama's timings over the tiers that ran and lists each one
+        under "tiers". Raises only if every tier that was tried failed.
+        """
+        result = {field: "" for field in required_fields}
+        pending = list(required_fields)
+        tier_timings = []
+        last_error = None
+        for mapper in self.tiers:
+            if not pending:
+                break
+            start = time.perf_counter()
+            try:
+                mapped, timings = mapper.extract_fields_timed(ocr_text, pending)
+            except Exception as e:
+                last_error = e
+                self._record(mapper.model_name, len(pending), 0, time.perf_counter() - start, error=True)
+                tier_timings.append({"model": mapper.model_name, "fields": len(pending), "accepted": 0, "error": str(e)})
+                continue
+
+            accepted = [field for field in pending if self.validator(field, mapped.get(field))]
+            for field in pending:
+                if mapped.get(field):
+                    result[field] = mapped[field]
+            self._record(mapper.model_name, len(pending), len(accepted), time.perf_counter() - start)
+            tier_timings.append({"model": mapper.model_name, "fields": len(pending), "accepted": len(accepted), **timings})
+            pending = [field for field in pending if field not in accepted]
+
+        if last_error is not None and all("error" in t for t in tier_timings):
+            raise last_error
+        return result, self._combine_timings(tier_timings)
+
+    @staticmethod
+    def _combine_timings(tier_timings: list[dict]) -> dict:
+        combined = {"tiers": tier_timings}
+        for key in ("total_ms", "load_ms", "prompt_eval_ms", "eval_ms", "prompt_tokens", "generated_tokens"):
+            values = [t[key] for t in tier_timings if t.get(key) is not None]
+            combined[key] = round(sum(values), 1) if values else None
+        combined["early_stop"] = any(t.get("early_stop") for t in tier_timings)
+        return combined
+
+    def _record(self, model: str, requested: int, accepted: int, seconds: float, error: bool = False):
+        with self._lock:
+            stats = self._stats[model]
+            stats["calls"] += 1
+            stats["errors"] += int(error)
+            stats["fields_requested"] += requested
+            stats["fields_accepted"] += accepted
+            stats["total_ms"] += seconds * 1000
+
+    def stats(self) -> list[dict]:
+        """Per-tier calls, errors, field acceptance rate and mean latency, in cascade order."""
+        with self._lock:
+            return [
+                {
+                    "model": model,
+                    "calls": s["calls"],
+                    "errors": s["errors"],
+                    "fields_requested": s["fields_requested"],
+                    "fields_accepted": s["fields_accepted"],
+                    "accept_rate": round(s["fields_accepted"] / s["fields_requested"], 3) if s["fields_requested"] else None,
+                    "avg_latency_ms": round(s["total_ms"] / s["calls"], 1) if s["calls"] else None,
+                }
+                for model, s in self._stats.items()
+            ]
+
+
+def model_tiers() -> list[str]:
+    """Mapper models from MAPPER_MODEL_TIERS (comma-separated, smallest first), else the single MAPPER_MODEL."""
+    tiers = [name.strip() for name in os.getenv("MAPPER_MODEL_TIERS", "").split(",") if name.strip()]
+    return tiers or [os.getenv("MAPPER_MODEL", "qwen2.5:1.5b")]
+
+
+class _JsonObjectScanner:
+    """
+    Incrementally tracks streamed text until the first top-level JSON object closes.
+
+    Braces inside strings (and escaped quotes) are ignored, so values such as
+    "Flat {3B}" do not end the object early.
+    """
+
+    def __init__(self):
+        self._parts = []
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._start = None
+        self._length = 0
+        self.complete = None
+
+    @property
+    def text(self) -> str:
+        return "".join(self._parts)
+
+    def feed(self, chunk: str):
+        """Add streamed text; returns the object text once it is complete, else None."""
+        if self.complete is not None or not chunk:
+            return self.complete
+        self._parts.append(chunk)
+        for offset, ch in enumerate(chunk):
+            position = self._length + offset
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"' and self._start is not None:
+                self._in_string = True
+            elif ch == "{":
+                if self._start is None:
+                    self._start = position
+                self._depth += 1
+            elif ch == "}" and self._start is not None:
+                self._depth -= 1
+                if self._depth == 0:
+                    self.complete = self.text[self._start:position + 1]
+                    break
+        self._length += len(chunk)
+        return self.complete
+
+
+def server_timing_header(timings: dict) -> str:
+    """Render mapper timings (plus one entry per cascade tier) as a Server-Timing header value."""
+    entries = [
+        f"{name};dur={timings[key]}"
+        for name, key in (("load", "load_ms"), ("prompt_eval", "prompt_eval_ms"), ("eval", "eval_ms"), ("total", "total_ms"))
+        if timings.get(key) is not None
+    ]
+    for i, tier in enumerate(timings.get("tiers", [])):
+        entry = f'tier{i};desc="{tier["model"]} {tier["accepted"]}/{tier["fields"]}"'
+        if tier.get("total_ms") is not None:
+            entry += f";dur={tier['total_ms']}"
+        entries.append(entry)
+    return ", ".join(entries)
+
+
+def run_batch(mapper: QwenFieldMapper, items: list[tuple[str, list[str]]], concurrency: int) -> list[dict]:
+    """
+    Map many (text, fields) items over at most `concurrency` concurrent generations.
+
+    Results come back in input order, each with its own error, latency and
+    Ollama timings, so one bad item does not fail the batch.
+    """
+    def run_item(index: int, item: tuple[str, list[str]]) -> dict:
+        text, fields = item
+        start = time.perf_counter()
+        try:
+            mapped, timings = mapper.extract_fields_timed(text, fields)
+            error = None
+        except Exception as e:
+            mapped, timings = {field: "" for field in fields}, None
+            error = str(e)
+        return {
+            "index": index,
+            "fields": mapped,
+            "error": error,
+            "latency_ms": round((time.perf_counter() - start) * 1000, 1),
+            "timings": timings,
+        }
+
+    if not items:
+        return []
+    with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(items)))) as pool:
+        return list(pool.map(run_item, range(len(items)), items))
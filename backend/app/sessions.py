@@ -0,0 +1,256 @@
+import os
+import time
+import uuid
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+
+from PIL import Image
+
+from .utils import is_pdf_file, is_multipage_file, get_page_count, load_page
+
+logger = logging.getLogger(__name__)
+
+# Sessions idle for longer than this are dropped
+SESSION_TTL_SECONDS = float(os.getenv("SESSION_TTL_SECONDS", "1800"))
+# Upper bound on the bytes, rasters and OCR results held by all sessions together;
+# least recently used sessions are evicted beyond it
+SESSION_MEMORY_BUDGET = int(float(os.getenv("SESSION_MEMORY_BUDGET_MB", "512")) * 1024 * 1024)
+SESSION_DIR = os.getenv("SESSION_DIR", os.path.join("uploads", "sessions"))
+# /extract results kept for /verify, by count and age
+EXTRACTION_CACHE_SIZE = int(os.getenv("EXTRACTION_CACHE_SIZE", "256"))
+EXTRACTION_TTL_SECONDS = float(os.getenv("EXTRACTION_TTL_SECONDS", str(SESSION_TTL_SECONDS)))
+
+# Rough in-memory size of one OCR detection (text, box, polygon, floats)
+_DETECTION_BYTES = 600
+
+
+def _result_size(result) -> int:
+    if isinstance(result, dict):
+        return 1024 + _DETECTION_BYTES * len(result.get("detections") or result.get("texts") or [])
+    return 1024
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class DocumentSession:
+    """
+    An uploaded document kept for reuse across endpoints.
+
+    The bytes live in a file under SESSION_DIR (the extractors take paths);
+    page rasters and per-language OCR results are computed once and cached.
+    """
+
+    def __init__(self, document_id: str, filename: str, path: str, size: int):
+        self.id = document_id
+        self.filename = filename
+        self.path = path
+        self.file_size = size
+        self.is_pdf = is_pdf_file(filename)
+        self.is_multipage = is_multipage_file(filename)
+        self.created_at = time.time()
+        self.last_access = time.monotonic()
+        self._rasters: Dict[tuple, Image.Image] = {}
+        self._results: Dict[tuple, object] = {}
+        self._sizes: Dict[tuple, int] = {}
+        self._lock = threading.RLock()
+
+    @property
+    def size_bytes(self) -> int:
+        return self.file_size + sum(self._sizes.values())
+
+    def _memo(self, store: Dict, key: tuple, compute: Callable, size: Callable):
+        with self._lock:
+            if key in store:
+                return store[key]
+        # Compute outside the lock; a concurrent duplicate only costs time
+        value = compute()
+        with self._lock:
+            store.setdefault(key, value)
+            self._sizes[key] = size(store[key])
+            return store[key]
+
+    def sha256(self) -> str:
+        return self._memo(self._results, ("sha256",), lambda: file_sha256(self.path), lambda _: 64)
+
+    def page_count(self) -> int:
+        if not self.is_multipage:
+            return 1
+        return self._memo(self._results, ("page_count",), lambda: get_page_count(self.path), lambda _: 64)
+
+    def page_image(self, page_number: int = 1, dpi: int = 200) -> Image.Image:
+        """
+        Raster of a page (the image itself for image uploads), cached per page and dpi.
+        TIFF frames keep their own mode, so bilevel fax pages are cached at a third of the RGB size.
+        """
+        page = page_number if self.is_multipage else 1
+        return self._memo(self._rasters, ("raster", page, dpi), lambda: load_page(self.path, page, dpi),
+                          lambda image: image.width * image.height * len(image.getbands()))
+
+    def cached(self, kind: str, key: tuple, compute: Callable):
+        """Cache any per-document result (OCR, quality report, ...) under (kind, *key); error results are not kept."""
+        value = self._memo(self._results, (kind, *key), compute, _result_size)
+        if isinstance(value, dict) and "error" in value:
+            with self._lock:
+                self._results.pop((kind, *key), None)
+                self._sizes.pop((kind, *key), None)
+        return value
+
+    def peek(self, kind: str, key: tuple):
+        """A cached result if present, without computing it."""
+        with self._lock:
+            return self._results.get((kind, *key))
+
+    def entries(self, kind: str) -> List[tuple]:
+        """Every cached (key, result) of one kind, e.g. all field mappings of the document."""
+        with self._lock:
+            return [(key[1:], value) for key, value in self._results.items() if key[0] == kind]
+
+    def info(self) -> Dict:
+        with self._lock:
+            return {
+                "document_id": self.id,
+                "filename": self.filename,
+                "is_pdf": self.is_pdf,
+                "size_bytes": self.size_bytes,
+                "cached_pages": sorted({key[1] for key in self._rasters}),
+                "cached_results": [list(key) for key in self._results if key[0] not in ("page_count", "sha256")],
+                "expires_in": round(max(0.0, SESSION_TTL_SECONDS - (time.monotonic() - self.last_access)), 1),
+            }
+
+    def close(self):
+        with self._lock:
+            self._rasters.clear()
+            self._results.clear()
+            self._sizes.clear()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class SessionStore:
+    """Document sessions with TTL expiry and LRU eviction beyond a memory budget."""
+
+    def __init__(self, ttl_seconds: float = SESSION_TTL_SECONDS, memory_budget: int = SESSION_MEMORY_BUDGET):
+        self.ttl_seconds = ttl_seconds
+        self.memory_budget = memory_budget
+        self._sessions: "OrderedDict[str, DocumentSession]" = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(SESSION_DIR, exist_ok=True)
+
+    def create(self, filename: str, data: bytes) -> DocumentSession:
+        document_id = uuid.uuid4().hex
+        path = os.path.join(SESSION_DIR, f"{document_id}_{os.path.basename(filename or 'document')}")
+        with open(path, "wb") as f:
+            f.write(data)
+        session = DocumentSession(document_id, filename or "document", path, len(data))
+        with self._lock:
+            self._sessions[document_id] = session
+        self.evict()
+        logger.info(f"Created document session {document_id} for {filename} ({len(data)} bytes)")
+        return session
+
+    def get(self, document_id: str) -> Optional[DocumentSession]:
+        """The session, marked as used; None if unknown or expired."""
+        self.evict()
+        with self._lock:
+            session = self._sessions.get(document_id)
+            if session is not None:
+                session.last_access = time.monotonic()
+                self._sessions.move_to_end(document_id)
+            return session
+
+    def delete(self, document_id: str) -> bool:
+        with self._lock:
+            session = self._sessions.pop(document_id, None)
+        if session is None:
+            return False
+        session.close()
+        return True
+
+    def evict(self):
+        """Drop expired sessions, then least recently used ones while over the memory budget."""
+        now = time.monotonic()
+        evicted = []
+        with self._lock:
+            for document_id, session in list(self._sessions.items()):
+                if now - session.last_access > self.ttl_seconds:
+                    evicted.append(self._sessions.pop(document_id))
+            total = sum(s.size_bytes for s in self._sessions.values())
+            # Never evict the most recently used session to make room for itself
+            while total > self.memory_budget and len(self._sessions) > 1:
+                _, session = self._sessions.popitem(last=False)
+                total -= session.size_bytes
+                evicted.append(session)
+        for session in evicted:
+            logger.info(f"Evicted document session {session.id}")
+            session.close()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "sessions": len(self._sessions),
+                "size_bytes": sum(s.size_bytes for s in self._sessions.values()),
+                "memory_budget": self.memory_budget,
+                "ttl_seconds": self.ttl_seconds,
+            }
+
+
+class ExtractionStore:
+    """
+    Recent /extract results, so /verify can compare against them without OCR.
+
+    Entries are keyed by an extraction_id and remember the document's sha256, so
+    a result is only reused for the same bytes.
+    """
+
+    def __init__(self, max_entries: int = EXTRACTION_CACHE_SIZE, ttl_seconds: float = EXTRACTION_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, Dict]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def put(self, mapped_fields: Dict, language: str, page_number: int, sha256: str,
+            fields: Optional[list] = None, document_id: Optional[str] = None) -> str:
+        extraction_id = uuid.uuid4().hex
+        entry = {
+            "extraction_id": extraction_id,
+            "mapped_fields": mapped_fields,
+            "fields": list(fields or []),
+            "language": language,
+            "page_number": page_number,
+            "sha256": sha256,
+            "document_id": document_id,
+            "created": time.monotonic(),
+        }
+        with self._lock:
+            self._entries[extraction_id] = entry
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return extraction_id
+
+    def get(self, extraction_id: str) -> Optional[Dict]:
+        """The entry, or None if unknown or older than ttl_seconds."""
+        with self._lock:
+            entry = self._entries.get(extraction_id)
+            if entry is None:
+                return None
+            if time.monotonic() - entry["created"] > self.ttl_seconds:
+                del self._entries[extraction_id]
+                return None
+            return entry
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {"entries": len(self._entries), "max_entries": self.max_entries, "ttl_seconds": self.ttl_seconds}
+
+
+store = SessionStore()
+extractions = ExtractionStore()
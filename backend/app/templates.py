@@ -0,0 +1,319 @@
+import os
+import json
+import logging
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from .label_scanner import resolve_field, fold_text
+from .layout import reading_order_lines
+from .region_ocr import ocr_regions, parse_region
+
+logger = logging.getLogger(__name__)
+
+# Registered templates are persisted here (JSON) and reloaded on startup
+TEMPLATES_PATH = os.getenv("TEMPLATES_PATH", "templates.json")
+# Maximum Hamming distance between page and template fingerprints (256-bit dHash;
+# templates registered with the older 64-bit hash are held to the same fraction of bits)
+TEMPLATE_MATCH_DISTANCE = int(os.getenv("TEMPLATE_MATCH_DISTANCE", "24"))
+# Anchor search windows are widened by this fraction of the page size on every side
+TEMPLATE_ANCHOR_MARGIN = float(os.getenv("TEMPLATE_ANCHOR_MARGIN", "0.03"))
+# Found anchors must all be displaced alike (one scan offset), within this fraction of the page size
+TEMPLATE_SHIFT_TOLERANCE = float(os.getenv("TEMPLATE_SHIFT_TOLERANCE", "0.01"))
+
+# Side of the dHash grid: 16x16 = 256 bits
+_FINGERPRINT_SIDE = 16
+
+_templates: Dict[str, Dict] = {}
+_lock = threading.Lock()
+
+
+# ----------------------------
+# Fingerprints
+# ----------------------------
+def page_fingerprint(image: Image.Image, side: int = _FINGERPRINT_SIDE) -> int:
+    """side x side-bit difference hash of the page: cheap, stable across scan noise, fine enough to tell layouts apart."""
+    pixels = np.asarray(image.convert("L").resize((side + 1, side), Image.BILINEAR), dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+    return int("".join("1" if b else "0" for b in bits), 2)
+
+
+def _fingerprint_side(fingerprint_hex: str) -> int:
+    """Grid side of a stored fingerprint (8 for templates registered with the 64-bit hash)."""
+    return int(round((len(fingerprint_hex) * 4) ** 0.5))
+
+
+def fingerprint_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+# ----------------------------
+# Registry
+# ----------------------------
+def _save():
+    with open(TEMPLATES_PATH, "w", encoding="utf-8") as f:
+        json.dump(list(_templates.values()), f, ensure_ascii=False, indent=2)
+
+
+def _load():
+    if not os.path.exists(TEMPLATES_PATH):
+        return
+    try:
+        with open(TEMPLATES_PATH, encoding="utf-8") as f:
+            for template in json.load(f):
+                _templates[template["name"]] = template
+        logger.info(f"Loaded {len(_templates)} form templates from {TEMPLATES_PATH}")
+    except Exception as e:
+        logger.error(f"Could not load form templates from {TEMPLATES_PATH}: {e}")
+
+
+def _box(value, what: str) -> List[float]:
+    try:
+        x1, y1, x2, y2 = (float(v) for v in value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{what} must be [x1, y1, x2, y2]")
+    if x2 <= x1 or y2 <= y1:
+        raise ValueError(f"{what} is empty")
+    return [x1, y1, x2, y2]
+
+
+def register_template(definition: Dict, reference: Image.Image) -> Dict:
+    """
+    Register (or replace) a form template.
+
+    Args:
+        definition: {"name", "anchors": {anchor_id: {"text", "bbox"}},
+                     "fields": {field: {"anchor": anchor_id, "zone": [x1, y1, x2, y2]}}}
+                    with boxes in pixels of the reference page
+        reference: Blank or sample page of the form, used for its fingerprint and size
+
+    Returns:
+        The stored template (zones are kept relative to their anchor box)
+
+    Raises:
+        ValueError: If the definition is incomplete or inconsistent
+    """
+    name = str(definition.get("name", "")).strip()
+    if not name:
+        raise ValueError("Template name is required")
+    anchors = definition.get("anchors") or {}
+    fields = definition.get("fields") or {}
+    if not anchors or not fields:
+        raise ValueError("A template needs at least one anchor and one field")
+
+    stored_anchors = {}
+    for anchor_id, anchor in anchors.items():
+        text = str(anchor.get("text", "")).strip()
+        if not text:
+            raise ValueError(f"Anchor '{anchor_id}' has no text")
+        stored_anchors[anchor_id] = {"text": text, "bbox": _box(anchor.get("bbox"), f"Anchor '{anchor_id}' bbox")}
+
+    stored_fields = {}
+    for field, spec in fields.items():
+        anchor_id = spec.get("anchor")
+        if anchor_id not in stored_anchors:
+            raise ValueError(f"Field '{field}' refers to unknown anchor '{anchor_id}'")
+        zone = _box(spec.get("zone"), f"Field '{field}' zone")
+        ax1, ay1 = stored_anchors[anchor_id]["bbox"][:2]
+        stored_fields[field] = {"anchor": anchor_id, "offset": [zone[0] - ax1, zone[1] - ay1, zone[2] - ax1, zone[3] - ay1]}
+
+    template = {
+        "name": name,
+        "fingerprint": f"{page_fingerprint(reference):0{_FINGERPRINT_SIDE ** 2 // 4}x}",
+        "page_size": [reference.width, reference.height],
+        "anchors": stored_anchors,
+        "fields": stored_fields,
+    }
+    with _lock:
+        _templates[name] = template
+        _save()
+    logger.info(f"Registered form template '{name}' with {len(stored_fields)} fields")
+    return template
+
+
+def delete_template(name: str) -> bool:
+    with _lock:
+        if _templates.pop(name, None) is None:
+            return False
+        _save()
+    return True
+
+
+def list_templates() -> List[Dict]:
+    with _lock:
+        return [
+            {"name": t["name"], "fingerprint": t["fingerprint"], "page_size": t["page_size"], "fields": list(t["fields"])}
+            for t in _templates.values()
+        ]
+
+
+def has_templates() -> bool:
+    return bool(_templates)
+
+
+def match_template(image: Image.Image) -> Tuple[Optional[Dict], Optional[int]]:
+    """Closest registered template within TEMPLATE_MATCH_DISTANCE and of similar aspect ratio; (None, None) if none."""
+    with _lock:
+        candidates = list(_templates.values())
+    if not candidates:
+        return None, None
+
+    fingerprints = {}
+    aspect = image.width / image.height
+    best, best_distance, best_fraction = None, None, None
+    for template in candidates:
+        width, height = template["page_size"]
+        if abs(width / height - aspect) > 0.05 * aspect:
+            continue
+        side = _fingerprint_side(template["fingerprint"])
+        if side not in fingerprints:
+            fingerprints[side] = page_fingerprint(image, side)
+        distance = fingerprint_distance(fingerprints[side], int(template["fingerprint"], 16))
+        fraction = distance / side ** 2
+        if fraction <= TEMPLATE_MATCH_DISTANCE / _FINGERPRINT_SIDE ** 2 and (best_fraction is None or fraction < best_fraction):
+            best, best_distance, best_fraction = template, distance, fraction
+    return best, best_distance
+
+
+# ----------------------------
+# Zone extraction
+# ----------------------------
+def _field_keys(template: Dict, fields: Optional[List[str]]) -> Optional[Dict[str, str]]:
+    """Requested key -> template field, or None if the template does not cover every requested field."""
+    if not fields:
+        return {field: field for field in template["fields"]}
+    by_canonical = {resolve_field(field) or field: field for field in template["fields"]}
+    keys = {}
+    for key in fields:
+        field = key if key in template["fields"] else by_canonical.get(resolve_field(key) or key)
+        if field is None:
+            return None
+        keys[key] = field
+    return keys
+
+
+def _inside(detection: Dict, zone: List[float]) -> bool:
+    b = detection["bbox"]
+    cx, cy = (b["x1"] + b["x2"]) / 2, (b["y1"] + b["y2"]) / 2
+    return zone[0] <= cx <= zone[2] and zone[1] <= cy <= zone[3]
+
+
+def extract_with_template(engine, image: Image.Image, template: Dict,
+                          fields: Optional[List[str]] = None) -> Optional[Dict]:
+    """
+    Recognize only the field zones of a matched template.
+
+    Each anchor's search window (the anchor plus its zones, widened by
+    TEMPLATE_ANCHOR_MARGIN) is OCR'd in a single batch. The anchor label is
+    located in its window and its displacement from the template position
+    shifts that anchor's zones, which absorbs scan offsets. Every anchor must
+    be found, displaced alike, before the zones are trusted.
+
+    Args:
+        engine: PHOCR engine of the document's language
+        image: Page image
+        template: Template from match_template
+        fields: Requested field keys (default: every template field)
+
+    Returns:
+        {"fields": {key: {"value", "confidence", "source": "template"}}, "ocr": region OCR
+        result, "anchors_found", "anchors_total"}; None when the template does
+        not cover the requested fields, an anchor is missing or the anchors
+        are displaced inconsistently, i.e. the fingerprint matched a different
+        form (caller falls back to full-page extraction)
+    """
+    keys = _field_keys(template, fields)
+    if keys is None:
+        logger.info(f"Template '{template['name']}' does not cover the requested fields; using full-page extraction")
+        return None
+
+    sx = image.width / template["page_size"][0]
+    sy = image.height / template["page_size"][1]
+    scale = lambda box: [box[0] * sx, box[1] * sy, box[2] * sx, box[3] * sy]
+    margin_x, margin_y = TEMPLATE_ANCHOR_MARGIN * image.width, TEMPLATE_ANCHOR_MARGIN * image.height
+
+    needed = {template["fields"][field]["anchor"] for field in keys.values()}
+    anchor_ids = [a for a in template["anchors"] if a in needed]
+    expected, zones, windows = {}, {}, []
+    for anchor_id in anchor_ids:
+        expected[anchor_id] = scale(template["anchors"][anchor_id]["bbox"])
+        ax1, ay1 = expected[anchor_id][:2]
+        boxes = [expected[anchor_id]]
+        for field, spec in template["fields"].items():
+            if spec["anchor"] == anchor_id:
+                off = spec["offset"]
+                zones[field] = [ax1 + off[0] * sx, ay1 + off[1] * sy, ax1 + off[2] * sx, ay1 + off[3] * sy]
+                boxes.append(zones[field])
+        window = [min(b[0] for b in boxes) - margin_x, min(b[1] for b in boxes) - margin_y,
+                  max(b[2] for b in boxes) + margin_x, max(b[3] for b in boxes) + margin_y]
+        windows.append(parse_region(window, image.width, image.height))
+
+    ocr = ocr_regions(engine, image, windows)
+
+    anchor_detections = {}
+    shifts = {}
+    for index, anchor_id in enumerate(anchor_ids):
+        label = fold_text(template["anchors"][anchor_id]["text"])
+        exp = expected[anchor_id]
+        found = [d for d in ocr["detections"] if d["region"] == index and label in fold_text(d["text"])]
+        if found:
+            best = min(found, key=lambda d: abs(d["bbox"]["x1"] - exp[0]) + abs(d["bbox"]["y1"] - exp[1]))
+            anchor_detections[anchor_id] = best
+            shifts[anchor_id] = (best["bbox"]["x1"] - exp[0], best["bbox"]["y1"] - exp[1])
+    if len(anchor_detections) < len(anchor_ids):
+        logger.warning(f"Template '{template['name']}' false match: found {len(anchor_detections)}/{len(anchor_ids)} "
+                       f"anchors; using full-page extraction")
+        return None
+    if shifts:
+        spread_x = max(dx for dx, _ in shifts.values()) - min(dx for dx, _ in shifts.values())
+        spread_y = max(dy for _, dy in shifts.values()) - min(dy for _, dy in shifts.values())
+        if spread_x > TEMPLATE_SHIFT_TOLERANCE * image.width or spread_y > TEMPLATE_SHIFT_TOLERANCE * image.height:
+            logger.warning(f"Template '{template['name']}' false match: anchors displaced inconsistently "
+                           f"({spread_x:.0f}x{spread_y:.0f} px spread); using full-page extraction")
+            return None
+
+    mapped = {}
+    for key, field in keys.items():
+        anchor_id = template["fields"][field]["anchor"]
+        index = anchor_ids.index(anchor_id)
+        dx, dy = shifts.get(anchor_id, (0.0, 0.0))
+        zone = [zones[field][0] + dx, zones[field][1] + dy, zones[field][2] + dx, zones[field][3] + dy]
+        anchor_det = anchor_detections.get(anchor_id)
+
+        parts, scores = [], []
+        if anchor_det is not None:
+            # Label and value recognized as one box ("Name: Jane Doe")
+            text = anchor_det["text"]
+            pos = fold_text(text).find(fold_text(template["anchors"][anchor_id]["text"]))
+            rest = text[pos + len(template["anchors"][anchor_id]["text"]):].strip(" :：")
+            if rest and anchor_det["bbox"]["x2"] > zone[0]:
+                parts.append(rest)
+                scores.append(anchor_det["confidence"])
+        in_zone = [
+            {"text": d["text"], "confidence": d["confidence"],
+             "bounds": (d["bbox"]["x1"], d["bbox"]["y1"], d["bbox"]["x2"], d["bbox"]["y2"])}
+            for d in ocr["detections"]
+            if d["region"] == index and d is not anchor_det and _inside(d, zone)
+        ]
+        for line in reading_order_lines(in_zone):
+            for seg in line:
+                parts.append(seg["text"])
+                scores.append(seg["confidence"])
+        value = " ".join(parts).strip(" :：")
+        mapped[key] = {
+            "value": value or None,
+            "confidence": round(sum(scores) / len(scores), 4) if value else None,
+            "source": "template",
+        }
+
+    return {
+        "fields": mapped,
+        "ocr": ocr,
+        "anchors_found": len(anchor_detections),
+        "anchors_total": len(anchor_ids),
+    }
+
+
+_load()
@@ -0,0 +1,95 @@
+import os
+import re
+import logging
+from typing import Dict, Optional
+
+from .layout import result_segments, reading_order_lines
+
+logger = logging.getLogger(__name__)
+
+# Detections below this OCR confidence are treated as noise and not sent to the LLM
+COMPACT_MIN_CONFIDENCE = float(os.getenv("COMPACT_MIN_CONFIDENCE", "0.5"))
+# Upper bound on the (estimated) tokens of OCR text in a mapper prompt
+MAPPER_TOKEN_BUDGET = int(os.getenv("MAPPER_TOKEN_BUDGET", "1024"))
+# Only segments at least this long are deduplicated, so short values that
+# legitimately repeat ("India", "M", "Yes") are kept
+DEDUP_MIN_CHARS = int(os.getenv("COMPACT_DEDUP_MIN_CHARS", "8"))
+
+_CJK_RANGES = r'\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af'
+_TOKEN_RE = re.compile(rf'[{_CJK_RANGES}]|[^\W{_CJK_RANGES}]+|[^\w\s]')
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Rough LLM token count without a tokenizer: one per CJK character or
+    punctuation mark, and one per ~4 characters of other words.
+    """
+    return sum(1 if len(tok) == 1 else -(-len(tok) // 4) for tok in _TOKEN_RE.findall(text or ""))
+
+
+# ----------------------------
+# Compaction
+# ----------------------------
+def _dedup_key(text: str) -> str:
+    return re.sub(r'\s+', ' ', text).strip().casefold()
+
+
+def compact_text(result: Dict, min_confidence: Optional[float] = None,
+                 token_budget: Optional[int] = None) -> str:
+    """
+    Build the OCR text sent to the LLM mapper.
+
+    Rebuilds reading-order lines from the detection boxes, drops detections
+    below the confidence floor, removes repeated segments (headers, boilerplate
+    printed more than once) and truncates at a line boundary to the token budget.
+
+    Args:
+        result: Output of extract_text_with_detection (or extract_text)
+        min_confidence: Confidence floor (default: COMPACT_MIN_CONFIDENCE)
+        token_budget: Maximum estimated tokens (default: MAPPER_TOKEN_BUDGET)
+
+    Returns:
+        Newline-separated lines of OCR text ("" if the result has no text)
+    """
+    min_confidence = COMPACT_MIN_CONFIDENCE if min_confidence is None else min_confidence
+    token_budget = MAPPER_TOKEN_BUDGET if token_budget is None else token_budget
+
+    segments = [s for s in result_segments(result) if s["text"]]
+    if not segments:
+        return ""
+    before = estimate_tokens(" ".join(s["text"] for s in segments))
+
+    kept = [s for s in segments if s["confidence"] is None or s["confidence"] >= min_confidence]
+    # Never hand the LLM nothing just because the whole page scored low
+    if not kept:
+        kept = segments
+
+    seen = set()
+    lines = []
+    for line in reading_order_lines(kept):
+        texts = []
+        for seg in line:
+            key = _dedup_key(seg["text"])
+            if len(key) >= DEDUP_MIN_CHARS:
+                if key in seen:
+                    continue
+                seen.add(key)
+            texts.append(seg["text"])
+        if texts:
+            lines.append(" ".join(texts))
+
+    out, used = [], 0
+    for line in lines:
+        tokens = estimate_tokens(line)
+        if used + tokens > token_budget:
+            if not out:
+                # A single line over budget: keep its leading part
+                out.append(line[:max(1, len(line) * token_budget // max(tokens, 1))])
+            break
+        out.append(line)
+        used += tokens
+    text = "\n".join(out)
+
+    logger.info(f"Compacted OCR text for mapping: {before} -> {estimate_tokens(text)} tokens "
+                f"({len(segments)} -> {len(kept)} segments, {len(lines)} lines, {len(out)} kept)")
+    return text
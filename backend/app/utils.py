@@ -155,6 +155,130 @@ def is_pdf_file(file_path):
     return file_path.lower().endswith('.pdf')
 
 
+def is_tiff_file(file_path):
+    """
+    Check if file is a TIFF (fax-style scans are often multi-page TIFFs)
+    
+    Args:
+        file_path: Path to file
+        
+    Returns:
+        bool: True if TIFF file
+    """
+    return file_path.lower().endswith(('.tif', '.tiff'))
+
+
+def is_multipage_file(file_path):
+    """True for documents with pages (PDF or TIFF)."""
+    return is_pdf_file(file_path) or is_tiff_file(file_path)
+
+
+def get_tiff_frame_count(tiff_path):
+    """
+    Get number of frames (pages) in a TIFF without decoding them
+    
+    Args:
+        tiff_path: Path to TIFF file
+        
+    Returns:
+        int: Number of frames
+    """
+    with Image.open(tiff_path) as img:
+        return getattr(img, "n_frames", 1)
+
+
+def load_tiff_frame(tiff_path, page_number=1):
+    """
+    Decode a single TIFF frame
+    
+    Only the requested frame is decoded, and it keeps its own mode: bilevel
+    fax pages stay mode '1' (a third of the memory of RGB) until OCR converts them.
+    
+    Args:
+        tiff_path: Path to TIFF file
+        page_number: Frame to decode (1-indexed)
+        
+    Returns:
+        PIL Image
+    """
+    with Image.open(tiff_path) as img:
+        try:
+            img.seek(page_number - 1)
+        except EOFError:
+            raise ValueError(f"TIFF has no page {page_number}")
+        frame = img.copy()
+    return frame
+
+
+def iter_tiff_frames(tiff_path):
+    """
+    Yield (page_number, frame) for every TIFF frame, decoding one frame at a time
+    
+    Args:
+        tiff_path: Path to TIFF file
+        
+    Yields:
+        (int, PIL Image) in the frame's own mode
+    """
+    with Image.open(tiff_path) as img:
+        for index in range(getattr(img, "n_frames", 1)):
+            img.seek(index)
+            yield index + 1, img.copy()
+
+
+def get_page_count(file_path):
+    """Number of pages of a PDF, TIFF or image file (1 for single images)."""
+    if is_pdf_file(file_path):
+        return get_pdf_page_count(file_path)
+    if is_tiff_file(file_path):
+        return get_tiff_frame_count(file_path)
+    return 1
+
+
+def get_page_pixels(file_path, dpi=200):
+    """
+    Pixel count of a file's first page once decoded (PDF pages at dpi), read
+    from the file header without rasterizing or decoding anything
+    
+    Args:
+        file_path: Path to file
+        dpi: Resolution PDF pages would be rasterized at
+        
+    Returns:
+        int: Width x height in pixels
+    """
+    if is_pdf_file(file_path):
+        try:
+            from PyPDF2 import PdfReader
+            box = PdfReader(file_path).pages[0].mediabox
+            return int(float(box.width) * dpi / 72) * int(float(box.height) * dpi / 72)
+        except Exception as e:
+            logger.warning(f"Could not read PDF page size: {e}; assuming US Letter")
+            return int(8.5 * dpi) * int(11 * dpi)
+    with Image.open(file_path) as img:
+        return img.width * img.height
+
+
+def load_page(file_path, page_number=1, dpi=200):
+    """
+    Load one page of a PDF (rasterized at dpi), TIFF (that frame, in its own mode)
+    or image file (converted to RGB)
+    
+    Args:
+        file_path: Path to file
+        page_number: Page number (1-indexed)
+        dpi: Resolution for PDF rasterization
+        
+    Returns:
+        PIL Image
+    """
+    if is_pdf_file(file_path):
+        return convert_pdf_to_image(file_path, page_number=page_number, dpi=dpi)
+    if is_tiff_file(file_path):
+        return load_tiff_frame(file_path, page_number)
+    return Image.open(file_path).convert("RGB")
+
+
 def save_image_temporarily(image, suffix='.jpg', quality=95):
     """
     Save PIL Image to temporary file
@@ -1,129 +1,230 @@
-from difflib import SequenceMatcher
+import logging
+
+import numpy as np
+from rapidfuzz import process
+from rapidfuzz.distance import Indel
+
 from app.extraction import map_fields, extract_text, extract_text_with_detection
+from app.label_scanner import resolve_field
+
+logger = logging.getLogger(__name__)
+
+# Submitted and extracted keys must be at least this similar before their values are compared
+KEY_MATCH_THRESHOLD = 0.6
+# Below this best value score, an exact key match is tried as a fallback
+EXACT_KEY_FALLBACK_BELOW = 0.3
+# Below this the field counts as not found
+NOT_FOUND_BELOW = 0.1
+# Field status thresholds
+MATCH_THRESHOLD = 0.8
+PARTIAL_MATCH_THRESHOLD = 0.5
+
+
+def _normalize(text) -> str:
+    return str(text).lower().strip()
+
 
 def similarity(a: str, b: str) -> float:
     """
     Return similarity score between two strings (case-insensitive).
-    Uses difflib.SequenceMatcher ratio.
+    RapidFuzz's normalized Indel similarity: close to difflib's ratio, but not
+    identical for every input (difflib's junk heuristics are not applied).
     """
     if not a or not b:
         return 0.0
-    return SequenceMatcher(None, str(a).lower().strip(), str(b).lower().strip()).ratio()
+    return Indel.normalized_similarity(_normalize(a), _normalize(b))
+
+
+def field_key(key) -> str:
+    """Canonical field of a key or label ("Full Name", "姓名" -> "name"); unknown keys normalized as they are."""
+    return resolve_field(key) or _normalize(key)
+
+
+def verification_fields(submitted_data: dict) -> list:
+    """
+    Field keys to map for a verification: the submitted keys that carry a value,
+    lowercased, one per canonical field.
+    """
+    fields, seen = [], set()
+    for key, value in submitted_data.items():
+        if not value or not str(value).strip():
+            continue
+        canonical = field_key(key)
+        if canonical not in seen:
+            seen.add(canonical)
+            fields.append(_normalize(key))
+    return fields
+
+
+def covers_fields(mapped_fields: dict, fields: list) -> bool:
+    """True if mapped_fields (any key naming) has an entry for every field, so no new mapping is needed."""
+    available = {field_key(key) for key in mapped_fields}
+    return all(field_key(field) in available for field in fields)
+
+
+def similarity_matrix(queries: list, choices: list) -> np.ndarray:
+    """Pairwise similarity of every query against every choice (len(queries) x len(choices), 0..1)."""
+    if not queries or not choices:
+        return np.zeros((len(queries), len(choices)))
+    return process.cdist(
+        [_normalize(q) for q in queries], [_normalize(c) for c in choices],
+        scorer=Indel.normalized_similarity, dtype=np.float32, workers=-1,
+    ).astype(float)
+
+
+def extract_fields_for_verification(file_path: str, fields: list = None) -> dict:
+    """Run OCR and map the given fields (English engine) for a document that has no cached extraction."""
+    ocr_result = extract_text(file_path)
+
+    if fields:
+        return map_fields(ocr_result, custom_fields=fields)
+    return map_fields(ocr_result)
+
+
+def flatten_mapped_fields(mapped_fields: dict) -> dict:
+    """
+    Mapped fields as {lowercased field: value} for non-empty values; accepts both
+    plain values and the {"value", "confidence"} shape of the CJK mappers.
+    """
+    extracted_fields = {}
+    for field_name, field_data in mapped_fields.items():
+        if isinstance(field_data, dict) and 'value' in field_data:
+            # Extract the actual value from the nested structure
+            field_value = field_data.get('value')
+            if field_value is not None and str(field_value).strip():
+                extracted_fields[field_name.lower()] = str(field_value).strip()
+        elif field_data is not None and str(field_data).strip():
+            # Handle direct value (fallback case)
+            extracted_fields[field_name.lower()] = str(field_data).strip()
+    return extracted_fields
+
 
 def verify_fields(submitted_data: dict, file_path: str, custom_fields: list = None) -> dict:
     """
-    FIXED VERSION - Compare submitted form data with extracted fields from the scanned document.
+    Compare submitted form data with extracted fields from the scanned document.
     Returns field-by-field verification with confidence score.
 
     Args:
         submitted_data (dict): Form data submitted by the user (format: {"Name": "ananya"}).
         file_path (str): Path to the scanned document/image.
-        custom_fields (list): List of field names to verify (optional).
+        custom_fields (list): Only used when submitted_data names no fields (optional).
 
     Returns:
         dict: Verification results per field with match status and confidence.
     """
     try:
-        # Run OCR and extract structured fields
-        ocr_result = extract_text(file_path)
+        # Only the submitted fields are mapped; the rest would be generated and thrown away
+        fields = verification_fields(submitted_data) or custom_fields
+        mapped_fields = extract_fields_for_verification(file_path, fields)
+    except Exception as e:
+        logger.error(f"Error in verification: {e}")
+        return _error_result(e)
+    return verify_mapped_fields(submitted_data, mapped_fields, custom_fields)
+
 
-        # Use custom fields if provided for mapping
-        if custom_fields:
-            mapped_fields = map_fields(ocr_result, custom_fields=custom_fields)
+def _error_result(e: Exception) -> dict:
+    return {
+        "overall_status": "error",
+        "overall_confidence": 0.0,
+        "field_results": {},
+        "error": str(e),
+        "total_fields_checked": 0,
+        "extracted_text_available": False
+    }
+
+
+def match_fields(submitted: dict, extracted_fields: dict) -> dict:
+    """
+    Best extracted value for every submitted field.
+
+    Key and value similarities are computed as two score matrices in one batch
+    each. Keys that resolve to the same canonical field ("date of birth" and
+    "dob") count as identical: a cached mapping that covers_fields accepted for
+    a submitted key may name the field differently. A submitted field takes the best-scoring value
+    among extracted keys more than KEY_MATCH_THRESHOLD similar to its own key;
+    when that scores below EXACT_KEY_FALLBACK_BELOW, an identically named
+    extracted field is tried.
+
+    Args:
+        submitted: {lowercased key: stripped non-empty value}
+        extracted_fields: Output of flatten_mapped_fields
+
+    Returns:
+        Dict of submitted key -> per-field verification result
+    """
+    submitted_keys = list(submitted)
+    extracted_keys = list(extracted_fields)
+    key_scores = similarity_matrix(submitted_keys, extracted_keys)
+    if submitted_keys and extracted_keys:
+        same_field = (np.array([field_key(k) for k in submitted_keys], dtype=object)[:, None]
+                      == np.array([field_key(k) for k in extracted_keys], dtype=object)[None, :])
+        key_scores = np.where(same_field, 1.0, key_scores)
+    value_scores = similarity_matrix([submitted[k] for k in submitted_keys],
+                                     [extracted_fields[k] for k in extracted_keys])
+    candidates = np.where(key_scores > KEY_MATCH_THRESHOLD, value_scores, 0.0)
+    column = {key: j for j, key in enumerate(extracted_keys)}
+
+    results = {}
+    for i, submitted_key in enumerate(submitted_keys):
+        best_similarity, matched_field_name = 0.0, None
+        if extracted_keys:
+            j = int(np.argmax(candidates[i]))
+            if candidates[i, j] > 0:
+                best_similarity, matched_field_name = float(candidates[i, j]), extracted_keys[j]
+
+        if best_similarity < EXACT_KEY_FALLBACK_BELOW and submitted_key in column:
+            exact = float(value_scores[i, column[submitted_key]])
+            if exact > best_similarity:
+                best_similarity, matched_field_name = exact, submitted_key
+
+        if best_similarity < NOT_FOUND_BELOW:
+            best_match, best_similarity = "Not found in document", 0.0
         else:
-            mapped_fields = map_fields(ocr_result)
+            best_match = extracted_fields[matched_field_name]
 
-        print(f"OCR mapped fields: {mapped_fields}")
+        if best_similarity >= MATCH_THRESHOLD:
+            status = "match"
+        elif best_similarity >= PARTIAL_MATCH_THRESHOLD:
+            status = "partial_match"
+        else:
+            status = "no_match"
+
+        results[submitted_key] = {
+            "submitted_value": submitted[submitted_key],
+            "extracted_value": best_match,
+            "similarity_score": round(best_similarity, 3),
+            "status": status,
+            "confidence": round(best_similarity * 100, 1),
+            "matched_field": matched_field_name  # For debugging
+        }
+    return results
 
-        # CRITICAL FIX: Extract values correctly from the nested structure
-        extracted_fields = {}
-        for field_name, field_data in mapped_fields.items():
-            if isinstance(field_data, dict) and 'value' in field_data:
-                # Extract the actual value from the nested structure
-                field_value = field_data.get('value')
-                if field_value is not None and str(field_value).strip():
-                    extracted_fields[field_name.lower()] = str(field_value).strip()
-            elif field_data is not None and str(field_data).strip():
-                # Handle direct value (fallback case)
-                extracted_fields[field_name.lower()] = str(field_data).strip()
 
-        print(f"Extracted fields for verification: {extracted_fields}")
+def verify_mapped_fields(submitted_data: dict, mapped_fields: dict, custom_fields: list = None) -> dict:
+    """
+    Compare submitted form data with already mapped fields (from /extract or a
+    document session), without running OCR.
 
-        # Normalize submitted data keys to lowercase for comparison
+    Args:
+        submitted_data (dict): Form data submitted by the user.
+        mapped_fields (dict): map_fields output (plain values or {"value", "confidence"}).
+        custom_fields (list): List of field names to verify (optional).
+
+    Returns:
+        dict: Verification results per field with match status and confidence.
+    """
+    try:
+        extracted_fields = flatten_mapped_fields(mapped_fields)
+
+        # Normalize submitted data keys to lowercase for comparison; empty values are not checked
         normalized_submitted = {k.lower(): v for k, v in submitted_data.items()}
-        print(f"Normalized submitted data: {normalized_submitted}")
-
-        verification_results = {}
-
-        # FIXED LOGIC: More robust field matching
-        for submitted_key, submitted_value in normalized_submitted.items():
-            if not submitted_value or not str(submitted_value).strip():
-                continue
-
-            submitted_clean = str(submitted_value).strip()
-            best_match = None
-            best_similarity = 0.0
-            matched_field_name = None
-
-            print(f"\nProcessing field: '{submitted_key}' = '{submitted_clean}'")
-
-            # IMPROVED: Find the best matching extracted field with better logic
-            for extracted_key, extracted_value in extracted_fields.items():
-                # Check key similarity first
-                key_similarity = similarity(submitted_key, extracted_key)
-                print(f"  Key match: '{submitted_key}' vs '{extracted_key}' = {key_similarity:.3f}")
-
-                if key_similarity > 0.6:  # Keys are similar enough
-                    value_similarity = similarity(submitted_clean, extracted_value)
-                    print(f"    Value match: '{submitted_clean}' vs '{extracted_value}' = {value_similarity:.3f}")
-
-                    if value_similarity > best_similarity:
-                        best_similarity = value_similarity
-                        best_match = extracted_value
-                        matched_field_name = extracted_key
-                        print(f"    -> NEW BEST MATCH via key similarity: {best_match} (score: {best_similarity:.3f})")
-
-            # FIXED: Only do fallback matching if no good key match found AND with stricter criteria
-            if best_similarity < 0.3:  # Much stricter threshold
-                print(f"  No good key match found (best: {best_similarity:.3f}). Checking for exact field name match...")
-
-                # Look for exact field name match (case insensitive)
-                if submitted_key in extracted_fields:
-                    exact_match_value = extracted_fields[submitted_key]
-                    value_similarity = similarity(submitted_clean, exact_match_value)
-                    print(f"  Exact key match found: '{submitted_key}' -> '{exact_match_value}' (similarity: {value_similarity:.3f})")
-
-                    if value_similarity > best_similarity:
-                        best_similarity = value_similarity
-                        best_match = exact_match_value
-                        matched_field_name = submitted_key
-
-                # REMOVED: The problematic "check all values" loop that was causing incorrect matches
-
-            # If still no good match, mark as not found
-            if best_similarity < 0.1:  # Very low threshold for "not found"
-                best_match = "Not found in document"
-                best_similarity = 0.0
-                print(f"  -> FINAL RESULT: Field not found in document")
-            else:
-                print(f"  -> FINAL RESULT: Matched to '{matched_field_name}': '{best_match}' (score: {best_similarity:.3f})")
-
-            # Determine verification status
-            if best_similarity >= 0.8:
-                status = "match"
-            elif best_similarity >= 0.5:
-                status = "partial_match"
-            else:
-                status = "no_match"
-
-            verification_results[submitted_key] = {
-                "submitted_value": submitted_clean,
-                "extracted_value": best_match or "Not found",
-                "similarity_score": round(best_similarity, 3),
-                "status": status,
-                "confidence": round(best_similarity * 100, 1),
-                "matched_field": matched_field_name  # For debugging
-            }
+        submitted = {
+            key: str(value).strip()
+            for key, value in normalized_submitted.items()
+            if value and str(value).strip()
+        }
+
+        verification_results = match_fields(submitted, extracted_fields)
 
         # Overall verification score
         if verification_results:
@@ -133,7 +234,9 @@ def verify_fields(submitted_data: dict, file_path: str, custom_fields: list = No
             avg_similarity = 0.0
             overall_status = "no_data"
 
-        final_result = {
+        logger.info(f"Verified {len(verification_results)} fields against {len(extracted_fields)} extracted: "
+                    f"{overall_status} ({avg_similarity:.3f})")
+        return {
             "overall_status": overall_status,
             "overall_confidence": round(avg_similarity * 100, 1),
             "field_results": verification_results,
@@ -146,16 +249,6 @@ def verify_fields(submitted_data: dict, file_path: str, custom_fields: list = No
             }
         }
 
-        print(f"Final verification result: {final_result}")
-        return final_result
-
     except Exception as e:
-        print(f"Error in verification: {e}")
-        return {
-            "overall_status": "error",
-            "overall_confidence": 0.0,
-            "field_results": {},
-            "error": str(e),
-            "total_fields_checked": 0,
-            "extracted_text_available": False
-        }
+        logger.error(f"Error in verification: {e}")
+        return _error_result(e)
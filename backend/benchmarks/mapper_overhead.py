@@ -0,0 +1,107 @@
+"""
+Per-call overhead of the mapping service HTTP hop versus the in-process mapper.
+
+Both paths talk to the same stub model runtime, which answers instantly, so the
+difference between them is the cost of the extra service: request/response
+serialization, the localhost round trip and FastAPI routing.
+
+Run from the backend/ folder:
+
+    python -m benchmarks.mapper_overhead --calls 200
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+FIELDS = ["name", "age", "gender", "dob", "address", "country", "phone", "email", "id_number"]
+OCR_TEXT = ("Full Name: Jane Doe Age: 34 Gender: Female Date of Birth: 12/03/1990 "
+            "Address: 12 Park Street, Springfield Country: India Phone: +91 98765 43210 "
+            "Email: jane.doe@example.com ID Number: P1234567")
+
+
+def _free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class _StubOllama(BaseHTTPRequestHandler):
+    """Streams a fixed JSON object the way /api/generate does."""
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        fields = request.get("format", {}).get("required", FIELDS)
+        chunks = [
+            json.dumps({"response": json.dumps({field: "x" for field in fields}), "done": False}),
+            json.dumps({"response": "", "done": True, "total_duration": 1_000_000, "eval_count": 1}),
+        ]
+        body = ("\n".join(chunks) + "\n").encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def _serve(server):
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+
+def _time_calls(fn, calls: int) -> list:
+    fn()  # warm connections
+    samples = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--calls", type=int, default=200)
+    args = parser.parse_args()
+
+    ollama_port = _free_port()
+    _serve(ThreadingHTTPServer(("127.0.0.1", ollama_port), _StubOllama))
+
+    mapper_port = _free_port()
+    os.environ["OLLAMA_URL"] = f"http://127.0.0.1:{ollama_port}"
+    os.environ["MAPPER_ENDPOINTS"] = f"http://127.0.0.1:{mapper_port}"
+    os.environ["MAPPER_HEALTH_INTERVAL"] = "0"
+
+    import uvicorn
+    from app import mapper_client
+    from app.mappingfinal import app as mapping_app
+
+    server = uvicorn.Server(uvicorn.Config(mapping_app, host="127.0.0.1", port=mapper_port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+
+    results = {
+        "http (mapping service)": _time_calls(lambda: mapper_client.map_fields_via_api(OCR_TEXT, FIELDS), args.calls),
+        "inprocess": _time_calls(lambda: mapper_client._extract_inprocess(OCR_TEXT, FIELDS), args.calls),
+    }
+
+    print(f"{'mode':<24}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}")
+    for mode, samples in results.items():
+        p95 = statistics.quantiles(samples, n=20)[-1]
+        print(f"{mode:<24}{statistics.mean(samples):>10.2f}{statistics.median(samples):>10.2f}{p95:>10.2f}")
+    overhead = statistics.mean(results["http (mapping service)"]) - statistics.mean(results["inprocess"])
+    print(f"\nHTTP hop overhead removed by in-process mode: {overhead:.2f} ms per call")
+    server.should_exit = True
+
+
+if __name__ == "__main__":
+    main()
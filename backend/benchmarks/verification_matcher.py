@@ -0,0 +1,81 @@
+"""
+Verification matcher: RapidFuzz score matrices versus the former per-pair difflib loop.
+
+Both match the same synthetic submission against the same extracted fields with
+the same thresholds; the loop below is the previous implementation without its
+debug printing (which made it slower still).
+
+Run from the backend/ folder:
+
+    python -m benchmarks.verification_matcher --fields 200 --rounds 5
+"""
+import argparse
+import random
+import string
+import time
+from difflib import SequenceMatcher
+
+from app.verification import match_fields
+
+
+def _difflib_similarity(a: str, b: str) -> float:
+    if not a or not b:
+        return 0.0
+    return SequenceMatcher(None, str(a).lower().strip(), str(b).lower().strip()).ratio()
+
+
+def nested_loop_match(submitted: dict, extracted_fields: dict) -> dict:
+    results = {}
+    for submitted_key, submitted_value in submitted.items():
+        best_match, best_similarity, matched = None, 0.0, None
+        for extracted_key, extracted_value in extracted_fields.items():
+            if _difflib_similarity(submitted_key, extracted_key) > 0.6:
+                value_similarity = _difflib_similarity(submitted_value, extracted_value)
+                if value_similarity > best_similarity:
+                    best_match, best_similarity, matched = extracted_value, value_similarity, extracted_key
+        if best_similarity < 0.3 and submitted_key in extracted_fields:
+            value_similarity = _difflib_similarity(submitted_value, extracted_fields[submitted_key])
+            if value_similarity > best_similarity:
+                best_match, best_similarity, matched = extracted_fields[submitted_key], value_similarity, submitted_key
+        results[submitted_key] = {"extracted_value": best_match, "similarity_score": round(best_similarity, 3),
+                                  "matched_field": matched}
+    return results
+
+
+def _word(rng: random.Random, length: int) -> str:
+    return "".join(rng.choice(string.ascii_lowercase) for _ in range(length))
+
+
+def make_case(fields: int, seed: int = 7):
+    rng = random.Random(seed)
+    extracted = {f"{_word(rng, 6)}_{i}": " ".join(_word(rng, rng.randint(3, 9)) for _ in range(3)) for i in range(fields)}
+    submitted = {}
+    for key, value in extracted.items():
+        # Submitted values with a typo or two, as typed into a form
+        chars = list(value)
+        for _ in range(rng.randint(0, 2)):
+            chars[rng.randrange(len(chars))] = rng.choice(string.ascii_lowercase)
+        submitted[key] = "".join(chars)
+    return submitted, extracted
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fields", type=int, default=200)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    submitted, extracted = make_case(args.fields)
+    timings = {}
+    for name, matcher in (("difflib loop", nested_loop_match), ("rapidfuzz cdist", match_fields)):
+        start = time.perf_counter()
+        for _ in range(args.rounds):
+            result = matcher(submitted, extracted)
+        timings[name] = (time.perf_counter() - start) / args.rounds * 1000
+        matched = sum(1 for r in result.values() if r["similarity_score"] >= 0.8)
+        print(f"{name:16s} {timings[name]:9.1f} ms per submission  ({matched}/{len(result)} matched)")
+    print(f"speedup          {timings['difflib loop'] / timings['rapidfuzz cdist']:9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
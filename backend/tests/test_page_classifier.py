@@ -0,0 +1,79 @@
+import numpy as np
+from PIL import Image, ImageDraw
+
+from app.page_classifier import PageClassifier
+
+# US Letter at 200 dpi
+PAGE_SIZE = (1700, 2200)
+
+
+def _form(values=(), lines=20, seed=0):
+    """A printed form: rows of glyph-sized blocks (labels and rules), plus filled-in values."""
+    rng = np.random.RandomState(seed)
+    page = Image.new("L", PAGE_SIZE, 255)
+    draw = ImageDraw.Draw(page)
+    for row in range(lines):
+        y = 200 + row * 80
+        x = 150
+        for _ in range(rng.randint(4, 9)):
+            width = rng.randint(14, 26)
+            draw.rectangle([x, y, x + width, y + 30], fill=0)
+            x += width + 8
+        draw.line([700, y + 34, 1500, y + 34], fill=0, width=3)
+    for row, value in values:
+        y = 200 + row * 80
+        for i, ch in enumerate(value):
+            x = 720 + i * 28
+            # One stroke pattern per character, so different values leave different ink
+            code = ord(ch)
+            draw.rectangle([x, y, x + 4, y + 28], fill=0)
+            draw.rectangle([x, y + (code % 5) * 6, x + 18, y + (code % 5) * 6 + 4], fill=0)
+            if code % 2:
+                draw.rectangle([x + 14, y, x + 18, y + 28], fill=0)
+    return page.convert("RGB")
+
+
+def _rescan(page, dx=0, dy=0, degrees=0.0):
+    moved = page.transform(page.size, Image.AFFINE, (1, 0, -dx, 0, 1, -dy), fillcolor="white")
+    return moved.rotate(degrees, resample=Image.BILINEAR, fillcolor="white") if degrees else moved
+
+
+def _status(first, second):
+    classifier = PageClassifier()
+    classifier.classify(1, first)
+    return classifier.classify(2, second)
+
+
+def test_single_line_page_is_not_blank():
+    page = Image.new("RGB", PAGE_SIZE, "white")
+    draw = ImageDraw.Draw(page)
+    for x in range(150, 700, 30):
+        draw.rectangle([x, 1000, x + 20, 1030], fill="black")
+    assert PageClassifier().classify(1, page)["status"] == "content"
+
+
+def test_empty_page_is_blank():
+    assert PageClassifier().classify(1, Image.new("RGB", PAGE_SIZE, "white"))["status"] == "blank"
+
+
+def test_exact_copy_is_duplicate():
+    page = _form([(0, "JOHN SMITH")])
+    assert _status(page, page.copy()) == {"status": "duplicate", "ink_coverage": _status(page, page)["ink_coverage"],
+                                          "duplicate_of": 1}
+
+
+def test_shifted_rescan_is_duplicate():
+    page = _form([(0, "JOHN SMITH")])
+    assert _status(page, _rescan(page, dx=3, dy=3))["status"] == "duplicate"
+
+
+def test_skewed_rescan_is_duplicate():
+    page = _form([(0, "JOHN SMITH")])
+    assert _status(page, _rescan(page, dx=5, dy=-4, degrees=0.3))["status"] == "duplicate"
+
+
+def test_filled_copies_of_one_form_are_kept():
+    first = _form([(0, "JOHN SMITH"), (2, "12/03/1990")])
+    assert _status(first, _form([(0, "MARIA LOPEZ"), (2, "07/11/1985")]))["status"] == "content"
+    assert _status(first, _form([(0, "JOHN SMITH")]))["status"] == "content"
+    assert _status(first, _rescan(_form([(0, "MARIA LOPEZ"), (2, "07/11/1985")]), dx=3, degrees=0.3))["status"] == "content"
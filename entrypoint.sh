@@ -17,25 +17,52 @@ if ! pgrep -x "ollama" > /dev/null; then
     sleep 5
 fi
 
-# Pull model if missing
-if ! ollama list models | grep -q "qwen2.5:1.5b"; then
-    echo "Pulling qwen2.5:1.5b..."
-    ollama pull qwen2.5:1.5b
-fi
+# Pull the mapper models if missing (every tier of MAPPER_MODEL_TIERS, else MAPPER_MODEL)
+MODELS="${MAPPER_MODEL_TIERS:-${MAPPER_MODEL:-qwen2.5:1.5b}}"
+for MODEL in ${MODELS//,/ }; do
+    if ! ollama list models | grep -q "$MODEL"; then
+        echo "Pulling $MODEL..."
+        ollama pull "$MODEL"
+    fi
+done
 
-echo "Ollama is ready with qwen2.5:1.5b."
+echo "Ollama is ready with $MODELS."
 
-# Start mappingfinal.py in background (detached)
-echo "Starting mappingfinal.py..."
-nohup python3 app/mappingfinal.py > /app/mapping.log 2>&1 &
+if [ "${MAPPER_MODE:-http}" = "inprocess" ]; then
+    # The OCR API runs the mapper itself and talks to Ollama directly
+    echo "MAPPER_MODE=inprocess: not starting mappingfinal.py"
+else
+    # MAPPER_PORT=0 (free port) is resolved here, so the health check below knows where to look
+    MAPPER_PORT="${MAPPER_PORT:-8001}"
+    if [ "$MAPPER_PORT" = "0" ]; then
+        MAPPER_PORT=$(python3 -c 'import socket; s = socket.socket(); s.bind(("", 0)); print(s.getsockname()[1]); s.close()')
+        echo "MAPPER_PORT=0: using free port $MAPPER_PORT"
+    fi
+    export MAPPER_PORT
 
-# Wait for mappingfinal.py to be healthy
-echo "Waiting for mappingfinal.py initialization..."
-until curl -s http://127.0.0.1:8001/health | grep -q "ok"; do
-    sleep 2
-done
+    # A wildcard bind address is reached through loopback
+    MAPPER_HEALTH_HOST="${MAPPER_HOST:-127.0.0.1}"
+    if [ "$MAPPER_HEALTH_HOST" = "0.0.0.0" ] || [ "$MAPPER_HEALTH_HOST" = "::" ]; then
+        MAPPER_HEALTH_HOST=127.0.0.1
+    fi
 
-echo "mappingfinal.py is ready!"
+    # Start mappingfinal.py in background (detached)
+    echo "Starting mappingfinal.py on ${MAPPER_HOST:-127.0.0.1}:$MAPPER_PORT..."
+    nohup python3 app/mappingfinal.py > /app/mapping.log 2>&1 &
+    MAPPER_PID=$!
+
+    # Wait for mappingfinal.py to be healthy
+    echo "Waiting for mappingfinal.py initialization..."
+    until curl -s "http://$MAPPER_HEALTH_HOST:$MAPPER_PORT/health" | grep -q "ok"; do
+        if ! kill -0 "$MAPPER_PID" 2>/dev/null; then
+            echo "mappingfinal.py exited during startup; see /app/mapping.log"
+            exit 1
+        fi
+        sleep 2
+    done
+
+    echo "mappingfinal.py is ready!"
+fi
 
 # Start second FastAPI server (foreground, container main process)
 echo "Starting FastAPI app.main:app on port 8000..."